@@ -0,0 +1,35 @@
+# async_support.py
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# AsyncHandlers=1 registra las variantes async de los handlers en function_app.py
+ASYNC_HANDLERS = os.environ.get("AsyncHandlers", "0") == "1"
+# Hilos para llamadas bloqueantes (pyodbc, SDK de SMS) desde los handlers async
+BLOCKING_WORKERS = int(os.environ.get("AsyncBlockingWorkers", "32"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Executor acotado compartido por todas las llamadas bloqueantes."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=BLOCKING_WORKERS, thread_name_prefix="bloqueante")
+    return _executor
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Ejecuta una función bloqueante en el executor sin bloquear el event loop."""
+    loop = asyncio.get_running_loop()
+    # run_in_executor no propaga el contexto: se copia para que las fases medidas en el
+    # hilo (timing.span) se sumen a la solicitud que las originó
+    contexto = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), functools.partial(contexto.run, fn, *args, **kwargs))
@@ -0,0 +1,94 @@
+# auth.py
+
+import hashlib
+import logging
+import os
+import time
+
+import jwt
+
+import cache
+import esquemas
+import timing
+
+# Configuración
+JWT_SECRET = os.environ.get("JWT_SECRET", "fe85ac5165c700310f9cb9e33e748d8802129676b6c66543cf344cd4d4f501ff")
+# AuthRequired=0 vuelve a tomar el RUT del cuerpo sin token (solo para desarrollo)
+AUTH_REQUIRED = os.environ.get("AuthRequired", "1") == "1"
+# RUTs con acceso a las rutas de administración (separados por coma)
+ADMIN_RUTS = frozenset(r.strip() for r in os.environ.get("AdminRuts", "").split(",") if r.strip())
+# TokenCache=0 verifica la firma en cada solicitud
+TOKEN_CACHE = os.environ.get("TokenCache", "1") == "1"
+
+
+class TokenInvalido(Exception):
+    """El token falta, no es válido o expiró."""
+
+
+def _decodificar(token):
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+    except jwt.InvalidTokenError as e:
+        raise TokenInvalido(str(e))
+
+
+def verificar_token(token, usar_cache=None):
+    """Devuelve los claims del token. Los tokens ya verificados se sirven desde cache.tokens,
+    indexados por su SHA-256 y solo hasta su `exp`, sin repetir el HMAC ni el decode JSON."""
+    usar_cache = TOKEN_CACHE if usar_cache is None else usar_cache
+    if not usar_cache:
+        return _decodificar(token)
+
+    clave = hashlib.sha256(token.encode("utf-8")).digest()
+    claims = cache.tokens.get(clave)
+    if claims is not None:
+        return claims
+
+    claims = _decodificar(token)
+    exp = claims.get("exp")
+    if exp is not None:
+        vigencia = exp - time.time()
+        if vigencia > 0:
+            cache.tokens.set(clave, claims, ttl=vigencia)
+    return claims
+
+
+def _token_bearer(req):
+    cabecera = req.headers.get("Authorization") or req.headers.get("authorization") or ""
+    tipo, _, token = cabecera.partition(" ")
+    if tipo.lower() != "bearer" or not token.strip():
+        raise TokenInvalido("Falta el token Bearer")
+    return token.strip()
+
+
+def rut_autenticado(req, rut_cuerpo=None):
+    """Devuelve (rut, None) con el RUT tomado de los claims del token, o (None, respuesta de error).
+    Si el cuerpo trae un RUT distinto al del token la solicitud se rechaza con 403."""
+    if not AUTH_REQUIRED:
+        return rut_cuerpo, None
+
+    with timing.span("auth"):
+        try:
+            claims = verificar_token(_token_bearer(req))
+        except TokenInvalido as e:
+            logging.info(f"Token rechazado: {str(e)}")
+            return None, esquemas.error("Token inválido o expirado", 401)
+
+    rut = str(claims.get("user_id") or "")
+    if not rut:
+        return None, esquemas.error("Token inválido o expirado", 401)
+    if rut_cuerpo and str(rut_cuerpo).split("-")[0] != rut:
+        return None, esquemas.error("El RUT no corresponde al token", 403)
+    return rut, None
+
+
+def admin_autenticado(req):
+    """Como rut_autenticado, pero además exige que el RUT del token esté en AdminRuts."""
+    if not AUTH_REQUIRED:
+        return None, None
+    rut, error = rut_autenticado(req)
+    if error:
+        return None, error
+    if rut not in ADMIN_RUTS:
+        return None, esquemas.error("Acceso restringido a administradores", 403)
+    return rut, None
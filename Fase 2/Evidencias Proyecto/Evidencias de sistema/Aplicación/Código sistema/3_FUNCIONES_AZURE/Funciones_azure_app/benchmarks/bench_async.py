@@ -0,0 +1,130 @@
+# bench_async.py
+#
+# Compara el throughput de main_perfil (sync, sobre un pool de hilos del tamaño del worker
+# de Functions) contra main_perfil_async (un solo event loop) con una base de datos simulada
+# lenta. Con --tasa-fallos se inyectan errores transitorios para que los reintentos esperen:
+# en modo sync esa espera retiene un hilo, en modo async no.
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/bench_async.py --solicitudes 200 --latencia-ms 50 --hilos 4
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SqlConnectionString", "simulada")
+
+import azure.functions as func
+import pyodbc
+
+import async_support
+import cache
+import db_pool
+import perfil_chat
+
+
+class _FilaPerfil:
+    def __init__(self, rut):
+        self.NombreCompleto = "Empleado Simulado"
+        self.RUTUsuario = rut
+        self.DV = "0"
+        self.Email = f"{rut}@ejemplo.cl"
+
+
+class _CursorLento:
+    def __init__(self, latencia, tasa_fallos):
+        self.latencia = latencia
+        self.tasa_fallos = tasa_fallos
+        self._rut = None
+
+    def execute(self, sql, params=()):
+        time.sleep(self.latencia)
+        if random.random() < self.tasa_fallos:
+            raise pyodbc.Error("08S01", "Falla transitoria simulada")
+        self._rut = params[0] if params else None
+        return self
+
+    def fetchone(self):
+        return _FilaPerfil(self._rut)
+
+    def close(self):
+        pass
+
+
+class _ConexionLenta:
+    def __init__(self, latencia, tasa_fallos):
+        self.latencia = latencia
+        self.tasa_fallos = tasa_fallos
+
+    def cursor(self):
+        return _CursorLento(self.latencia, self.tasa_fallos)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _solicitud(i):
+    return func.HttpRequest(
+        method="POST",
+        url="/api/http_trigger_perfil",
+        body=json.dumps({"rut": str(10000000 + i)}).encode("utf-8"),
+    )
+
+
+def medir_sync(n, hilos):
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hilos) as executor:
+        respuestas = list(executor.map(perfil_chat.main_perfil, (_solicitud(i) for i in range(n))))
+    return time.perf_counter() - inicio, respuestas
+
+
+async def _todas_async(n):
+    return await asyncio.gather(*(perfil_chat.main_perfil_async(_solicitud(i)) for i in range(n)))
+
+
+def medir_async(n):
+    inicio = time.perf_counter()
+    respuestas = asyncio.run(_todas_async(n))
+    return time.perf_counter() - inicio, respuestas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de concurrencia: handlers sync vs async")
+    parser.add_argument("--solicitudes", type=int, default=200)
+    parser.add_argument("--latencia-ms", type=float, default=50.0)
+    parser.add_argument("--tasa-fallos", type=float, default=0.0)
+    parser.add_argument("--hilos", type=int, default=4, help="hilos del worker en modo sync")
+    parser.add_argument("--bloqueantes", type=int, default=async_support.BLOCKING_WORKERS,
+                        help="hilos del executor para llamadas bloqueantes en modo async")
+    args = parser.parse_args()
+
+    latencia = args.latencia_ms / 1000
+    async_support.BLOCKING_WORKERS = args.bloqueantes
+    db_pool._pool = db_pool.ConnectionPool(
+        "simulada", min_size=0, max_size=max(args.hilos, args.bloqueantes),
+        connect=lambda _: _ConexionLenta(latencia, args.tasa_fallos))
+    # Sin cache: cada solicitud debe llegar a la base simulada
+    cache.perfiles.ttl = 0
+
+    print(f"{'modo':>6} {'solicitudes':>11} {'segundos':>9} {'req/s':>9} {'ok':>5}")
+    for nombre, medir in (("sync", lambda: medir_sync(args.solicitudes, args.hilos)),
+                          ("async", lambda: medir_async(args.solicitudes))):
+        segundos, respuestas = medir()
+        ok = sum(1 for r in respuestas if r.status_code == 200)
+        print(f"{nombre:>6} {args.solicitudes:>11} {segundos:>9.2f} {args.solicitudes / segundos:>9.1f} {ok:>5}")
+
+
+if __name__ == "__main__":
+    main()
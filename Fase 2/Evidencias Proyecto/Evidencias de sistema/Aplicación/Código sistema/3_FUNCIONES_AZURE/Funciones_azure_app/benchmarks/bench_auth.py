@@ -0,0 +1,87 @@
+# bench_auth.py
+#
+# Mide la verificación de tokens de auth.py con y sin cache.tokens. Cada usuario repite su
+# token en varios turnos del chatbot, así que con cache solo el primer turno paga el HMAC y
+# el decode JSON. Se reporta el costo por verificación y por solicitud completa a main_perfil
+# (con la base de datos simulada para aislar el costo de autenticación).
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/bench_auth.py --usuarios 1000 --turnos 20
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SqlConnectionString", "simulada")
+
+import azure.functions as func
+
+import auth
+import cache
+import login_chat
+import perfil_chat
+
+
+def _tokens(usuarios):
+    return [login_chat.generate_token(10000000 + i) for i in range(usuarios)]
+
+
+def _verificaciones(tokens, turnos, usar_cache):
+    """Verifica cada token `turnos` veces, intercalando usuarios como en tráfico real."""
+    cache.tokens.clear()
+    inicio = time.perf_counter()
+    for _ in range(turnos):
+        for token in tokens:
+            auth.verificar_token(token, usar_cache=usar_cache)
+    segundos = time.perf_counter() - inicio
+    return segundos / (len(tokens) * turnos) * 1e6
+
+
+def _solicitudes_perfil(tokens, turnos, usar_cache):
+    """Solicitudes a main_perfil con el perfil ya en cache: el costo restante es la autenticación."""
+    auth.TOKEN_CACHE = usar_cache
+    cache.tokens.clear()
+    for i in range(len(tokens)):
+        cache.perfiles.set(str(10000000 + i), ({"RUTUsuario": 10000000 + i}, None))
+    reqs = [func.HttpRequest(method="POST", url="/api/http_trigger_perfil",
+                             headers={"Authorization": f"Bearer {token}"}, body=b"")
+            for token in tokens]
+    latencias = []
+    for _ in range(turnos):
+        for req in reqs:
+            inicio = time.perf_counter()
+            resp = perfil_chat.main_perfil(req)
+            latencias.append((time.perf_counter() - inicio) * 1e6)
+            assert resp.status_code == 200, resp.get_body()
+    return statistics.mean(latencias), statistics.quantiles(latencias, n=100)[98]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verificación de JWT con y sin cache")
+    parser.add_argument("--usuarios", type=int, default=1000)
+    parser.add_argument("--turnos", type=int, default=20, help="solicitudes por usuario")
+    parser.add_argument("--salida", help="archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    tokens = _tokens(args.usuarios)
+    cache.tokens.max_entries = max(cache.tokens.max_entries, args.usuarios)
+    resultados = {}
+    print(f"{'modo':>10} {'verificar µs':>13} {'perfil µs':>10} {'perfil p99 µs':>14}")
+    for modo, usar_cache in (("sin cache", False), ("con cache", True)):
+        por_token = _verificaciones(tokens, args.turnos, usar_cache)
+        media, p99 = _solicitudes_perfil(tokens, args.turnos, usar_cache)
+        resultados[modo] = {"verificar_us": por_token, "perfil_media_us": media, "perfil_p99_us": p99}
+        print(f"{modo:>10} {por_token:>13.2f} {media:>10.2f} {p99:>14.2f}")
+    print(f"\ncache.tokens: {cache.tokens.stats()}")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# bench_cold_start.py
+#
+# Mide el costo de arranque en frío: cuánto tarda `import function_app` y cuánto agrega
+# la primera carga del módulo de cada ruta. Cada medición corre en un proceso nuevo con
+# `python -X importtime`, y se promedian varias repeticiones. Con --salida se guardan los
+# resultados en JSON para compararlos entre commits.
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/bench_cold_start.py --repeticiones 5 --salida cold_start.json
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (etiqueta, código a ejecutar después de importar function_app)
+ESCENARIOS = [
+    ("import function_app", ""),
+    ("login", "function_app._cargar('login_chat', 'main_login')"),
+    ("registro", "function_app._cargar('registro_chat', 'main_register')"),
+    ("perfil", "function_app._cargar('perfil_chat', 'main_perfil')"),
+    ("hijos", "function_app._cargar('hijos_chat', 'main_get_hijos')"),
+    ("password_retry_sms", "function_app._cargar('password_retry_sms', 'main_password_retry')"),
+]
+
+_LINEA = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S.*)$")
+
+
+def _importtime(codigo):
+    """Ejecuta el código en un intérprete nuevo y devuelve {módulo: (self_us, acumulado_us)}."""
+    env = dict(os.environ)
+    env.setdefault("SqlConnectionString", "no-usada")
+    # Sin el hilo de precalentamiento, que importaría todos los módulos durante la medición
+    env["PrewarmOnStartup"] = "0"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import function_app\n{codigo}"],
+        cwd=APP_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    modulos = {}
+    for linea in proc.stderr.splitlines():
+        m = _LINEA.match(linea)
+        if m:
+            nombre = m.group(3).strip()
+            modulos[nombre] = (int(m.group(1)), int(m.group(2)))
+    return modulos
+
+
+def _total_ms(modulos):
+    """Suma del tiempo propio de todos los módulos importados, en ms."""
+    return sum(propio for propio, _ in modulos.values()) / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de arranque en frío (import time)")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="módulos más costosos a listar")
+    parser.add_argument("--salida", help="archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    resultados = {}
+    base = None
+    print(f"{'escenario':>20} {'mediana ms':>11} {'extra ms':>9} {'módulos':>8}")
+    for etiqueta, codigo in ESCENARIOS:
+        corridas = [_importtime(codigo) for _ in range(args.repeticiones)]
+        totales = [_total_ms(c) for c in corridas]
+        mediana = statistics.median(totales)
+        if base is None:
+            base = mediana
+        ultima = corridas[-1]
+        costosos = sorted(ultima.items(), key=lambda kv: kv[1][0], reverse=True)[:args.top]
+        resultados[etiqueta] = {
+            "mediana_ms": mediana,
+            "extra_sobre_import_ms": mediana - base,
+            "modulos": len(ultima),
+            "mas_costosos": [{"modulo": nombre, "propio_ms": propio / 1000} for nombre, (propio, _) in costosos],
+        }
+        print(f"{etiqueta:>20} {mediana:>11.1f} {mediana - base:>9.1f} {len(ultima):>8}")
+
+    print("\nMódulos más costosos al importar function_app:")
+    for item in resultados["import function_app"]["mas_costosos"]:
+        print(f"  {item['propio_ms']:>8.2f} ms  {item['modulo']}")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# bench_consultas.py
+#
+# Tiempo por consulta de LoginUsuario, GetUserPhone y GetHijos con 100k+ usuarios, en tres
+# variantes sobre fake_pyodbc (SQLite):
+#   - original sin índices: el esquema antes de la migración 1 (solo las claves primarias)
+#   - original con índices: los procedimientos originales sobre el esquema migrado
+#   - migración 1: los procedimientos reescritos sobre el esquema migrado
+#
+# SQLite sabe resolver un OR entre dos columnas indexadas con dos búsquedas, así que la
+# diferencia entre las dos últimas variantes es menor que en SQL Server, donde el OR suele
+# terminar en un recorrido completo; la primera variante muestra el costo de no tener índices.
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/bench_consultas.py --usuarios 100000 --socios 10000
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_pyodbc
+from equivalencia_consultas import ANTES
+
+
+def medir(db, proc, identificadores):
+    """Mediana y p95 en microsegundos por llamada."""
+    tiempos = []
+    for identificador in identificadores:
+        inicio = time.perf_counter()
+        proc(db, identificador)
+        tiempos.append((time.perf_counter() - inicio) * 1e6)
+    tiempos.sort()
+    return statistics.median(tiempos), tiempos[int(len(tiempos) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tiempo de las consultas de login y búsqueda, antes y después de la migración 1")
+    parser.add_argument("--usuarios", type=int, default=100000)
+    parser.add_argument("--socios", type=int, default=10000)
+    parser.add_argument("--consultas", type=int, default=200, help="llamadas por tipo de consulta")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="construye_consultas_")
+    bases = {}
+    for indices in (False, True):
+        ruta = os.path.join(directorio, f"indices_{int(indices)}.db")
+        inicio = time.perf_counter()
+        fake_pyodbc.crear_base(ruta, usuarios=args.usuarios, sin_registrar=args.usuarios // 10,
+                               hijos_por_usuario=2, hash_contrasena="x", socios=args.socios, indices=indices)
+        bases[indices] = sqlite3.connect(ruta)
+        print(f"Base {'con' if indices else 'sin'} índices: {time.perf_counter() - inicio:.1f} s")
+
+    rnd = random.Random(1)
+    colaboradores = [rnd.randrange(args.usuarios) for _ in range(args.consultas)]
+    socios = [rnd.randrange(max(args.socios, 1)) for _ in range(args.consultas)]
+    casos = [
+        ("login por RUT", "LoginUsuario", [str(fake_pyodbc.RUT_BASE + i) for i in colaboradores]),
+        ("login por email", "LoginUsuario", [f"empleado{i}@construye.cl" for i in colaboradores]),
+        ("login socio", "LoginUsuario", [f"socio{i}@empresa.cl" for i in socios]),
+        ("teléfono por RUT", "GetUserPhone", [str(fake_pyodbc.RUT_BASE + i) for i in colaboradores]),
+        ("teléfono por email", "GetUserPhone", [f"empleado{i}@construye.cl" for i in colaboradores]),
+        ("hijos", "GetHijos", [str(fake_pyodbc.RUT_BASE + i) for i in colaboradores]),
+    ]
+    variantes = [
+        ("original sin índices", bases[False], ANTES),
+        ("original con índices", bases[True], ANTES),
+        ("migración 1", bases[True], fake_pyodbc.PROCEDIMIENTOS),
+    ]
+
+    print(f"\n{args.usuarios} colaboradores, {args.socios} socios; µs por llamada (mediana / p95)")
+    print(f"{'consulta':>20} " + " ".join(f"{nombre:>22}" for nombre, _, _ in variantes))
+    for etiqueta, procedimiento, identificadores in casos:
+        columnas = []
+        for _, db, procs in variantes:
+            mediana, p95 = medir(db, procs[procedimiento], identificadores)
+            columnas.append(f"{mediana:>10.0f} / {p95:>9.0f}")
+        print(f"{etiqueta:>20} " + " ".join(f"{c:>22}" for c in columnas))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# bench_esquemas.py
+#
+# Costo por solicitud de leer/validar el cuerpo y construir la respuesta, antes (validaciones
+# repetidas en cada módulo con re.match sin compilar, req.get_json y json.dumps por respuesta)
+# y después (esquemas.py: una pasada con patrones precompilados, errores ya serializados y
+# orjson si está instalado). No toca base de datos ni scrypt.
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/bench_esquemas.py --iteraciones 50000
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import azure.functions as func
+
+import esquemas
+
+
+# --- Implementación anterior (copiada de login_chat antes de esquemas.py) ----
+
+def validate_email(email):
+    return re.match(r'^[\w\.-]+@[\w\.-]+\.\w+$', email) is not None
+
+def validate_rut(rut):
+    return re.match(r'^\d{1,8}-[0-9kK]$', rut) is not None
+
+def validate_password(password):
+    return re.match(r'^(?=.*[a-zA-ZñÑ])(?=.*[A-ZÑ])(?=.*\d)[a-zA-ZñÑ\d]{8,}$', password) is not None
+
+def sanitize_input(input_string):
+    return re.sub(r"[;'\"*?=&]", "", input_string.replace(" ", ""))
+
+def clean_rut(rut):
+    return rut.split('-')[0]
+
+def _error_antes(message, status_code=400):
+    return func.HttpResponse(json.dumps({"error": message}), mimetype="application/json", status_code=status_code)
+
+def _leer_antes(req):
+    req_body = req.get_json()
+    identifier = req_body.get('identifier')
+    password = req_body.get('password')
+    if not identifier or not password:
+        return None, _error_antes("Identificador y contraseña son requeridos")
+    identifier = sanitize_input(identifier)
+    password = sanitize_input(password)
+    if not (validate_email(identifier) or (validate_rut(identifier) and (identifier := clean_rut(identifier)))):
+        return None, _error_antes("Formato de identificador inválido")
+    if not validate_password(password):
+        return None, _error_antes("Formato de contraseña inválido")
+    return (identifier, password), None
+
+def _respuesta_antes(datos):
+    return func.HttpResponse(json.dumps(datos), mimetype="application/json", status_code=200)
+
+
+# --- Implementación actual ---------------------------------------------------
+
+def _leer_despues(req):
+    datos, error = esquemas.LOGIN.leer(req)
+    if error:
+        return None, error
+    return (datos['identifier'], datos['password']), None
+
+def _respuesta_despues(datos):
+    return esquemas.respuesta(datos)
+
+
+PERFIL = {"mensaje": "Usuario encontrado", "NombreCompleto": "Juan Pérez Soto", "RUTUsuario": 12345678,
+          "DV": "5", "NumeroTelefono": "+56911112222", "Email": "juan@ejemplo.cl", "Edad": 41,
+          "Sexo": "M", "Ciudad": "Santiago", "Nacionalidad": "Chilena", "Direccion": "Obra 123"}
+
+CASOS = {
+    "login válido": {"identifier": "12345678-5", "password": "Clave1234"},
+    "email válido": {"identifier": "juan@ejemplo.cl", "password": "Clave1234"},
+    "identificador inválido": {"identifier": "12.345.678", "password": "Clave1234"},
+    "faltan campos": {"identifier": "12345678-5"},
+}
+
+
+def _medir(fn, n):
+    inicio = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - inicio) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overhead de lectura y respuesta por solicitud")
+    parser.add_argument("--iteraciones", type=int, default=50000)
+    args = parser.parse_args()
+
+    print(f"codec JSON: {'orjson' if esquemas.orjson is not None else 'json'}")
+    print(f"{'caso':>24} {'antes µs':>10} {'después µs':>11} {'mejora':>8}")
+    for caso, cuerpo in CASOS.items():
+        req = func.HttpRequest(method="POST", url="/api/http_trigger_login",
+                               body=json.dumps(cuerpo).encode("utf-8"))
+        antes = _medir(lambda: _leer_antes(req), args.iteraciones)
+        despues = _medir(lambda: _leer_despues(req), args.iteraciones)
+        print(f"{caso:>24} {antes:>10.2f} {despues:>11.2f} {antes / despues:>7.1f}x")
+
+    antes = _medir(lambda: _respuesta_antes(PERFIL), args.iteraciones)
+    despues = _medir(lambda: _respuesta_despues(PERFIL), args.iteraciones)
+    print(f"{'respuesta perfil':>24} {antes:>10.2f} {despues:>11.2f} {antes / despues:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
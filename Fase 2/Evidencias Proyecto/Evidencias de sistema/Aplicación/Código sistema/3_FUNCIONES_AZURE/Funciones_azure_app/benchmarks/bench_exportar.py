@@ -0,0 +1,113 @@
+# bench_exportar.py
+#
+# Throughput y memoria de exportar.py sobre una base sintética de fake_pyodbc (por defecto
+# 1.000.000 de empleados, con un hijo cada uno). Cada configuración corre en su propio proceso
+# para que el pico de memoria (ru_maxrss) sea solo el de esa exportación. La última fila lee la
+# tabla completa en una sola página, como referencia de lo que costaría sin paginar.
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/bench_exportar.py --filas 1000000
+#   python benchmarks/bench_exportar.py --filas 100000 --base /tmp/export.db
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+
+# (nombre, conjunto, formato, gzip, página completa)
+CONFIGURACIONES = [
+    ("empleados ndjson", "empleados", "ndjson", False, False),
+    ("empleados csv", "empleados", "csv", False, False),
+    ("empleados csv.gz", "empleados", "csv", True, False),
+    ("hijos ndjson", "hijos", "ndjson", False, False),
+    ("empleados csv (1 página)", "empleados", "csv", False, True),
+]
+
+
+def _interno(args):
+    """Corre dentro del subproceso: exporta a /dev/null contando filas y bytes."""
+    sys.path.insert(0, APP_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import fake_pyodbc
+    fake_pyodbc.instalar()
+    os.environ["SqlConnectionString"] = args.base
+
+    import exportar
+
+    conjunto, formato, gzip, completa = json.loads(args.interno)
+    limite = args.filas + 1 if completa else args.pagina
+    contador = {"filas": 0}
+
+    def contar(filas):
+        for fila in filas:
+            contador["filas"] += 1
+            yield fila
+
+    rss_inicial = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    inicio = time.perf_counter()
+    partes = exportar.SERIALIZADORES[formato](contar(exportar.filas(conjunto, "", limite)),
+                                             exportar.CONJUNTOS[conjunto][1])
+    if gzip:
+        partes = exportar.comprimir(partes)
+    total = 0
+    with open(os.devnull, "wb") as salida:
+        for parte in partes:
+            total += len(parte)
+            salida.write(parte)
+    segundos = time.perf_counter() - inicio
+    print(json.dumps({
+        "filas": contador["filas"],
+        "bytes": total,
+        "segundos": segundos,
+        "rss_inicial_mb": rss_inicial / 1024,
+        "rss_pico_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput de la exportación paginada por clave")
+    parser.add_argument("--filas", type=int, default=1000000, help="empleados sintéticos")
+    parser.add_argument("--pagina", type=int, default=5000, help="RUTs por página")
+    parser.add_argument("--base", help="archivo SQLite a reutilizar (se crea si no existe)")
+    parser.add_argument("--interno", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.interno:
+        _interno(args)
+        return
+
+    sys.path.insert(0, BENCH_DIR)
+    import fake_pyodbc
+
+    base = args.base or os.path.join(tempfile.mkdtemp(prefix="construye_export_"), "export.db")
+    if not os.path.exists(base):
+        inicio = time.perf_counter()
+        fake_pyodbc.crear_base(base, usuarios=args.filas, sin_registrar=0, hijos_por_usuario=1,
+                               hash_contrasena="x")
+        print(f"Base con {args.filas} empleados creada en {time.perf_counter() - inicio:.1f} s ({base})")
+
+    print(f"{'configuración':>26} {'filas':>9} {'s':>7} {'filas/s':>10} {'MB':>8} {'MB/s':>7} "
+          f"{'RSS pico MB':>12} {'Δ RSS MB':>9}")
+    for nombre, conjunto, formato, gzip, completa in CONFIGURACIONES:
+        env = {**os.environ, "SqlPoolMinSize": "0", "ExportFetchSize": "1000"}
+        salida = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--filas", str(args.filas),
+             "--pagina", str(args.pagina), "--base", base,
+             "--interno", json.dumps([conjunto, formato, gzip, completa])],
+            env=env, capture_output=True, text=True, check=True, cwd=APP_DIR).stdout
+        r = json.loads(salida.strip().splitlines()[-1])
+        mb = r["bytes"] / 1e6
+        print(f"{nombre:>26} {r['filas']:>9} {r['segundos']:>7.2f} {r['filas'] / r['segundos']:>10.0f} "
+              f"{mb:>8.1f} {mb / r['segundos']:>7.1f} {r['rss_pico_mb']:>12.1f} "
+              f"{r['rss_pico_mb'] - r['rss_inicial_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
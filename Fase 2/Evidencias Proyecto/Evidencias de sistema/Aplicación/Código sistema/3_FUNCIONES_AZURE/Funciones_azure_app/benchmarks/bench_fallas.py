@@ -0,0 +1,121 @@
+# bench_fallas.py
+#
+# Inyección de fallas: simula una caída de la base de datos con fake_pyodbc (toda conexión
+# falla tras la latencia de login) y compara la política anterior (3 intentos con espera fija
+# de 1 s, sin circuit breaker) contra la actual (backoff exponencial con jitter, plazo por
+# solicitud y circuit breaker). Luego levanta la base y mide cuánto tarda en volver a
+# responder 200 gracias a las sondas del breaker.
+#
+# Cada política corre en su propio proceso porque se configura por variables de entorno.
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/bench_fallas.py --solicitudes 200 --concurrencia 8
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+
+POLITICAS = {
+    "antes": {"RetryBackoff": "fixed", "RetryBaseDelaySeconds": "1", "RetryDeadlineSeconds": "0",
+              "DbCircuitBreaker": "0"},
+    "despues": {"DbCircuitBreaker": "1", "DbBreakerOpenSeconds": "2"},
+}
+
+
+def _interno(args):
+    """Corre dentro del subproceso, con la política ya fijada en el entorno."""
+    sys.path.insert(0, APP_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import fake_pyodbc
+
+    ruta_db = os.path.join(tempfile.mkdtemp(prefix="construye_fallas_"), "fallas.db")
+    fake_pyodbc.crear_base(ruta_db, usuarios=args.solicitudes, sin_registrar=0, hash_contrasena="x")
+    fake_pyodbc.instalar()
+    os.environ["SqlConnectionString"] = ruta_db
+
+    import azure.functions as func
+    import db_pool
+    import function_app
+
+    def solicitud(i):
+        req = func.HttpRequest(method="POST", url="/api/http_trigger_perfil",
+                               body=json.dumps({"rut": str(fake_pyodbc.RUT_BASE + i)}).encode("utf-8"))
+        inicio = time.perf_counter()
+        resp = function_app.http_trigger_perfil(req)
+        return (time.perf_counter() - inicio) * 1000, resp.status_code
+
+    db_pool.get_pool()
+    fake_pyodbc.configurar(caida=True, latencia_conexion_ms=args.latencia_conexion_ms)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrencia) as executor:
+        resultados = list(executor.map(solicitud, range(args.solicitudes)))
+    segundos = time.perf_counter() - inicio
+
+    latencias = sorted(ms for ms, _ in resultados)
+    estados = {}
+    for _, estado in resultados:
+        estados[str(estado)] = estados.get(str(estado), 0) + 1
+
+    # Recuperación: la base vuelve y se consulta cada 50 ms hasta obtener 200
+    fake_pyodbc.configurar(caida=False, latencia_conexion_ms=0)
+    levantada = time.perf_counter()
+    intentos = 0
+    while True:
+        intentos += 1
+        _, estado = solicitud(intentos % args.solicitudes)
+        if estado == 200 or time.perf_counter() - levantada > 30:
+            break
+        time.sleep(0.05)
+
+    print(json.dumps({
+        "segundos": segundos,
+        "media_ms": statistics.mean(latencias),
+        "p50_ms": latencias[len(latencias) // 2],
+        "p95_ms": latencias[int(len(latencias) * 0.95) - 1],
+        "estados": estados,
+        "conexiones_fallidas": fake_pyodbc.stats["conexiones_fallidas"],
+        "recuperacion_s": time.perf_counter() - levantada,
+        "breaker": db_pool.breaker.stats(),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Comportamiento ante una caída de la base de datos")
+    parser.add_argument("--solicitudes", type=int, default=200)
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--latencia-conexion-ms", type=float, default=100.0,
+                        help="lo que tarda en fallar cada intento de conexión")
+    parser.add_argument("--interno", choices=list(POLITICAS), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.interno:
+        _interno(args)
+        return
+
+    print(f"{'política':>9} {'total s':>8} {'media ms':>9} {'p95 ms':>8} {'conexiones fallidas':>20} "
+          f"{'recuperación s':>15}  estados")
+    for politica, entorno in POLITICAS.items():
+        env = {**os.environ, **entorno, "AuthRequired": "0", "CacheTtlSeconds": "0",
+               "SqlPoolMinSize": "0", "SqlPoolMaxSize": str(args.concurrencia),
+               "PrewarmOnStartup": "0"}
+        salida = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--interno", politica,
+             "--solicitudes", str(args.solicitudes), "--concurrencia", str(args.concurrencia),
+             "--latencia-conexion-ms", str(args.latencia_conexion_ms)],
+            env=env, capture_output=True, text=True, check=True, cwd=APP_DIR).stdout
+        r = json.loads(salida.strip().splitlines()[-1])
+        print(f"{politica:>9} {r['segundos']:>8.2f} {r['media_ms']:>9.1f} {r['p95_ms']:>8.1f} "
+              f"{r['conexiones_fallidas']:>20} {r['recuperacion_s']:>15.2f}  {r['estados']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# bench_hash.py
+#
+# Hashes por segundo por núcleo para cada juego de parámetros de scrypt: el formato original
+# (LEGADO), los actuales (PasswordHashLogN/R/P) y algunos alternativos. Se mide secuencial en
+# un núcleo y con el pool de procesos de hash_pool completo (total y dividido por trabajador),
+# que es la capacidad real de logins por segundo de la instancia.
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/bench_hash.py --hashes 64
+#   python benchmarks/bench_hash.py --parametros 14:8,15:8,16:8
+
+import argparse
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import scrypt
+
+import contrasenas
+import hash_pool
+
+
+def secuencial(params, hashes):
+    """Hashes por segundo en el proceso actual (un núcleo)."""
+    salt = os.urandom(contrasenas.HASH_SALT_BYTES)
+    inicio = time.perf_counter()
+    for i in range(hashes):
+        scrypt.hash(f"Clave{i}".encode(), salt, N=params.n, r=params.r, p=params.p, buflen=params.buflen)
+    return hashes / (time.perf_counter() - inicio)
+
+
+def en_pool(pool, params, hashes):
+    """Hashes por segundo con el pool de procesos ocupado por completo."""
+    pares = [(f"Clave{i}".encode(), os.urandom(contrasenas.HASH_SALT_BYTES)) for i in range(hashes)]
+    inicio = time.perf_counter()
+    pool.hash_lote(pares, N=params.n, r=params.r, p=params.p, buflen=params.buflen)
+    return hashes / (time.perf_counter() - inicio)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hashes por segundo por núcleo para cada juego de parámetros")
+    parser.add_argument("--hashes", type=int, default=64, help="hashes por medición")
+    parser.add_argument("--parametros", default="13:8,15:8,14:16",
+                        help="juegos adicionales ln:r, separados por coma (p=1)")
+    args = parser.parse_args()
+
+    juegos = [("legado", contrasenas.LEGADO), ("actuales", contrasenas.ACTUALES)]
+    for juego in args.parametros.split(","):
+        ln, r = (int(v) for v in juego.split(":"))
+        juegos.append((f"ln={ln} r={r}", contrasenas.Parametros(2 ** ln, r, 1, contrasenas.HASH_BYTES)))
+
+    pool = hash_pool.get_pool()
+    workers = max(pool.workers, 1)
+    # Arrancar los procesos antes de medir
+    pool.hash_lote([(b"calentar", os.urandom(8))] * workers)
+    print(f"{workers} trabajadores en el pool, {os.cpu_count()} núcleos\n")
+
+    print(f"{'parámetros':>14} {'ln':>3} {'r':>3} {'p':>2} {'MB':>6} {'1 núcleo/s':>11} "
+          f"{'pool/s':>9} {'pool/s/núcleo':>14} {'ms/hash':>8}")
+    for nombre, params in juegos:
+        uno = secuencial(params, max(args.hashes // 4, 1))
+        total = en_pool(pool, params, args.hashes)
+        print(f"{nombre:>14} {params.n.bit_length() - 1:>3} {params.r:>3} {params.p:>2} "
+              f"{contrasenas.memoria_bytes(params) / 2 ** 20:>6.0f} {uno:>11.1f} {total:>9.1f} "
+              f"{total / workers:>14.1f} {1000 / uno:>8.1f}")
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
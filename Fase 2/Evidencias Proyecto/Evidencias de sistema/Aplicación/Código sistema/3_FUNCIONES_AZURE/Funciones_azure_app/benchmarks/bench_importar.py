@@ -0,0 +1,148 @@
+# bench_importar.py
+#
+# Carga masiva de Empleados con importar_empleados.py sobre fake_pyodbc:
+#   1. Throughput por tamaño de lote con fast_executemany, y fila por fila como referencia, con
+#      una latencia simulada por viaje a la base (fast_executemany paga una sola por lote).
+#   2. Corte a mitad de carga (justo después de confirmar un bloque, antes del checkpoint) y
+#      reanudación: verifica que no se pierdan ni se dupliquen filas ni rechazos.
+#
+# El CSV sintético mezcla filas nuevas, RUTs ya existentes (se actualizan) y ~3 % de filas
+# inválidas (DV incorrecto, email, edad, RUT mal formado).
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/bench_importar.py --filas 200000 --latencia-ms 1
+
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_pyodbc
+fake_pyodbc.instalar()
+
+EXISTENTES = 1000
+
+
+def generar_csv(ruta, filas):
+    """Devuelve (filas inválidas, filas válidas con RUT nuevo)."""
+    invalidas = nuevas = 0
+    with open(ruta, "w", newline="", encoding="utf-8") as f:
+        escritor = csv.writer(f, delimiter=";")
+        escritor.writerow(("NombreCompleto", "RUTUsuario", "DV", "Email", "Edad", "Sexo", "Ciudad", "Nacionalidad"))
+        for i in range(filas):
+            # Las primeras EXISTENTES filas repiten RUTs de la base: se actualizan
+            rut = fake_pyodbc.RUT_BASE + (i if i < EXISTENTES else 5000000 + i)
+            dv = fake_pyodbc.digito_verificador(rut)
+            email, edad = f"obra{i}@construye.cl", str(20 + i % 40)
+            rut_texto = f"{rut:,}".replace(",", ".") if i % 3 == 0 else str(rut)
+            defecto = i % 100
+            if defecto == 7:
+                dv = "0" if dv != "0" else "1"
+            elif defecto == 31:
+                email = "sin-arroba.construye.cl"
+            elif defecto == 59:
+                edad = "7"
+            elif defecto == 83:
+                rut_texto += "X"
+            if defecto in (7, 31, 59, 83):
+                invalidas += 1
+            elif i >= EXISTENTES:
+                nuevas += 1
+            escritor.writerow((f"Trabajador Obra {i}", rut_texto, dv, email, edad,
+                               "F" if i % 2 else "M", "Iquique", "Chilena"))
+    return invalidas, nuevas
+
+
+def preparar_base(directorio, nombre):
+    ruta = os.path.join(directorio, nombre)
+    fake_pyodbc.crear_base(ruta, usuarios=EXISTENTES, sin_registrar=0, hijos_por_usuario=0, hash_contrasena="x")
+    os.environ["SqlConnectionString"] = ruta
+    import db_pool
+    if db_pool._pool is not None:
+        db_pool._pool.close()
+        db_pool._pool = None
+    return ruta
+
+
+def contar_empleados(ruta):
+    conn = sqlite3.connect(ruta)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM Empleados").fetchone()[0]
+    finally:
+        conn.close()
+
+
+class Corte(Exception):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput y reanudación de importar_empleados")
+    parser.add_argument("--filas", type=int, default=200000)
+    parser.add_argument("--lotes", default="100,1000,5000")
+    parser.add_argument("--latencia-ms", type=float, default=1.0, help="latencia simulada por viaje a la base")
+    args = parser.parse_args()
+
+    import importar_empleados
+
+    directorio = tempfile.mkdtemp(prefix="construye_import_")
+    origen = os.path.join(directorio, "obra.csv")
+    invalidas, nuevas = generar_csv(origen, args.filas)
+    esperadas = EXISTENTES + nuevas
+    print(f"CSV con {args.filas} filas ({invalidas} inválidas) en {origen}")
+    fake_pyodbc.configurar(latencia_ms=args.latencia_ms)
+
+    print(f"\n{'lote':>6} {'fast_executemany':>17} {'s':>8} {'filas/s':>9} {'importadas':>11} {'rechazadas':>11}")
+    lotes = [int(t) for t in args.lotes.split(",")]
+    # Sin fast_executemany el tamaño del lote casi no influye: se mide una vez
+    for lote, fast in [(lotes[0], False)] + [(lote, True) for lote in lotes]:
+        preparar_base(directorio, f"lote_{lote}_{int(fast)}.db")
+        importar_empleados.IMPORT_FAST_EXECUTEMANY = fast
+        inicio = time.perf_counter()
+        r = importar_empleados.importar(origen, lote, reanudar=False)
+        segundos = time.perf_counter() - inicio
+        print(f"{lote:>6} {str(fast):>17} {segundos:>8.2f} {args.filas / segundos:>9.0f} "
+              f"{r['importadas']:>11} {r['rechazadas']:>11}")
+
+    # Corte después de confirmar el tercer bloque y antes de guardar su checkpoint
+    importar_empleados.IMPORT_FAST_EXECUTEMANY = True
+    ruta = preparar_base(directorio, "corte.db")
+    lote = 1000
+    upsert_original = importar_empleados._upsert
+    bloques = {"n": 0}
+
+    def upsert_con_corte(filas):
+        upsert_original(filas)
+        bloques["n"] += 1
+        if bloques["n"] == 3:
+            raise Corte()
+
+    importar_empleados._upsert = upsert_con_corte
+    try:
+        importar_empleados.importar(origen, lote)
+    except Corte:
+        pass
+    importar_empleados._upsert = upsert_original
+    print(f"\nCorte tras el bloque 3: {contar_empleados(ruta)} empleados en la base, "
+          f"checkpoint presente: {os.path.exists(origen + '.checkpoint.json')}")
+
+    r = importar_empleados.importar(origen, lote)
+    with open(r["archivo_rechazos"], encoding="utf-8") as f:
+        lineas_rechazos = sum(1 for _ in f) - 1
+    total = contar_empleados(ruta)
+    print(f"Reanudada: {r['filas']} filas, {r['importadas']} importadas, {r['rechazadas']} rechazadas; "
+          f"{total} empleados en la base, {lineas_rechazos} líneas en el archivo de rechazos")
+    ok = (total == esperadas and r["rechazadas"] == invalidas == lineas_rechazos
+          and not os.path.exists(origen + ".checkpoint.json"))
+    print("Reanudación correcta" if ok else f"ERROR: se esperaban {esperadas} empleados y {invalidas} rechazos")
+
+
+if __name__ == "__main__":
+    main()
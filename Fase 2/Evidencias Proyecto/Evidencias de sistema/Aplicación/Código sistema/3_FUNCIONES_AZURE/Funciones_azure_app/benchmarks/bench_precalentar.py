@@ -0,0 +1,90 @@
+# bench_precalentar.py
+#
+# Efecto del precalentamiento (precalentar.py) en la primera solicitud de una instancia nueva:
+# latencia del primer y del segundo login, en frío y después de precalentar. Cada escenario
+# corre en un proceso nuevo sobre fake_pyodbc, con una latencia de conexión que simula el
+# handshake TLS + login de Azure SQL; el login usa un hash real, así que la primera solicitud
+# en frío también paga el arranque del pool de hashing.
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/bench_precalentar.py --repeticiones 5 --latencia-conexion-ms 80
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+ESCENARIOS = ("frio", "precalentado")
+
+
+def _interno(args):
+    """Corre dentro del subproceso: importa la aplicación, precalienta si corresponde y mide dos logins."""
+    sys.path.insert(0, APP_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    import fake_pyodbc
+    from load_bench import PASSWORD, _hash_almacenado
+
+    ruta_db = os.path.join(tempfile.mkdtemp(prefix="construye_precalentar_"), "precalentar.db")
+    fake_pyodbc.crear_base(ruta_db, usuarios=10, sin_registrar=0, hash_contrasena=_hash_almacenado())
+    fake_pyodbc.instalar()
+    fake_pyodbc.configurar(latencia_conexion_ms=args.latencia_conexion_ms, latencia_ms=args.latencia_ms)
+    os.environ["SqlConnectionString"] = ruta_db
+
+    import azure.functions as func
+    import function_app
+
+    resultado = {"precalentamiento_ms": 0.0}
+    if args.interno == "precalentado":
+        inicio = time.perf_counter()
+        function_app._cargar("precalentar", "ejecutar")("bench", function_app.precargar)
+        resultado["precalentamiento_ms"] = (time.perf_counter() - inicio) * 1000
+
+    handler = function_app.http_trigger_login
+    rut = str(fake_pyodbc.RUT_BASE)
+    for etiqueta in ("primera_ms", "segunda_ms"):
+        req = func.HttpRequest(method="POST", url="/api/http_trigger_login", headers={},
+                               body=json.dumps({"identifier": f"{rut}-{fake_pyodbc.digito_verificador(rut)}",
+                                                "password": PASSWORD}).encode("utf-8"))
+        inicio = time.perf_counter()
+        resp = handler(req)
+        resultado[etiqueta] = (time.perf_counter() - inicio) * 1000
+        if resp.status_code != 200:
+            raise SystemExit(f"Login respondió {resp.status_code}: {resp.get_body()!r}")
+    print(json.dumps(resultado))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Primera solicitud de una instancia nueva, con y sin precalentamiento")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--latencia-conexion-ms", type=float, default=80.0)
+    parser.add_argument("--latencia-ms", type=float, default=2.0, help="latencia por sentencia")
+    parser.add_argument("--interno", choices=ESCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.interno:
+        _interno(args)
+        return
+
+    env = {**os.environ, "PrewarmOnStartup": "0", "LoginRateLimit": "0", "SqlPoolMinSize": "1"}
+    print(f"{'escenario':>13} {'precalentar ms':>15} {'1er login ms':>13} {'2º login ms':>12}")
+    for escenario in ESCENARIOS:
+        medidas = []
+        for _ in range(args.repeticiones):
+            salida = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--interno", escenario,
+                 "--latencia-conexion-ms", str(args.latencia_conexion_ms), "--latencia-ms", str(args.latencia_ms)],
+                env=env, capture_output=True, text=True, check=True, cwd=APP_DIR).stdout
+            medidas.append(json.loads(salida.strip().splitlines()[-1]))
+        mediana = {clave: statistics.median(m[clave] for m in medidas) for clave in medidas[0]}
+        print(f"{escenario:>13} {mediana['precalentamiento_ms']:>15.1f} {mediana['primera_ms']:>13.1f} "
+              f"{mediana['segunda_ms']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
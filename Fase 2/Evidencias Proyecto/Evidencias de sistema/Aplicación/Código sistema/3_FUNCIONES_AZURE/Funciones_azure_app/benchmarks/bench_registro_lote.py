@@ -0,0 +1,93 @@
+# bench_registro_lote.py
+#
+# Alta de una cuadrilla: registrar N colaboradores uno por uno (register_usuario_colaborador,
+# como hoy llega cada solicitud HTTP) contra el registro en lote (register_usuarios_colaboradores:
+# hashes repartidos en el pool de procesos e inserción set-based), sobre fake_pyodbc con una
+# latencia simulada por sentencia.
+#
+# Meta de throughput: el lote debe alcanzar al menos el 80 % de la capacidad de hashing de la
+# máquina (HashPoolWorkers / tiempo de un scrypt), es decir, la base de datos deja de ser el
+# cuello de botella y el costo queda dominado por scrypt, que es intencionalmente caro.
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/bench_registro_lote.py --usuarios 500 --latencia-ms 2
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_pyodbc
+fake_pyodbc.instalar()
+
+META = 0.8
+
+
+def preparar_base(directorio, nombre, usuarios):
+    ruta = os.path.join(directorio, nombre)
+    # Todos los empleados quedan sin registrar
+    fake_pyodbc.crear_base(ruta, usuarios=0, sin_registrar=usuarios, hijos_por_usuario=0)
+    os.environ["SqlConnectionString"] = ruta
+    import db_pool
+    if db_pool._pool is not None:
+        db_pool._pool.close()
+        db_pool._pool = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registro de colaboradores: uno por uno vs lote")
+    parser.add_argument("--usuarios", type=int, default=500)
+    parser.add_argument("--latencia-ms", type=float, default=2.0, help="latencia simulada por sentencia")
+    args = parser.parse_args()
+
+    import hash_pool
+    import registro_chat
+
+    usuarios = [(str(fake_pyodbc.RUT_BASE + i), "Clave1234", f"Calle {i}", f"+5691234{i:04d}"[-12:])
+                for i in range(args.usuarios)]
+    directorio = tempfile.mkdtemp(prefix="construye_registro_")
+    fake_pyodbc.configurar(latencia_ms=args.latencia_ms)
+    pool = hash_pool.get_pool()
+
+    # Capacidad de hashing: tiempo de un scrypt (tras calentar los procesos) por trabajador
+    pool.hash_lote([(b"calentar", os.urandom(8))] * max(pool.workers, 1))
+    inicio = time.perf_counter()
+    pool.hash(b"Clave1234", os.urandom(8))
+    un_hash = time.perf_counter() - inicio
+    capacidad = max(pool.workers, 1) / un_hash
+    print(f"scrypt: {un_hash * 1000:.1f} ms por hash, {pool.workers} trabajadores "
+          f"-> capacidad {capacidad:.1f} hashes/s")
+
+    print(f"\n{'modo':>10} {'s':>8} {'usuarios/s':>11} {'registrados':>12}")
+    preparar_base(directorio, "uno_a_uno.db", args.usuarios)
+    inicio = time.perf_counter()
+    registrados = sum(1 for u in usuarios if registro_chat.register_usuario_colaborador(*u)[0])
+    segundos = time.perf_counter() - inicio
+    print(f"{'uno a uno':>10} {segundos:>8.2f} {args.usuarios / segundos:>11.1f} {registrados:>12}")
+
+    preparar_base(directorio, "lote.db", args.usuarios)
+    inicio = time.perf_counter()
+    _, _, estados = registro_chat.register_usuarios_colaboradores(usuarios)
+    segundos = time.perf_counter() - inicio
+    registrados = sum(1 for e in estados.values() if e == "registrado")
+    throughput = args.usuarios / segundos
+    print(f"{'lote':>10} {segundos:>8.2f} {throughput:>11.1f} {registrados:>12}")
+
+    # Repetir el lote: nadie queda pendiente, así que no se calcula ningún hash
+    inicio = time.perf_counter()
+    _, _, estados = registro_chat.register_usuarios_colaboradores(usuarios)
+    print(f"{'repetido':>10} {time.perf_counter() - inicio:>8.2f} {'':>11} "
+          f"{sum(1 for e in estados.values() if e == 'registrado'):>12}  (todos ya_registrado)")
+
+    print(f"\nMeta: {META:.0%} de la capacidad de hashing ({META * capacidad:.1f} usuarios/s): "
+          f"{'cumplida' if throughput >= META * capacidad else 'NO cumplida'} ({throughput / capacidad:.0%})")
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# bench_save_hijos.py
+#
+# Compara la latencia de guardar hijos fila por fila (RegistrarHijos) contra el modo
+# lote (RegistrarHijosLote) para 1, 10 y 100 hijos. Cada medición se hace dentro de una
+# transacción que se revierte al final, por lo que no deja datos en la base.
+#
+# Uso (desde Funciones_azure_app, con SqlConnectionString configurada):
+#   python benchmarks/bench_save_hijos.py --rut 15670589 --repeticiones 20
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_pool
+import hijos_chat
+
+
+def generar_hijos(n):
+    return [
+        {"nombreCompleto": f"Hijo Benchmark {i}", "fechaNacimiento": "01/03/2015", "esEstudiante": i % 2 == 0}
+        for i in range(n)
+    ]
+
+
+def medir(conn, insertar, rut, hijos, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        cursor = conn.cursor()
+        inicio = time.perf_counter()
+        insertar(cursor, rut, hijos)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        conn.rollback()
+    return tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de save_hijos: por fila vs lote")
+    parser.add_argument("--rut", required=True, help="RUT existente en Empleados (sin DV)")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--tamanos", default="1,10,100")
+    args = parser.parse_args()
+
+    modos = [("por_fila", hijos_chat._insertar_hijos_por_fila), ("lote", hijos_chat._insertar_hijos_lote)]
+
+    print(f"{'hijos':>6} {'modo':>9} {'p50 ms':>9} {'media ms':>9} {'min ms':>9}")
+    with db_pool.connection() as conn:
+        for n in (int(t) for t in args.tamanos.split(",")):
+            hijos = generar_hijos(n)
+            for nombre, insertar in modos:
+                tiempos = medir(conn, insertar, args.rut, hijos, args.repeticiones)
+                print(f"{n:>6} {nombre:>9} {statistics.median(tiempos):>9.2f} "
+                      f"{statistics.mean(tiempos):>9.2f} {min(tiempos):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# equivalencia_consultas.py
+#
+# Verifica que LoginUsuario, GetUserPhone y GetHijos de la migración 1 devuelven las mismas
+# filas que las versiones originales (IF EXISTS + SELECT con OR entre columnas). Ambas
+# versiones están traducidas a SQLite: las originales aquí (ANTES) y las nuevas en
+# fake_pyodbc.PROCEDIMIENTOS, igual que en ScriptCrea Base.txt.
+#
+# Se comparan como multiconjuntos (ninguna de las dos garantiza orden) sobre:
+#   1. Casos borde armados a mano: socio y colaborador con el mismo RUT o email, socios que
+#      comparten email, un RUT igual al email de otro, emails NULL, email de Empleados
+#      distinto del de UsuarioColaborador, teléfonos repetidos, empleados sin hijos.
+#   2. Bases aleatorias donde RUTs y emails salen de un conjunto chico de valores, para que
+#      las coincidencias cruzadas sean frecuentes.
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/equivalencia_consultas.py --semillas 300
+
+import argparse
+import collections
+import os
+import random
+import sqlite3
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+import fake_pyodbc
+
+
+# --- Versiones originales -------------------------------------------------------
+
+def _login_usuario_antes(db, identificador):
+    filas, nombres = fake_pyodbc._consulta(db, """
+        SELECT RUTSocio AS RUTUsuario, ContraseñaSocio AS Contraseña, CorreoSocio AS Email
+        FROM UsuarioSocio WHERE RUTSocio = ? OR CorreoSocio = ?""", (identificador, identificador))
+    if not filas:
+        filas, nombres = fake_pyodbc._consulta(db, """
+            SELECT RUTUsuario, Contraseña, Email FROM UsuarioColaborador
+            WHERE RUTUsuario = ? OR Email = ?""", (identificador, identificador))
+    return filas, nombres, -1, []
+
+
+def _get_user_phone_antes(db, identificador):
+    filas, nombres = fake_pyodbc._consulta(db, """
+        SELECT uc.NumeroTelefono FROM Empleados e JOIN UsuarioColaborador uc ON e.RUTUsuario = uc.RUTUsuario
+        WHERE e.Email = ? OR e.RUTUsuario = ?
+        UNION
+        SELECT us.NumeroTelefono FROM UsuarioSocio us WHERE us.CorreoSocio = ? OR us.RUTSocio = ?""",
+        (identificador,) * 4)
+    return filas, nombres, -1, []
+
+
+def _get_hijos_antes(db, rut):
+    if db.execute("SELECT 1 FROM Hijos WHERE RUTUsuario = ?", (rut,)).fetchone() is None:
+        return [], [], -1, []
+    filas, nombres = fake_pyodbc._consulta(db, """
+        SELECT RUTUsuario, NombreCompletoHijo, FechaNacimientoHijo, EsEstudiante
+        FROM Hijos WHERE RUTUsuario = ?""", (rut,))
+    return filas, nombres, -1, []
+
+
+ANTES = {
+    "LoginUsuario": _login_usuario_antes,
+    "GetUserPhone": _get_user_phone_antes,
+    "GetHijos": _get_hijos_antes,
+}
+
+
+# --- Datos ------------------------------------------------------------------------
+
+def _base_vacia():
+    db = sqlite3.connect(":memory:")
+    db.executescript(fake_pyodbc._ESQUEMA)
+    for sql in fake_pyodbc.INDICES.values():
+        db.execute(sql)
+    return db
+
+
+def _insertar(db, empleados, colaboradores, socios, hijos):
+    """empleados: (rut, email); colaboradores: (rut, email, telefono); socios: (rut, correo,
+    telefono); hijos: (rut, nombre)."""
+    db.executemany("INSERT INTO Empleados (NombreCompleto, RUTUsuario, DV, Email) VALUES ('N', ?, '1', ?)",
+                   empleados)
+    db.executemany("INSERT INTO UsuarioColaborador (RUTUsuario, DV, Email, Contraseña, NumeroTelefono) "
+                   "VALUES (?, '1', ?, 'hash-' || ?, ?)", [(r, e, r, t) for r, e, t in colaboradores])
+    db.executemany("INSERT INTO UsuarioSocio (RUTSocio, CorreoSocio, ContraseñaSocio, NumeroTelefono) "
+                   "VALUES (?, ?, 'socio-' || ?, ?)", [(r, c, r, t) for r, c, t in socios])
+    db.executemany("INSERT INTO Hijos (RUTUsuario, NombreCompletoHijo, FechaNacimientoHijo) VALUES (?, ?, '2015-03-01')",
+                   hijos)
+
+
+def base_casos_borde():
+    db = _base_vacia()
+    _insertar(
+        db,
+        empleados=[("111", "ana@obra.cl"), ("222", "beto@obra.cl"), ("333", None), ("444", "nuevo@obra.cl"),
+                   ("555", "compartido@obra.cl"), ("666", "compartido@obra.cl"), ("777", "888"),
+                   ("999", "sin-cuenta@obra.cl")],
+        colaboradores=[("111", "ana@obra.cl", "+56911111111"),
+                       ("222", "beto@obra.cl", None),                 # sin teléfono
+                       ("333", None, "+56933333333"),                 # sin email
+                       ("444", "viejo@obra.cl", "+56944444444"),      # email distinto al de Empleados
+                       ("555", "compartido@obra.cl", "+56955555555"),
+                       ("666", "compartido@obra.cl", "+56955555555"),  # mismo email y teléfono
+                       ("777", "888", "+56977777777")],               # email igual al RUT de un socio
+        socios=[("111", "socio111@empresa.cl", "+56211111111"),        # mismo RUT que un colaborador
+                ("888", "beto@obra.cl", "+56288888888"),               # mismo email que un colaborador
+                ("889", "gerencia@empresa.cl", "+56288888889"),
+                ("890", "gerencia@empresa.cl", None),                  # socios que comparten email
+                ("r@x.cl", "otro@empresa.cl", "+56200000001"),         # RUT igual al email de otro socio
+                ("891", "r@x.cl", "+56200000002"),
+                ("892", None, "+56200000003")],
+        hijos=[("111", "Hijo A"), ("111", "Hijo B"), ("555", "Hijo C")])
+    return db
+
+
+def base_aleatoria(semilla):
+    rnd = random.Random(semilla)
+    valores = [f"v{i}" for i in range(20)]
+
+    def quizas(valor, probabilidad_null=0.15):
+        return None if rnd.random() < probabilidad_null else valor
+
+    ruts_empleados = rnd.sample(valores, rnd.randint(0, 12))
+    empleados = [(r, quizas(rnd.choice(valores))) for r in ruts_empleados]
+    colaboradores = [(r, quizas(rnd.choice(valores)), quizas(f"+569{rnd.randint(0, 5)}"))
+                     for r in ruts_empleados if rnd.random() < 0.7]
+    socios = [(r, quizas(rnd.choice(valores)), quizas(f"+562{rnd.randint(0, 5)}"))
+              for r in rnd.sample(valores, rnd.randint(0, 8))]
+    hijos = [(rnd.choice(ruts_empleados), f"Hijo {i}") for i in range(rnd.randint(0, 10))] if ruts_empleados else []
+    db = _base_vacia()
+    _insertar(db, empleados, colaboradores, socios, hijos)
+    return db, valores
+
+
+def _identificadores(db):
+    consultas = ("SELECT RUTUsuario FROM Empleados", "SELECT Email FROM Empleados",
+                 "SELECT Email FROM UsuarioColaborador", "SELECT RUTSocio FROM UsuarioSocio",
+                 "SELECT CorreoSocio FROM UsuarioSocio")
+    encontrados = {v for sql in consultas for (v,) in db.execute(sql) if v is not None}
+    return encontrados | {"", "no-existe@obra.cl", "000"}
+
+
+# --- Comparación ------------------------------------------------------------------
+
+def comparar(db, identificadores, contexto):
+    """Devuelve la lista de diferencias entre ambas versiones para cada identificador."""
+    diferencias = []
+    for nombre, antes in ANTES.items():
+        despues = fake_pyodbc.PROCEDIMIENTOS[nombre]
+        for identificador in sorted(identificadores):
+            filas_antes, nombres_antes, _, _ = antes(db, identificador)
+            filas_despues, nombres_despues, _, _ = despues(db, identificador)
+            if nombre == "GetHijos":
+                # fake_pyodbc convierte la fecha a date, como pyodbc; la columna Version es de
+                # la migración 3
+                filas_despues = [(r[0], r[1], r[2].isoformat(), r[3]) for r in filas_despues]
+                nombres_despues = nombres_despues[:4]
+            elif nombre == "LoginUsuario":
+                # Origen se agregó después, para que login_chat no actualice el hash de los socios
+                filas_despues = [tuple(r[:3]) for r in filas_despues]
+                nombres_despues = nombres_despues[:3]
+            if filas_antes and nombres_antes != nombres_despues:
+                diferencias.append(f"{contexto} {nombre}({identificador!r}): columnas "
+                                   f"{nombres_antes} vs {nombres_despues}")
+            if collections.Counter(filas_antes) != collections.Counter(filas_despues):
+                diferencias.append(f"{contexto} {nombre}({identificador!r}): "
+                                   f"{sorted(filas_antes, key=repr)} vs {sorted(filas_despues, key=repr)}")
+    return diferencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Equivalencia de los procedimientos de la migración 1")
+    parser.add_argument("--semillas", type=int, default=300, help="bases aleatorias a comparar")
+    args = parser.parse_args()
+
+    db = base_casos_borde()
+    identificadores = _identificadores(db)
+    diferencias = comparar(db, identificadores, "casos borde")
+    consultas = len(identificadores) * len(ANTES)
+
+    for semilla in range(args.semillas):
+        db, valores = base_aleatoria(semilla)
+        identificadores = set(valores) | _identificadores(db)
+        diferencias += comparar(db, identificadores, f"semilla {semilla}")
+        consultas += len(identificadores) * len(ANTES)
+
+    for diferencia in diferencias[:20]:
+        print(diferencia)
+    print(f"{consultas} consultas comparadas ({args.semillas} bases aleatorias + casos borde): "
+          f"{len(diferencias)} diferencias")
+    sys.exit(1 if diferencias else 0)
+
+
+if __name__ == "__main__":
+    main()
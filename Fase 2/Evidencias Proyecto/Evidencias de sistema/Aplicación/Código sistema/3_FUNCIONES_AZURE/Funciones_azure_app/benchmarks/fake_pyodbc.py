@@ -0,0 +1,711 @@
+# fake_pyodbc.py
+#
+# Sustituto local de pyodbc respaldado por SQLite, para medir los handlers sin Azure SQL.
+# Implementa la parte de la API de pyodbc que usa la aplicación (connect, cursor, execute,
+# fetchone/fetchall/fetchmany, commit, rollback, rowcount, messages) y los procedimientos
+# almacenados de ScriptCrea Base.txt reescritos en Python sobre SQLite.
+#
+# Se instala antes de importar la aplicación:
+#   import fake_pyodbc
+#   fake_pyodbc.instalar()                       # sys.modules["pyodbc"] = fake_pyodbc
+#   fake_pyodbc.crear_base("bench.db", usuarios=1000)
+#   fake_pyodbc.configurar(latencia_ms=5, tasa_fallos=0.01)
+#
+# La cadena de conexión es la ruta del archivo SQLite.
+
+import datetime
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+
+class Error(Exception):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class ProgrammingError(DatabaseError):
+    pass
+
+
+class IntegrityError(DatabaseError):
+    pass
+
+
+class DataError(DatabaseError):
+    pass
+
+
+# Latencia y fallos inyectables (se pueden cambiar en caliente con configurar())
+_config = {
+    "latencia_ms": 0.0,           # por sentencia
+    "jitter_ms": 0.0,
+    "latencia_conexion_ms": 0.0,  # handshake TLS + login
+    "tasa_fallos": 0.0,           # probabilidad de error transitorio por sentencia
+    "caida": False,               # simula una caída: toda conexión y sentencia falla
+}
+_stats_lock = threading.Lock()
+stats = {"conexiones": 0, "sentencias": 0, "fallos_inyectados": 0, "conexiones_fallidas": 0}
+
+
+def configurar(**opciones):
+    for clave, valor in opciones.items():
+        if clave not in _config:
+            raise KeyError(clave)
+        _config[clave] = valor
+
+
+def instalar():
+    """Registra este módulo como `pyodbc` para que la aplicación lo importe."""
+    sys.modules["pyodbc"] = sys.modules[__name__]
+
+
+def _dormir(ms):
+    if ms > 0:
+        time.sleep(ms / 1000)
+
+
+class Row:
+    """Fila con acceso por atributo y por índice, como pyodbc.Row."""
+
+    __slots__ = ("_nombres", "_valores")
+
+    def __init__(self, nombres, valores):
+        self._nombres = nombres
+        self._valores = tuple(valores)
+
+    def __getattr__(self, nombre):
+        try:
+            return self._valores[self._nombres[nombre]]
+        except KeyError:
+            raise AttributeError(nombre)
+
+    def __getitem__(self, i):
+        return self._valores[i]
+
+    def __len__(self):
+        return len(self._valores)
+
+    def __iter__(self):
+        return iter(self._valores)
+
+
+# --- Esquema y datos ---------------------------------------------------------
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS Empleados (
+    NombreCompleto TEXT NOT NULL, RUTUsuario TEXT PRIMARY KEY, DV TEXT NOT NULL, Email TEXT,
+    Edad INTEGER, Sexo TEXT, Ciudad TEXT, Nacionalidad TEXT, Version INTEGER);
+CREATE TABLE IF NOT EXISTS UsuarioColaborador (
+    RUTUsuario TEXT PRIMARY KEY REFERENCES Empleados(RUTUsuario), DV TEXT NOT NULL, Email TEXT,
+    Contraseña TEXT, Direccion TEXT, NumeroTelefono TEXT, Version INTEGER);
+CREATE TABLE IF NOT EXISTS Hijos (
+    RUTUsuario TEXT NOT NULL REFERENCES Empleados(RUTUsuario), NombreCompletoHijo TEXT,
+    FechaNacimientoHijo TEXT NOT NULL, EsEstudiante BLOB, Version INTEGER);
+CREATE TABLE IF NOT EXISTS UsuarioSocio (
+    NombreSocio TEXT, ApellidoSocio TEXT, RUTSocio TEXT, TelefonoSocio TEXT, CorreoSocio TEXT,
+    EmpresaSocio TEXT, CargoSocio TEXT, CentroObraSocio TEXT, NumeroSocio TEXT, ContraseñaSocio TEXT,
+    Direccion TEXT, NumeroTelefono TEXT);
+CREATE TABLE IF NOT EXISTS ResetCodes (
+    Id INTEGER PRIMARY KEY AUTOINCREMENT, RUTUsuario TEXT NOT NULL,
+    Code TEXT NOT NULL, ExpirationTime TEXT NOT NULL, Used INTEGER DEFAULT 0,
+    CreatedAt TEXT DEFAULT CURRENT_TIMESTAMP, Intentos INTEGER NOT NULL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS Valoraciones (
+    IDValoracion INTEGER PRIMARY KEY AUTOINCREMENT, Usuario TEXT NOT NULL,
+    Puntuacion INTEGER NOT NULL CHECK (Puntuacion BETWEEN 1 AND 5), Comentario TEXT,
+    Fecha TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP, Clave TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS ValoracionesResumen (
+    Dia TEXT NOT NULL, Usuario TEXT NOT NULL, Cantidad INTEGER NOT NULL, Suma INTEGER NOT NULL,
+    P1 INTEGER NOT NULL, P2 INTEGER NOT NULL, P3 INTEGER NOT NULL, P4 INTEGER NOT NULL, P5 INTEGER NOT NULL,
+    PRIMARY KEY (Dia, Usuario));
+"""
+
+# ROWVERSION de la migración 3: un contador de toda la base que cada INSERT o UPDATE de
+# Empleados, UsuarioColaborador o Hijos incrementa y copia en la columna Version de la fila
+_ROWVERSION = """
+CREATE TABLE IF NOT EXISTS RowVersion (Valor INTEGER NOT NULL);
+INSERT INTO RowVersion SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM RowVersion);
+""" + "".join(f"""
+CREATE TRIGGER IF NOT EXISTS {tabla}_Version_{evento} AFTER {evento} ON {tabla}
+BEGIN
+    UPDATE RowVersion SET Valor = Valor + 1;
+    UPDATE {tabla} SET Version = (SELECT Valor FROM RowVersion) WHERE rowid = NEW.rowid;
+END;""" for tabla in ("Empleados", "UsuarioColaborador", "Hijos") for evento in ("INSERT", "UPDATE"))
+
+# Claves e índices de la migración 1 del script (SQLite no tiene INCLUDE ni índices agrupados)
+INDICES = {
+    "PK_UsuarioSocio": "CREATE UNIQUE INDEX IF NOT EXISTS PK_UsuarioSocio ON UsuarioSocio (RUTSocio)",
+    "IX_UsuarioSocio_CorreoSocio": "CREATE INDEX IF NOT EXISTS IX_UsuarioSocio_CorreoSocio ON UsuarioSocio (CorreoSocio)",
+    "IX_UsuarioColaborador_Email": "CREATE INDEX IF NOT EXISTS IX_UsuarioColaborador_Email ON UsuarioColaborador (Email)",
+    "IX_Empleados_Email": "CREATE INDEX IF NOT EXISTS IX_Empleados_Email ON Empleados (Email)",
+    "IX_Hijos_RUTUsuario": "CREATE INDEX IF NOT EXISTS IX_Hijos_RUTUsuario ON Hijos (RUTUsuario)",
+    "IX_ResetCodes_RUTUsuario_Code": "CREATE INDEX IF NOT EXISTS IX_ResetCodes_RUTUsuario_Code ON ResetCodes (RUTUsuario, Code)",
+    # Migración 2
+    "IX_ResetCodes_ExpirationTime": "CREATE INDEX IF NOT EXISTS IX_ResetCodes_ExpirationTime ON ResetCodes (ExpirationTime)",
+}
+
+_INSERTAR_HIJO = ("INSERT INTO Hijos (RUTUsuario, NombreCompletoHijo, FechaNacimientoHijo, EsEstudiante) "
+                  "VALUES (?, ?, ?, ?)")
+
+RUT_BASE = 10000000
+RUT_SOCIO_BASE = 30000000
+
+
+def digito_verificador(rut):
+    """Dígito verificador (módulo 11) de un RUT sin DV."""
+    suma, factor = 0, 2
+    for digito in reversed(str(rut)):
+        suma += int(digito) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    return "0" if resto == 11 else "k" if resto == 10 else str(resto)
+
+
+def crear_base(ruta, usuarios=1000, sin_registrar=1000, hijos_por_usuario=2, hash_contrasena=None,
+               socios=0, indices=True):
+    """Crea y puebla la base SQLite.
+
+    - `usuarios` empleados registrados como colaboradores (RUT_BASE ...), con teléfono e hijos.
+    - `sin_registrar` empleados adicionales sin cuenta, para medir el registro.
+    - `socios` usuarios en UsuarioSocio (RUT_SOCIO_BASE ...).
+    `hash_contrasena` es el valor de Contraseña para todos los colaboradores. Con
+    `indices=False` la base queda sin los índices de la migración 1."""
+    conn = sqlite3.connect(ruta)
+    conn.executescript(_ESQUEMA)
+    conn.executescript(_ROWVERSION)
+    if indices:
+        for sql in INDICES.values():
+            conn.execute(sql)
+    conn.execute("PRAGMA journal_mode=WAL")
+    empleados, colaboradores, hijos = [], [], []
+
+    def insertar():
+        conn.executemany("INSERT OR IGNORE INTO Empleados (NombreCompleto, RUTUsuario, DV, Email, Edad, Sexo, "
+                         "Ciudad, Nacionalidad) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", empleados)
+        conn.executemany("INSERT OR IGNORE INTO UsuarioColaborador (RUTUsuario, DV, Email, Contraseña, Direccion, "
+                         "NumeroTelefono) VALUES (?, ?, ?, ?, ?, ?)", colaboradores)
+        conn.executemany(_INSERTAR_HIJO, hijos)
+        del empleados[:], colaboradores[:], hijos[:]
+
+    for i in range(usuarios + sin_registrar):
+        rut = str(RUT_BASE + i)
+        email = f"empleado{i}@construye.cl"
+        empleados.append((f"Empleado Prueba {i}", rut, digito_verificador(rut), email,
+                          30 + i % 30, "M" if i % 2 else "F", "Santiago", "Chilena"))
+        if i < usuarios:
+            colaboradores.append((rut, digito_verificador(rut), email, hash_contrasena,
+                                  f"Calle {i}", f"+569{RUT_BASE + i:08d}"[-12:]))
+            for h in range(hijos_por_usuario):
+                hijos.append((rut, f"Hijo {h} de {i}", f"201{h % 10}-0{1 + h % 9}-15", b"\x00\x01"))
+        # En bloques, para poblar bases de millones de filas sin tenerlas todas en memoria
+        if len(empleados) >= 50000:
+            insertar()
+    insertar()
+    conn.executemany("INSERT INTO UsuarioSocio VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (
+        (f"Socio {i}", "Prueba", str(RUT_SOCIO_BASE + i), f"+562{i:08d}", f"socio{i}@empresa.cl",
+         "Empresa", "Gerente", "Obra", str(i), hash_contrasena, f"Avenida {i}", f"+568{i:08d}")
+        for i in range(socios)))
+    conn.commit()
+    conn.close()
+
+
+# --- Procedimientos almacenados ------------------------------------------------
+# Cada uno recibe la conexión SQLite y los parámetros, y devuelve (filas, nombres, rowcount, mensajes).
+
+def _consulta(db, sql, params):
+    cur = db.execute(sql, params)
+    nombres = [d[0] for d in cur.description] if cur.description else []
+    return cur.fetchall(), nombres
+
+
+def _a_fecha(valor):
+    if isinstance(valor, datetime.date):
+        return valor.isoformat()
+    for formato in ("%d/%m/%Y", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(valor, formato).date().isoformat()
+        except (TypeError, ValueError):
+            pass
+    raise DatabaseError("22007", f"Conversion failed when converting date: {valor!r}")
+
+
+def _binario(valor):
+    if valor is None:
+        return None
+    return int(valor).to_bytes(2, "big")
+
+
+def _login_usuario(db, identificador):
+    # TOP (1) WITH TIES ... ORDER BY Origen: solo las filas del primer origen que coincide
+    filas, nombres = _consulta(db, """
+        SELECT RUTUsuario, Contraseña, Email, Origen FROM (
+            SELECT *, RANK() OVER (ORDER BY Origen) AS Puesto FROM (
+                SELECT 0 AS Origen, RUTSocio AS RUTUsuario, ContraseñaSocio AS Contraseña, CorreoSocio AS Email
+                FROM UsuarioSocio WHERE RUTSocio = :i
+                UNION ALL
+                SELECT 0, RUTSocio, ContraseñaSocio, CorreoSocio
+                FROM UsuarioSocio WHERE CorreoSocio = :i AND RUTSocio <> :i
+                UNION ALL
+                SELECT 1, RUTUsuario, Contraseña, Email FROM UsuarioColaborador WHERE RUTUsuario = :i
+                UNION ALL
+                SELECT 1, RUTUsuario, Contraseña, Email
+                FROM UsuarioColaborador WHERE Email = :i AND RUTUsuario <> :i))
+        WHERE Puesto = 1""", {"i": identificador})
+    return filas, nombres, -1, []
+
+
+def _version(valor):
+    """La versión como la devuelve pyodbc para ROWVERSION: 8 bytes."""
+    return None if valor is None else valor.to_bytes(8, "big")
+
+
+_PERFIL = """
+    SELECT e.NombreCompleto, e.RUTUsuario, e.DV, e.Email, e.Edad, e.Sexo, e.Ciudad, e.Nacionalidad,
+           uc.NumeroTelefono, IFNULL(uc.Direccion, 'No Registra') AS Direccion,
+           MAX(e.Version, IFNULL(uc.Version, 0)) AS Version
+    FROM Empleados e LEFT JOIN UsuarioColaborador uc ON e.RUTUsuario = uc.RUTUsuario"""
+
+
+def _perfiles_con_version(db, where, params):
+    filas, nombres = _consulta(db, f"{_PERFIL} WHERE {where}", params)
+    return [tuple(f[:-1]) + (_version(f[-1]),) for f in filas], nombres, -1, []
+
+
+def _obtener_perfil(db, rut):
+    return _perfiles_con_version(db, "e.RUTUsuario = ?", (rut,))
+
+
+def _version_perfil(db, rut):
+    filas, nombres = _consulta(db, """
+        SELECT MAX(e.Version, IFNULL(uc.Version, 0)) AS Version
+        FROM Empleados e LEFT JOIN UsuarioColaborador uc ON e.RUTUsuario = uc.RUTUsuario
+        WHERE e.RUTUsuario = ?""", (rut,))
+    return [(_version(v),) for (v,) in filas], nombres, -1, []
+
+
+def _obtener_perfiles_lote(db, filas_tvp):
+    ruts = [rut for (rut,) in filas_tvp]
+    if not ruts:
+        return [], [], -1, []
+    return _perfiles_con_version(db, f"e.RUTUsuario IN ({', '.join('?' * len(ruts))})", ruts)
+
+
+def _get_hijos(db, rut):
+    filas, nombres = _consulta(db, """
+        SELECT RUTUsuario, NombreCompletoHijo, FechaNacimientoHijo, EsEstudiante, Version
+        FROM Hijos WHERE RUTUsuario = ?""", (rut,))
+    filas = [(r[0], r[1], datetime.date.fromisoformat(r[2]), r[3], _version(r[4])) for r in filas]
+    return filas, nombres, -1, []
+
+
+def _version_hijos(db, rut):
+    (cantidad, version), = db.execute("SELECT COUNT(*), MAX(Version) FROM Hijos WHERE RUTUsuario = ?",
+                                      (rut,)).fetchall()
+    return [(cantidad, _version(version))], ["Cantidad", "Version"], -1, []
+
+
+def _actualizar_contrasena(db, rut, anterior, nueva):
+    cur = db.execute("UPDATE UsuarioColaborador SET Contraseña = ? WHERE RUTUsuario = ? AND Contraseña = ?",
+                     (nueva, rut, anterior))
+    return [(cur.rowcount,)], ["Actualizadas"], -1, []
+
+
+def _cambiar_contrasena(db, rut, nueva):
+    cur = db.execute("UPDATE UsuarioSocio SET ContraseñaSocio = ? WHERE RUTSocio = ?", (nueva, rut))
+    if cur.rowcount == 0:
+        cur = db.execute("UPDATE UsuarioColaborador SET Contraseña = ? WHERE RUTUsuario = ?", (nueva, rut))
+    return [(cur.rowcount,)], ["Actualizadas"], -1, []
+
+
+def _estado_colaboradores_lote(db, filas_tvp):
+    resultado = []
+    for (rut,) in filas_tvp:
+        if not _empleado_existe(db, rut):
+            estado = "no_existe"
+        elif db.execute("SELECT 1 FROM UsuarioColaborador WHERE RUTUsuario = ?", (rut,)).fetchone():
+            estado = "ya_registrado"
+        else:
+            estado = "pendiente"
+        resultado.append((rut, estado))
+    return resultado, ["RUTUsuario", "Resultado"], -1, []
+
+
+def _registrar_colaboradores_lote(db, filas_tvp):
+    resultado = []
+    for rut, contrasena, direccion, telefono in filas_tvp:
+        cur = db.execute("""
+            INSERT INTO UsuarioColaborador (RUTUsuario, DV, Email, Contraseña, Direccion, NumeroTelefono)
+            SELECT RUTUsuario, DV, Email, ?, ?, ? FROM Empleados e WHERE RUTUsuario = ?
+            AND NOT EXISTS (SELECT 1 FROM UsuarioColaborador uc WHERE uc.RUTUsuario = e.RUTUsuario)""",
+            (contrasena, direccion, telefono, rut))
+        if cur.rowcount > 0:
+            estado = "registrado"
+        else:
+            estado = "ya_registrado" if _empleado_existe(db, rut) else "no_existe"
+        resultado.append((rut, estado))
+    return resultado, ["RUTUsuario", "Resultado"], -1, []
+
+
+def _importar_empleado(db, nombre, rut, dv, email, edad, sexo, ciudad, nacionalidad):
+    db.execute("""
+        INSERT INTO Empleados (NombreCompleto, RUTUsuario, DV, Email, Edad, Sexo, Ciudad, Nacionalidad)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (RUTUsuario) DO UPDATE SET
+            NombreCompleto = excluded.NombreCompleto, DV = excluded.DV, Email = excluded.Email,
+            Edad = excluded.Edad, Sexo = excluded.Sexo, Ciudad = excluded.Ciudad,
+            Nacionalidad = excluded.Nacionalidad""",
+        (nombre, rut, dv, email, edad, sexo, ciudad, nacionalidad))
+    return [], [], -1, []
+
+
+def _exportar_empleados(db, desde, limite):
+    filas, nombres = _consulta(db, """
+        SELECT e.RUTUsuario, e.DV, e.NombreCompleto, e.Email, e.Edad, e.Sexo, e.Ciudad, e.Nacionalidad,
+               uc.RUTUsuario IS NOT NULL AS Colaborador, uc.Direccion, uc.NumeroTelefono
+        FROM Empleados e LEFT JOIN UsuarioColaborador uc ON e.RUTUsuario = uc.RUTUsuario
+        WHERE e.RUTUsuario > ? ORDER BY e.RUTUsuario LIMIT ?""", (desde, limite))
+    return filas, nombres, -1, []
+
+
+def _exportar_hijos(db, desde, limite):
+    filas, nombres = _consulta(db, """
+        SELECT e.RUTUsuario, h.NombreCompletoHijo, h.FechaNacimientoHijo, h.EsEstudiante
+        FROM (SELECT RUTUsuario FROM Empleados WHERE RUTUsuario > ? ORDER BY RUTUsuario LIMIT ?) e
+        LEFT JOIN Hijos h ON h.RUTUsuario = e.RUTUsuario
+        ORDER BY e.RUTUsuario""", (desde, limite))
+    filas = [(r[0], r[1], datetime.date.fromisoformat(r[2]) if r[2] else None, r[3]) for r in filas]
+    return filas, nombres, -1, []
+
+
+def _empleado_existe(db, rut):
+    return db.execute("SELECT 1 FROM Empleados WHERE RUTUsuario = ?", (rut,)).fetchone() is not None
+
+
+def _registrar_hijos(db, rut, nombre, fecha, es_estudiante):
+    if not _empleado_existe(db, rut):
+        return [], [], -1, [("[01000] (0)", "El RUTUsuario no existe en la tabla Empleados.")]
+    db.execute(_INSERTAR_HIJO, (rut, nombre, _a_fecha(fecha), _binario(es_estudiante)))
+    return [], [], 1, [("[01000] (0)", "Registro insertado correctamente en Hijos.")]
+
+
+def _registrar_hijos_lote(db, rut, filas_tvp):
+    insertados = 0
+    if _empleado_existe(db, rut):
+        db.executemany(_INSERTAR_HIJO,
+                       [(rut, nombre, _a_fecha(fecha), _binario(es)) for nombre, fecha, es in filas_tvp])
+        insertados = len(filas_tvp)
+    return [(insertados,)], ["Insertados"], -1, []
+
+
+def _get_user_phone(db, identificador):
+    filas, nombres = _consulta(db, """
+        SELECT uc.NumeroTelefono FROM UsuarioColaborador uc WHERE uc.RUTUsuario = :i
+        UNION
+        SELECT uc.NumeroTelefono FROM Empleados e JOIN UsuarioColaborador uc ON e.RUTUsuario = uc.RUTUsuario
+        WHERE e.Email = :i
+        UNION
+        SELECT us.NumeroTelefono FROM UsuarioSocio us WHERE us.RUTSocio = :i
+        UNION
+        SELECT us.NumeroTelefono FROM UsuarioSocio us WHERE us.CorreoSocio = :i""", {"i": identificador})
+    return filas, nombres, -1, []
+
+
+def _save_reset_code(db, rut, code, minutos=15):
+    expira = (datetime.datetime.now() + datetime.timedelta(minutes=int(minutos))).isoformat(" ")
+    try:
+        db.execute("INSERT INTO ResetCodes (RUTUsuario, Code, ExpirationTime) VALUES (?, ?, ?)", (rut, code, expira))
+    except sqlite3.IntegrityError as e:
+        raise IntegrityError("23000", str(e))
+    return [], [], 1, []
+
+
+def _validate_reset_code(db, rut, code):
+    cur = db.execute("""
+        UPDATE ResetCodes SET Used = 1
+        WHERE RUTUsuario = ? AND Code = ? AND ExpirationTime > ? AND Used = 0""",
+        (rut, code, datetime.datetime.now().isoformat(" ")))
+    return [(cur.rowcount,)], ["IsValid"], -1, []
+
+
+def _ahora():
+    return datetime.datetime.now().isoformat(" ")
+
+
+def _buscar_usuario_reset(db, identificador):
+    filas, nombres = _consulta(db, """
+        SELECT RUTUsuario, NumeroTelefono FROM (
+            SELECT 0 AS Origen, RUTSocio AS RUTUsuario, NumeroTelefono FROM UsuarioSocio WHERE RUTSocio = :i
+            UNION ALL
+            SELECT 0, RUTSocio, NumeroTelefono FROM UsuarioSocio WHERE CorreoSocio = :i
+            UNION ALL
+            SELECT 1, RUTUsuario, NumeroTelefono FROM UsuarioColaborador WHERE RUTUsuario = :i
+            UNION ALL
+            SELECT 1, RUTUsuario, NumeroTelefono FROM UsuarioColaborador WHERE Email = :i)
+        ORDER BY Origen LIMIT 1""", {"i": identificador})
+    return filas, nombres, -1, []
+
+
+def _guardar_codigo_reset(db, rut, code, minutos=15):
+    db.execute("DELETE FROM ResetCodes WHERE RUTUsuario = ?", (rut,))
+    _save_reset_code(db, rut, code, minutos)
+    return [db.execute("SELECT last_insert_rowid()").fetchone()], ["Id"], -1, []
+
+
+def _obtener_codigo_reset(db, rut):
+    filas, nombres = _consulta(db, """
+        SELECT Id, Code, Intentos FROM ResetCodes
+        WHERE RUTUsuario = ? AND Used = 0 AND ExpirationTime > ? ORDER BY Id DESC LIMIT 1""", (rut, _ahora()))
+    return filas, nombres, -1, []
+
+
+def _consumir_codigo_reset(db, id):
+    ahora = _ahora()
+    cur = db.execute("UPDATE ResetCodes SET Used = 1, ExpirationTime = ? WHERE Id = ? AND Used = 0 AND ExpirationTime > ?",
+                     (ahora, id, ahora))
+    return [(cur.rowcount,)], ["Consumidos"], -1, []
+
+
+def _fallar_codigo_reset(db, id, max_intentos):
+    ahora = _ahora()
+    filas, nombres = _consulta(db, """
+        UPDATE ResetCodes SET Intentos = Intentos + 1,
+            Used = CASE WHEN Intentos + 1 >= :max THEN 1 ELSE Used END,
+            ExpirationTime = CASE WHEN Intentos + 1 >= :max THEN :ahora ELSE ExpirationTime END
+        WHERE Id = :id AND Used = 0 AND ExpirationTime > :ahora
+        RETURNING Intentos""", {"id": id, "max": max_intentos, "ahora": ahora})
+    return filas, nombres, -1, []
+
+
+def _purgar_reset_codes(db, lote=5000):
+    total = 0
+    while True:
+        cur = db.execute("""DELETE FROM ResetCodes WHERE Id IN (
+            SELECT Id FROM ResetCodes WHERE ExpirationTime <= ? LIMIT ?)""", (_ahora(), lote))
+        total += cur.rowcount
+        if cur.rowcount <= 0:
+            return [(total,)], ["Borrados"], -1, []
+
+
+def _registrar_usuario_colaborador(db, rut, contrasena, direccion, telefono):
+    if not _empleado_existe(db, rut):
+        return [], [], -1, [("[01000] (0)", "El RUT no existe en la tabla Empleados.")]
+    if db.execute("SELECT 1 FROM UsuarioColaborador WHERE RUTUsuario = ?", (rut,)).fetchone():
+        return [], [], -1, [("[01000] (0)", "El RUT ya está registrado en UsuarioLogin.")]
+    cur = db.execute("""
+        INSERT INTO UsuarioColaborador (RUTUsuario, DV, Email, Contraseña, Direccion, NumeroTelefono)
+        SELECT RUTUsuario, DV, Email, ?, ?, ? FROM Empleados WHERE RUTUsuario = ?""",
+        (contrasena, direccion, telefono, rut))
+    return [], [], cur.rowcount, [("[01000] (0)", "Usuario registrado exitosamente.")]
+
+
+def _registrar_valoraciones_lote(db, filas_tvp):
+    deltas = {}
+    for clave, usuario, puntuacion, comentario, fecha in filas_tvp:
+        if db.execute("SELECT 1 FROM Valoraciones WHERE Clave = ?", (clave,)).fetchone():
+            continue
+        db.execute("INSERT INTO Valoraciones (Usuario, Puntuacion, Comentario, Fecha, Clave) VALUES (?, ?, ?, ?, ?)",
+                   (usuario, puntuacion, comentario, fecha.isoformat(" "), clave))
+        delta = deltas.setdefault((fecha.date().isoformat(), usuario), [0] * 7)
+        delta[0] += 1
+        delta[1] += puntuacion
+        delta[1 + puntuacion] += 1
+    db.executemany("""
+        INSERT INTO ValoracionesResumen (Dia, Usuario, Cantidad, Suma, P1, P2, P3, P4, P5)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (Dia, Usuario) DO UPDATE SET
+            Cantidad = Cantidad + excluded.Cantidad, Suma = Suma + excluded.Suma,
+            P1 = P1 + excluded.P1, P2 = P2 + excluded.P2, P3 = P3 + excluded.P3,
+            P4 = P4 + excluded.P4, P5 = P5 + excluded.P5""",
+        [(dia, usuario, *delta) for (dia, usuario), delta in deltas.items()])
+    return [(sum(d[0] for d in deltas.values()),)], ["Insertadas"], -1, []
+
+
+def _resumen_valoraciones(db, desde, hasta, usuario=None):
+    # GROUPING SETS ((Dia), (Usuario), ()) como tres consultas
+    sumas = "SUM(Cantidad), SUM(Suma), SUM(P1), SUM(P2), SUM(P3), SUM(P4), SUM(P5)"
+    where = "Dia BETWEEN ? AND ? AND (? IS NULL OR Usuario = ?)"
+    params = (str(desde), str(hasta), usuario, usuario)
+    filas = []
+    for columnas, grupo in (("Dia, NULL, 0, 1", "GROUP BY Dia"), ("NULL, Usuario, 1, 0", "GROUP BY Usuario"),
+                            ("NULL, NULL, 1, 1", "")):
+        filas += db.execute(f"SELECT {columnas}, {sumas} FROM ValoracionesResumen WHERE {where} {grupo}",
+                            params).fetchall()
+    filas = [(datetime.date.fromisoformat(f[0]) if f[0] else None,) + tuple(f[1:]) for f in filas]
+    return filas, ["Dia", "Usuario", "TodosLosDias", "TodosLosUsuarios", "Cantidad", "Suma",
+                   "P1", "P2", "P3", "P4", "P5"], -1, []
+
+
+PROCEDIMIENTOS = {
+    "LoginUsuario": _login_usuario,
+    "ObtenerPerfil": _obtener_perfil,
+    "ObtenerPerfilesLote": _obtener_perfiles_lote,
+    "GetHijos": _get_hijos,
+    "VersionPerfil": _version_perfil,
+    "VersionHijos": _version_hijos,
+    "ImportarEmpleado": _importar_empleado,
+    "ActualizarContrasena": _actualizar_contrasena,
+    "CambiarContrasena": _cambiar_contrasena,
+    "EstadoColaboradoresLote": _estado_colaboradores_lote,
+    "RegistrarColaboradoresLote": _registrar_colaboradores_lote,
+    "ExportarEmpleados": _exportar_empleados,
+    "ExportarHijos": _exportar_hijos,
+    "RegistrarHijos": _registrar_hijos,
+    "RegistrarHijosLote": _registrar_hijos_lote,
+    "GetUserPhone": _get_user_phone,
+    "SaveResetCode": _save_reset_code,
+    "ValidateResetCode": _validate_reset_code,
+    "BuscarUsuarioReset": _buscar_usuario_reset,
+    "GuardarCodigoReset": _guardar_codigo_reset,
+    "ObtenerCodigoReset": _obtener_codigo_reset,
+    "ConsumirCodigoReset": _consumir_codigo_reset,
+    "FallarCodigoReset": _fallar_codigo_reset,
+    "PurgarResetCodes": _purgar_reset_codes,
+    "RegistrarUsuarioColaborador": _registrar_usuario_colaborador,
+    "RegistrarValoracionesLote": _registrar_valoraciones_lote,
+    "ResumenValoraciones": _resumen_valoraciones,
+}
+
+_CALL = re.compile(r"^\s*\{\s*CALL\s+(\w+)\s*(?:\((.*)\))?\s*\}\s*$", re.IGNORECASE | re.DOTALL)
+
+
+# --- Conexión y cursor ----------------------------------------------------------
+
+class Cursor:
+    def __init__(self, conexion):
+        self._conexion = conexion
+        self._filas = []
+        self._pos = 0
+        self.description = None
+        self.rowcount = -1
+        self.messages = []
+        self.fast_executemany = False
+
+    def _cargar(self, filas, nombres, rowcount, mensajes):
+        indices = {nombre: i for i, nombre in enumerate(nombres)}
+        self._filas = [Row(indices, f) for f in filas]
+        self._pos = 0
+        self.description = [(n, None, None, None, None, None, True) for n in nombres] or None
+        self.rowcount = rowcount
+        self.messages = mensajes
+
+    def execute(self, sql, *params):
+        if len(params) == 1 and isinstance(params[0], (tuple, list)):
+            params = tuple(params[0])
+        self._conexion._antes_de_sentencia()
+        return self._ejecutar(sql, params)
+
+    def _ejecutar(self, sql, params):
+        db = self._conexion._db
+        try:
+            llamada = _CALL.match(sql)
+            if llamada:
+                nombre = llamada.group(1)
+                proc = PROCEDIMIENTOS.get(nombre)
+                if proc is None:
+                    raise ProgrammingError("42000", f"Could not find stored procedure '{nombre}'.")
+                try:
+                    self._cargar(*proc(db, *params))
+                except TypeError as e:
+                    raise ProgrammingError("42000", f"Procedure or function {nombre} has too many arguments specified. ({e})")
+            else:
+                cur = db.execute(sql, params)
+                nombres = [d[0] for d in cur.description] if cur.description else []
+                self._cargar(cur.fetchall(), nombres, cur.rowcount, [])
+        except sqlite3.OperationalError as e:
+            raise OperationalError("HY000", str(e))
+        except sqlite3.IntegrityError as e:
+            raise IntegrityError("23000", str(e))
+        return self
+
+    def executemany(self, sql, secuencia):
+        if not self.fast_executemany:
+            for params in secuencia:
+                self.execute(sql, params)
+            return
+        # fast_executemany envía todos los parámetros en un solo viaje: una sola latencia
+        self._conexion._antes_de_sentencia()
+        for params in secuencia:
+            self._ejecutar(sql, tuple(params))
+
+    def fetchone(self):
+        if self._pos >= len(self._filas):
+            return None
+        fila = self._filas[self._pos]
+        self._pos += 1
+        return fila
+
+    def fetchmany(self, size=1):
+        filas = self._filas[self._pos:self._pos + size]
+        self._pos += len(filas)
+        return filas
+
+    def fetchall(self):
+        filas = self._filas[self._pos:]
+        self._pos = len(self._filas)
+        return filas
+
+    def nextset(self):
+        return False
+
+    def close(self):
+        self._filas = []
+
+
+class Connection:
+    def __init__(self, ruta):
+        _dormir(_config["latencia_conexion_ms"])
+        if _config["caida"]:
+            with _stats_lock:
+                stats["conexiones_fallidas"] += 1
+            raise OperationalError("08001", "Login timeout expired (caída simulada)")
+        self._db = sqlite3.connect(ruta, timeout=30, check_same_thread=False, isolation_level="DEFERRED")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self.autocommit = False
+        self.closed = False
+        with _stats_lock:
+            stats["conexiones"] += 1
+
+    def _antes_de_sentencia(self):
+        if self.closed:
+            raise ProgrammingError("08003", "Attempt to use a closed connection.")
+        _dormir(_config["latencia_ms"] + random.random() * _config["jitter_ms"])
+        with _stats_lock:
+            stats["sentencias"] += 1
+        if _config["caida"]:
+            raise OperationalError("08S01", "Communication link failure (caída simulada)")
+        if _config["tasa_fallos"] and random.random() < _config["tasa_fallos"]:
+            with _stats_lock:
+                stats["fallos_inyectados"] += 1
+            raise OperationalError("08S01", "Communication link failure (falla inyectada)")
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self._db.commit()
+
+    def rollback(self):
+        if not self.closed:
+            self._db.rollback()
+
+    def close(self):
+        if not self.closed:
+            self._db.close()
+            self.closed = True
+
+
+def connect(conn_str, **kwargs):
+    try:
+        return Connection(conn_str)
+    except sqlite3.Error as e:
+        raise OperationalError("08001", str(e))
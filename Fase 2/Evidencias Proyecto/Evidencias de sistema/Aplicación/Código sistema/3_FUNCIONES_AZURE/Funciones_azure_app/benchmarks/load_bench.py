@@ -0,0 +1,269 @@
+# load_bench.py
+#
+# Benchmark de carga de extremo a extremo: ejecuta las seis rutas de function_app.py contra
+# la base local de fake_pyodbc (SQLite) y reporta throughput y p50/p95/p99 por ruta, con la
+# concurrencia configurable. Los resultados se guardan en JSON para compararlos entre commits.
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/load_bench.py --concurrencia 16 --solicitudes 500 --latencia-ms 5
+#   python benchmarks/load_bench.py --async --salida resultados.json --comparar anterior.json
+#   python benchmarks/load_bench.py --fases   # desglose por fase (RequestTiming=1)
+
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_pyodbc
+
+PASSWORD = "Clave1234"
+SALT = b"benchsal"
+RUTAS = ["login", "registro", "perfil", "get_hijos", "save_hijos", "password_retry_sms"]
+
+
+def _hash_almacenado():
+    # Formato y parámetros actuales de contrasenas.py, para que el login no haga rehash;
+    # hashlib evita depender de scrypt para poblar
+    import contrasenas
+    params = contrasenas.ACTUALES
+    digest = hashlib.scrypt(PASSWORD.encode("utf-8"), salt=SALT, n=params.n, r=params.r, p=params.p,
+                            dklen=params.buflen, maxmem=2 * contrasenas.memoria_bytes(params))
+    return contrasenas.codificar(SALT, digest, params)
+
+
+def _preparar_entorno(args, ruta_db):
+    """Configura la aplicación para usar la base local antes de importarla."""
+    fake_pyodbc.instalar()
+    os.environ["SqlConnectionString"] = ruta_db
+    os.environ["AsyncHandlers"] = "1" if args.modo_async else "0"
+    if args.fases:
+        os.environ["RequestTiming"] = "1"
+    os.environ.setdefault("SqlPoolMaxSize", str(max(args.concurrencia, 1)))
+    os.environ.setdefault("SmsOutboxStore", "memory")
+    os.environ.setdefault("SmsSender", "fake")
+    os.environ.setdefault("SmsThrottleSeconds", "0")
+    # El generador repite usuarios: sin esto las corridas largas medirían respuestas 429
+    os.environ.setdefault("LoginRateLimit", "0")
+    # El precalentamiento al arrancar competiría con las primeras solicitudes medidas
+    os.environ.setdefault("PrewarmOnStartup", "0")
+
+
+class _Generador:
+    """Produce el cuerpo de cada solicitud por ruta, repartiendo la carga entre usuarios."""
+
+    def __init__(self, usuarios, sin_registrar):
+        self.usuarios = usuarios
+        self._contadores = {ruta: itertools.count() for ruta in RUTAS}
+        self._lock = threading.Lock()
+        self._registro = itertools.count(usuarios)
+        self._limite_registro = usuarios + sin_registrar
+        self._tokens = {}
+
+    def _rut(self, ruta):
+        with self._lock:
+            i = next(self._contadores[ruta]) % self.usuarios
+        return str(fake_pyodbc.RUT_BASE + i)
+
+    def cuerpo(self, ruta):
+        if ruta == "registro":
+            with self._lock:
+                i = next(self._registro)
+            rut = str(fake_pyodbc.RUT_BASE + min(i, self._limite_registro - 1))
+            return {"rut": f"{rut}-{fake_pyodbc.digito_verificador(rut)}", "password": PASSWORD,
+                    "direccion": "Obra 123", "numero": "+56900000000"}
+        rut = self._rut(ruta)
+        if ruta in ("login", "password_retry_sms"):
+            clave = "identifier"
+            cuerpo = {clave: f"{rut}-{fake_pyodbc.digito_verificador(rut)}"}
+            if ruta == "login":
+                cuerpo["password"] = PASSWORD
+            return cuerpo
+        if ruta == "save_hijos":
+            return {"rut": rut, "hijos": [{"nombreCompleto": "Hijo Carga", "fechaNacimiento": "15/03/2016",
+                                           "esEstudiante": True}]}
+        return {"rut": rut}
+
+    def cabeceras(self, ruta, cuerpo):
+        """Token Bearer del usuario para las rutas que lo exigen."""
+        if ruta not in ("perfil", "get_hijos", "save_hijos"):
+            return {}
+        rut = cuerpo["rut"]
+        token = self._tokens.get(rut)
+        if token is None:
+            import login_chat
+            token = self._tokens[rut] = login_chat.generate_token(rut)
+        return {"Authorization": f"Bearer {token}"}
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+def _resumen(latencias, estados, segundos):
+    errores = sum(n for estado, n in estados.items() if estado >= 500)
+    return {
+        "solicitudes": len(latencias),
+        "segundos": segundos,
+        "throughput": len(latencias) / segundos if segundos else 0.0,
+        "p50_ms": _percentil(latencias, 50),
+        "p95_ms": _percentil(latencias, 95),
+        "p99_ms": _percentil(latencias, 99),
+        "media_ms": statistics.mean(latencias) if latencias else 0.0,
+        "errores_5xx": errores,
+        "estados": {str(k): v for k, v in sorted(estados.items())},
+    }
+
+
+def _correr_sync(trigger, func, generador, ruta, n, concurrencia):
+    latencias, estados = [], {}
+    lock = threading.Lock()
+
+    def una(_):
+        cuerpo = generador.cuerpo(ruta)
+        req = func.HttpRequest(method="POST", url=f"/api/{ruta}", headers=generador.cabeceras(ruta, cuerpo),
+                               body=json.dumps(cuerpo).encode("utf-8"))
+        inicio = time.perf_counter()
+        resp = trigger(req)
+        ms = (time.perf_counter() - inicio) * 1000
+        with lock:
+            latencias.append(ms)
+            estados[resp.status_code] = estados.get(resp.status_code, 0) + 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+        list(executor.map(una, range(n)))
+    return _resumen(latencias, estados, time.perf_counter() - inicio)
+
+
+async def _correr_async(trigger, func, generador, ruta, n, concurrencia):
+    latencias, estados = [], {}
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def una():
+        async with semaforo:
+            cuerpo = generador.cuerpo(ruta)
+            req = func.HttpRequest(method="POST", url=f"/api/{ruta}", headers=generador.cabeceras(ruta, cuerpo),
+                                   body=json.dumps(cuerpo).encode("utf-8"))
+            inicio = time.perf_counter()
+            resp = await trigger(req)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            estados[resp.status_code] = estados.get(resp.status_code, 0) + 1
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una() for _ in range(n)))
+    return _resumen(latencias, estados, time.perf_counter() - inicio)
+
+
+def _imprimir_fases(fases):
+    print(f"\n{'ruta':>34} {'fase':>12} {'media ms':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for ruta, por_fase in fases.items():
+        for fase, h in por_fase.items():
+            print(f"{ruta:>34} {fase:>12} {h['media_ms']:>9.2f} {h['p50_ms']:>8} {h['p95_ms']:>8} {h['p99_ms']:>8}")
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocido"
+
+
+def _comparar(actual, anterior):
+    print(f"\nComparación con {anterior.get('commit', '?')}:")
+    print(f"{'ruta':>20} {'req/s':>18} {'p95 ms':>18}")
+    for ruta, r in actual["rutas"].items():
+        a = anterior.get("rutas", {}).get(ruta)
+        if not a:
+            continue
+        print(f"{ruta:>20} {a['throughput']:>8.1f} → {r['throughput']:<8.1f} {a['p95_ms']:>8.1f} → {r['p95_ms']:<8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga de las rutas HTTP con base SQLite local")
+    parser.add_argument("--rutas", default=",".join(RUTAS))
+    parser.add_argument("--solicitudes", type=int, default=300, help="solicitudes por ruta")
+    parser.add_argument("--concurrencia", type=int, default=8)
+    parser.add_argument("--async", dest="modo_async", action="store_true", help="usar los handlers async")
+    parser.add_argument("--usuarios", type=int, default=1000)
+    parser.add_argument("--latencia-ms", type=float, default=0.0, help="latencia simulada por sentencia")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--latencia-conexion-ms", type=float, default=0.0)
+    parser.add_argument("--tasa-fallos", type=float, default=0.0)
+    parser.add_argument("--fases", action="store_true", help="medir y reportar el tiempo por fase")
+    parser.add_argument("--base", help="archivo SQLite a usar (por defecto uno temporal)")
+    parser.add_argument("--salida", help="archivo JSON donde guardar los resultados")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix="construye_bench_")
+    ruta_db = args.base or os.path.join(directorio, "bench.db")
+    rutas = [r for r in args.rutas.split(",") if r]
+    sin_registrar = args.solicitudes if "registro" in rutas else 0
+    # Antes de _hash_almacenado: importar contrasenas carga hash_pool, async_support y timing,
+    # que leen AsyncHandlers y RequestTiming al importarse
+    _preparar_entorno(args, ruta_db)
+    if not os.path.exists(ruta_db):
+        fake_pyodbc.crear_base(ruta_db, usuarios=args.usuarios, sin_registrar=sin_registrar,
+                               hash_contrasena=_hash_almacenado())
+
+    fake_pyodbc.configurar(latencia_ms=args.latencia_ms, jitter_ms=args.jitter_ms,
+                           latencia_conexion_ms=args.latencia_conexion_ms, tasa_fallos=args.tasa_fallos)
+
+    import azure.functions as func
+    import function_app
+
+    generador = _Generador(args.usuarios, sin_registrar)
+    resultados = {
+        "commit": _commit_actual(),
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("salida", "comparar", "base")},
+        "rutas": {},
+    }
+
+    print(f"{'ruta':>20} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'5xx':>5}  estados")
+    for ruta in rutas:
+        trigger = getattr(function_app, f"http_trigger_{ruta}")
+        if args.modo_async:
+            r = asyncio.run(_correr_async(trigger, func, generador, ruta, args.solicitudes, args.concurrencia))
+        else:
+            r = _correr_sync(trigger, func, generador, ruta, args.solicitudes, args.concurrencia)
+        resultados["rutas"][ruta] = r
+        print(f"{ruta:>20} {r['throughput']:>9.1f} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+              f"{r['p99_ms']:>9.2f} {r['errores_5xx']:>5}  {r['estados']}")
+
+    resultados["driver"] = dict(fake_pyodbc.stats)
+    if args.fases:
+        import timing
+        resultados["fases"] = timing.histogramas()
+        _imprimir_fases(resultados["fases"])
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            _comparar(resultados, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
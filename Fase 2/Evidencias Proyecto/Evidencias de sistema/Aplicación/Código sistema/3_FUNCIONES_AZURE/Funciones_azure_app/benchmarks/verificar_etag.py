@@ -0,0 +1,160 @@
+# verificar_etag.py
+#
+# Verifica las respuestas condicionales (ETag / If-None-Match) de http_trigger_perfil y
+# http_trigger_get_hijos sobre fake_pyodbc, que emula la ROWVERSION de la migración 3:
+#   1. la respuesta trae ETag; con If-None-Match igual responde 304 sin cuerpo
+#   2. con el registro en cache el 304 no ejecuta SQL; sin él, solo VersionPerfil/VersionHijos
+#      (no ObtenerPerfil ni GetHijos)
+#   3. el ETag cambia al modificar el registro: perfil (Empleados o UsuarioColaborador) e
+#      hijos (agregar, modificar o borrar uno), y el ETag viejo responde 200 con el nuevo
+#   4. el ETag calculado desde la cache y desde VersionPerfil/VersionHijos es el mismo
+#   5. W/"...", listas de ETags y *; la variante async
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/verificar_etag.py
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_pyodbc
+
+_fallas = []
+_llamadas = {}
+
+
+def comprobar(condicion, descripcion):
+    print(f"{'ok   ' if condicion else 'FALLA'} {descripcion}")
+    if not condicion:
+        _fallas.append(descripcion)
+
+
+def _contar_procedimientos():
+    """Cuenta las llamadas a cada procedimiento de fake_pyodbc."""
+    for nombre, proc in list(fake_pyodbc.PROCEDIMIENTOS.items()):
+        def contado(*args, _nombre=nombre, _proc=proc):
+            _llamadas[_nombre] = _llamadas.get(_nombre, 0) + 1
+            return _proc(*args)
+        fake_pyodbc.PROCEDIMIENTOS[nombre] = contado
+
+
+def main():
+    ruta_db = os.path.join(tempfile.mkdtemp(prefix="construye_etag_"), "etag.db")
+    fake_pyodbc.crear_base(ruta_db, usuarios=10, sin_registrar=2, hijos_por_usuario=3, hash_contrasena="x")
+    fake_pyodbc.instalar()
+    _contar_procedimientos()
+    os.environ.update({"SqlConnectionString": ruta_db, "AuthRequired": "0", "PrewarmOnStartup": "0"})
+
+    import azure.functions as func
+    import cache
+    import function_app
+    import hijos_chat
+    import perfil_chat
+
+    def solicitud(ruta, rut, si_none_match=None):
+        headers = {"If-None-Match": si_none_match} if si_none_match else {}
+        req = func.HttpRequest(method="POST", url=f"/api/{ruta}", headers=headers,
+                               body=json.dumps({"rut": rut}).encode("utf-8"))
+        return getattr(function_app, ruta)(req)
+
+    def sql(sentencia, *params):
+        db = sqlite3.connect(ruta_db)
+        try:
+            db.execute(sentencia, params)
+            db.commit()
+        finally:
+            db.close()
+
+    def sin_cache():
+        cache.perfiles.clear()
+        cache.hijos.clear()
+
+    for ruta, procedimiento, completo in (("http_trigger_perfil", "VersionPerfil", "ObtenerPerfil"),
+                                          ("http_trigger_get_hijos", "VersionHijos", "GetHijos")):
+        rut = str(fake_pyodbc.RUT_BASE + (1 if ruta == "http_trigger_perfil" else 2))
+
+        # 1 y 2. 304 desde la cache y desde el procedimiento de versión
+        primera = solicitud(ruta, rut)
+        etag = primera.headers.get("ETag")
+        comprobar(primera.status_code == 200 and etag and etag.startswith('"'), f"{ruta}: 200 con ETag fuerte ({etag})")
+        comprobar(primera.headers.get("Cache-Control") == "private, no-cache", f"{ruta}: Cache-Control private, no-cache")
+        sentencias = fake_pyodbc.stats["sentencias"]
+        revalidada = solicitud(ruta, rut, etag)
+        comprobar(revalidada.status_code == 304 and not revalidada.get_body() and revalidada.headers.get("ETag") == etag,
+                  f"{ruta}: If-None-Match igual responde 304 sin cuerpo")
+        comprobar(fake_pyodbc.stats["sentencias"] == sentencias, f"{ruta}: 304 desde la cache sin SQL")
+
+        sin_cache()
+        antes = dict(_llamadas)
+        revalidada = solicitud(ruta, rut, etag)
+        comprobar(revalidada.status_code == 304, f"{ruta}: sin cache, 304 con {procedimiento}")
+        comprobar(_llamadas.get(procedimiento, 0) == antes.get(procedimiento, 0) + 1
+                  and _llamadas.get(completo, 0) == antes.get(completo, 0),
+                  f"{ruta}: sin cache se ejecuta {procedimiento} y no {completo}")
+
+        # 3 y 4. Cambios en la base
+        if ruta == "http_trigger_perfil":
+            cambios = [("Empleados", "UPDATE Empleados SET Ciudad = 'Temuco' WHERE RUTUsuario = ?"),
+                       ("UsuarioColaborador", "UPDATE UsuarioColaborador SET Direccion = 'Obra 2' WHERE RUTUsuario = ?")]
+        else:
+            cambios = [("hijo nuevo", "INSERT INTO Hijos (RUTUsuario, NombreCompletoHijo, FechaNacimientoHijo) "
+                                      "VALUES (?, 'Hijo Nuevo', '2018-01-01')"),
+                       ("hijo modificado", "UPDATE Hijos SET EsEstudiante = NULL WHERE rowid = "
+                                           "(SELECT MIN(rowid) FROM Hijos WHERE RUTUsuario = ?)"),
+                       ("hijo borrado", "DELETE FROM Hijos WHERE rowid = "
+                                        "(SELECT MIN(rowid) FROM Hijos WHERE RUTUsuario = ?)")]
+        for descripcion, sentencia in cambios:
+            sql(sentencia, rut)
+            sin_cache()
+            nueva = solicitud(ruta, rut, etag)
+            nuevo_etag = nueva.headers.get("ETag")
+            comprobar(nueva.status_code == 200 and nuevo_etag and nuevo_etag != etag,
+                      f"{ruta}: cambio en {descripcion}: el ETag viejo responde 200 con uno nuevo")
+            sin_cache()
+            comprobar(solicitud(ruta, rut, nuevo_etag).status_code == 304,
+                      f"{ruta}: cambio en {descripcion}: {procedimiento} coincide con el ETag de la lectura completa")
+            etag = nuevo_etag
+
+        # 5. Formatos de If-None-Match
+        comprobar(solicitud(ruta, rut, f'"otro", W/{etag}').status_code == 304, f"{ruta}: lista con W/ coincide")
+        comprobar(solicitud(ruta, rut, "*").status_code == 304, f"{ruta}: * coincide")
+        comprobar(solicitud(ruta, rut, '"otro"').status_code == 200, f"{ruta}: otro ETag responde 200")
+
+    # Sin hijos: ETag estable, también desde VersionHijos
+    rut = str(fake_pyodbc.RUT_BASE + 10)
+    vacio = solicitud("http_trigger_get_hijos", rut)
+    sin_cache()
+    comprobar(solicitud("http_trigger_get_hijos", rut, vacio.headers.get("ETag")).status_code == 304,
+              "get_hijos sin hijos: 304 con VersionHijos")
+
+    # save_hijos invalida la cache: el ETag en cache no queda viejo
+    rut = str(fake_pyodbc.RUT_BASE + 3)
+    etag = solicitud("http_trigger_get_hijos", rut).headers.get("ETag")
+    hijos_chat.save_hijos(rut, [{"nombreCompleto": "Hijo Otro", "fechaNacimiento": "01/02/2019"}])
+    comprobar(solicitud("http_trigger_get_hijos", rut, etag).status_code == 200, "save_hijos cambia el ETag")
+
+    # Variante async
+    rut = str(fake_pyodbc.RUT_BASE + 4)
+    etag = solicitud("http_trigger_perfil", rut).headers.get("ETag")
+    sin_cache()
+    req = func.HttpRequest(method="POST", url="/api/http_trigger_perfil", headers={"If-None-Match": etag},
+                           body=json.dumps({"rut": rut}).encode("utf-8"))
+    comprobar(asyncio.run(perfil_chat.main_perfil_async(req)).status_code == 304, "async: 304 con VersionPerfil")
+    req = func.HttpRequest(method="POST", url="/api/http_trigger_get_hijos", headers={"If-None-Match": '"otro"'},
+                           body=json.dumps({"rut": rut}).encode("utf-8"))
+    comprobar(asyncio.run(hijos_chat.main_get_hijos_async(req)).status_code == 200, "async: get_hijos 200")
+
+    print(f"\n{_llamadas}\n{len(_fallas)} fallas")
+    sys.exit(1 if _fallas else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# verificar_idempotencia.py
+#
+# Verifica Idempotency-Key (idempotencia.py) en http_trigger_registro y http_trigger_save_hijos
+# sobre fake_pyodbc, con las rutas tal como las registra function_app.py:
+#   1. una repetición devuelve la misma respuesta sin sentencias SQL ni hashes nuevos
+#   2. la misma clave con otro cuerpo responde 422; una clave inválida, 400
+#   3. repeticiones simultáneas esperan a la original: RegistrarHijosLote corre una vez
+#      (sin la cabecera, los reintentos duplican los hijos)
+#   4. una respuesta 503 no se guarda: el reintento con la misma clave se ejecuta
+#   5. la variante async y el almacén SQLite compartido entre dos "procesos"
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/verificar_idempotencia.py
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_pyodbc
+
+_fallas = []
+
+
+def comprobar(condicion, descripcion):
+    print(f"{'ok   ' if condicion else 'FALLA'} {descripcion}")
+    if not condicion:
+        _fallas.append(descripcion)
+
+
+def main():
+    directorio = tempfile.mkdtemp(prefix="construye_idempotencia_")
+    ruta_db = os.path.join(directorio, "idempotencia.db")
+    fake_pyodbc.crear_base(ruta_db, usuarios=10, sin_registrar=10, hijos_por_usuario=0, hash_contrasena="x")
+    fake_pyodbc.instalar()
+    os.environ.update({"SqlConnectionString": ruta_db, "AuthRequired": "0", "PrewarmOnStartup": "0",
+                       "PasswordHashLogN": "10", "DbCircuitBreaker": "0", "RetryDeadlineSeconds": "0.1"})
+
+    import azure.functions as func
+    import function_app
+    import hash_pool
+    import hijos_chat
+    import idempotencia
+
+    def solicitud(ruta, cuerpo, clave=None):
+        headers = {idempotencia.CABECERA: clave} if clave else {}
+        req = func.HttpRequest(method="POST", url=f"/api/{ruta}", headers=headers,
+                               body=json.dumps(cuerpo).encode("utf-8"))
+        return getattr(function_app, ruta)(req)
+
+    def hijos_en_base(rut):
+        db = sqlite3.connect(ruta_db)
+        try:
+            return db.execute("SELECT COUNT(*) FROM Hijos WHERE RUTUsuario = ?", (rut,)).fetchone()[0]
+        finally:
+            db.close()
+
+    # 1. Repetición del registro
+    rut = str(fake_pyodbc.RUT_BASE + 10)
+    registro = {"rut": f"{rut}-{fake_pyodbc.digito_verificador(rut)}", "password": "Clave1234",
+                "direccion": "Obra 1", "numero": "+56911112222"}
+    primera = solicitud("http_trigger_registro", registro, "registro-1")
+    sentencias, hashes = fake_pyodbc.stats["sentencias"], hash_pool.stats()["submitted"]
+    repetida = solicitud("http_trigger_registro", registro, "registro-1")
+    comprobar(primera.status_code == 200 and repetida.status_code == 200, "registro: 200 y 200")
+    comprobar(repetida.get_body() == primera.get_body() and repetida.headers.get("Idempotent-Replayed") == "true",
+              "registro: la repetición devuelve la misma respuesta, marcada como repetida")
+    comprobar(fake_pyodbc.stats["sentencias"] == sentencias and hash_pool.stats()["submitted"] == hashes,
+              "registro: la repetición no ejecuta SQL ni scrypt")
+    sin_clave = solicitud("http_trigger_registro", registro)
+    comprobar(sin_clave.status_code == 400, "registro sin clave: se ejecuta y el RUT ya está registrado")
+
+    # 2. Conflictos
+    otro = {**registro, "direccion": "Obra 2"}
+    comprobar(solicitud("http_trigger_registro", otro, "registro-1").status_code == 422,
+              "misma clave con otro cuerpo: 422")
+    comprobar(solicitud("http_trigger_registro", registro, "x" * 300).status_code == 400, "clave demasiado larga: 400")
+
+    # 3. Repeticiones simultáneas de save_hijos, con latencia para que se solapen
+    fake_pyodbc.configurar(latencia_ms=100)
+    rut = str(fake_pyodbc.RUT_BASE + 1)
+    cuerpo = {"rut": rut, "hijos": [{"nombreCompleto": "Hijo Uno", "fechaNacimiento": "15/03/2016",
+                                     "esEstudiante": True}]}
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        respuestas = list(executor.map(lambda _: solicitud("http_trigger_save_hijos", cuerpo, "hijos-1"), range(8)))
+    comprobar(all(r.status_code == 200 for r in respuestas), "save_hijos simultáneos: todos 200")
+    comprobar(hijos_en_base(rut) == 1, f"save_hijos simultáneos: un solo hijo guardado ({hijos_en_base(rut)})")
+    comprobar(idempotencia.stats()["esperas"] >= 1, "save_hijos simultáneos: las repeticiones esperaron")
+
+    rut = str(fake_pyodbc.RUT_BASE + 2)
+    for _ in range(2):
+        solicitud("http_trigger_save_hijos", {**cuerpo, "rut": rut})
+    comprobar(hijos_en_base(rut) == 2, "sin la cabecera el reintento duplica el hijo")
+    fake_pyodbc.configurar(latencia_ms=0)
+
+    # 4. Las fallas transitorias no se guardan
+    rut = str(fake_pyodbc.RUT_BASE + 3)
+    fake_pyodbc.configurar(caida=True)
+    caida = solicitud("http_trigger_save_hijos", {**cuerpo, "rut": rut}, "hijos-2")
+    fake_pyodbc.configurar(caida=False)
+    reintento = solicitud("http_trigger_save_hijos", {**cuerpo, "rut": rut}, "hijos-2")
+    comprobar(caida.status_code == 503, f"base caída: la primera responde 503 ({caida.status_code})")
+    comprobar(reintento.status_code == 200 and hijos_en_base(rut) == 1, "el reintento con la misma clave se ejecuta")
+
+    # 5a. Variante async
+    rut = str(fake_pyodbc.RUT_BASE + 4)
+    req = func.HttpRequest(method="POST", url="/api/http_trigger_save_hijos",
+                           headers={idempotencia.CABECERA: "hijos-async"},
+                           body=json.dumps({**cuerpo, "rut": rut}).encode("utf-8"))
+
+    async def dos_veces():
+        return await asyncio.gather(*(idempotencia.ejecutar_async("http_trigger_save_hijos",
+                                                                  hijos_chat.main_save_hijos_async, req)
+                                      for _ in range(2)))
+    async_respuestas = asyncio.run(dos_veces())
+    comprobar([r.status_code for r in async_respuestas] == [200, 200] and hijos_en_base(rut) == 1,
+              "async: dos solicitudes simultáneas, un solo hijo guardado")
+
+    # 5b. Almacén SQLite compartido: dos instancias sobre el mismo archivo
+    ruta_store = os.path.join(directorio, "store.db")
+    a = idempotencia.SqliteIdempotencyStore(ruta_store, sondeo=0.01)
+    b = idempotencia.SqliteIdempotencyStore(ruta_store, sondeo=0.01)
+    comprobar(a.reservar("k", "h") == (idempotencia.NUEVA, None), "sqlite: la primera reserva es nueva")
+    comprobar(b.reservar("k", "h") == (idempotencia.EN_CURSO, None), "sqlite: el otro proceso la ve en curso")
+    comprobar(b.reservar("k", "otra") == (idempotencia.CONFLICTO, None), "sqlite: otra huella es conflicto")
+    threading.Timer(0.1, a.completar, ("k", "respuesta", 60)).start()
+    b.esperar("k", 5)
+    comprobar(b.reservar("k", "h") == (idempotencia.REPETIDA, "respuesta"), "sqlite: tras esperar, la respuesta guardada")
+    a.reservar("l", "h")
+    a.liberar("l")
+    comprobar(b.reservar("l", "h") == (idempotencia.NUEVA, None), "sqlite: una reserva liberada se puede tomar")
+
+    hash_pool.get_pool().shutdown()
+    print(f"\n{idempotencia.stats()}\n{len(_fallas)} fallas")
+    sys.exit(1 if _fallas else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# verificar_replica.py
+#
+# Verifica el ruteo de lecturas a la réplica (db_pool.lectura) con dos bases locales de
+# fake_pyodbc: el primario y una copia que hace de réplica atrasada. Para saber de dónde vino
+# cada lectura, la réplica tiene otro nombre en el perfil y no recibe las escrituras.
+#   1. perfil, hijos y teléfono se leen de la réplica; login y escrituras van al primario
+#   2. después de save_hijos y del registro, las lecturas del mismo RUT van al primario
+#      mientras dura SqlReplicaStickySeconds, y vuelven a la réplica al vencer
+#   3. SqlReadRouting manda una ruta al primario
+#   4. si la réplica no acepta conexiones las lecturas van al primario, y vuelven a la
+#      réplica cuando el circuito de la réplica se cierra
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/verificar_replica.py
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_pyodbc
+
+STICKY_SECONDS = 0.5
+BREAKER_OPEN_SECONDS = 0.5
+RUT_SIN_REGISTRO = str(fake_pyodbc.RUT_BASE + 5)
+
+_fallas = []
+
+
+def comprobar(condicion, descripcion):
+    print(f"{'ok   ' if condicion else 'FALLA'} {descripcion}")
+    if not condicion:
+        _fallas.append(descripcion)
+
+
+def _preparar():
+    directorio = tempfile.mkdtemp(prefix="construye_replica_")
+    primario = os.path.join(directorio, "primario.db")
+    replica = os.path.join(directorio, "replica.db")
+    fake_pyodbc.crear_base(primario, usuarios=5, sin_registrar=5, hijos_por_usuario=1, hash_contrasena="x")
+    shutil.copy(primario, replica)
+    db = fake_pyodbc.connect(replica)
+    db.cursor().execute("UPDATE Empleados SET NombreCompleto = 'Desde la réplica'")
+    db.commit()
+    db.close()
+
+    fake_pyodbc.instalar()
+    os.environ.update({
+        "SqlConnectionString": primario,
+        "SqlReadOnlyConnectionString": replica,
+        "SqlReplicaStickySeconds": str(STICKY_SECONDS),
+        "SqlReplicaBreakerOpenSeconds": str(BREAKER_OPEN_SECONDS),
+        "CacheTtlSeconds": "0",
+        "PasswordHashLogN": "4",
+        "HashPoolWorkers": "0",
+    })
+
+
+def main():
+    _preparar()
+    import db_pool
+    import hijos_chat
+    import password_retry_sms
+    import perfil_chat
+    import registro_chat
+
+    rut = str(fake_pyodbc.RUT_BASE)
+
+    def origen_perfil(rut):
+        _, _, perfil = perfil_chat.perfil_usuario(rut)
+        return "replica" if perfil["NombreCompleto"] == "Desde la réplica" else "primario"
+
+    def hijos(rut):
+        return [h["NombreCompletoHijo"] for h in hijos_chat.get_hijos(rut)[2]]
+
+    # 1. Ruteo por defecto
+    comprobar(origen_perfil(rut) == "replica", "perfil se lee de la réplica")
+    antes = db_pool.stats()["replica"]["lecturas"]["replica"]
+    hijos_chat.get_hijos(rut)
+    password_retry_sms.buscar_usuario(rut)
+    comprobar(db_pool.stats()["replica"]["lecturas"]["replica"] == antes + 2, "hijos y teléfono se leen de la réplica")
+
+    # 2. Read-your-writes tras save_hijos y tras el registro
+    ok, _, _ = hijos_chat.save_hijos(rut, [{"nombreCompleto": "Hijo Nuevo", "fechaNacimiento": "15/03/2016",
+                                            "esEstudiante": True}])
+    comprobar(ok, "save_hijos escribe en el primario")
+    comprobar("Hijo Nuevo" in hijos(rut), "get_hijos justo después de save_hijos ve el hijo nuevo")
+    comprobar(origen_perfil(rut) == "primario", "perfil del mismo RUT también va al primario")
+    comprobar(origen_perfil(str(fake_pyodbc.RUT_BASE + 1)) == "replica", "otros RUTs siguen en la réplica")
+    time.sleep(STICKY_SECONDS + 0.1)
+    comprobar("Hijo Nuevo" not in hijos(rut), "al vencer la ventana vuelve a la réplica (atrasada)")
+
+    ok, mensaje = registro_chat.register_usuario_colaborador(RUT_SIN_REGISTRO, "Clave1234", "Obra 1", "+56911112222")
+    comprobar(ok, f"registro en el primario ({mensaje})")
+    usuario, _ = password_retry_sms.buscar_usuario(RUT_SIN_REGISTRO)
+    comprobar(usuario is not None and usuario[1] == "+56911112222",
+              "el teléfono recién registrado se encuentra (lectura en el primario)")
+
+    # 3. Ruta forzada al primario
+    db_pool._routing = db_pool._parse_routing("perfil=primary")
+    comprobar(origen_perfil(str(fake_pyodbc.RUT_BASE + 2)) == "primario", "SqlReadRouting perfil=primary")
+    comprobar(hijos_chat.get_hijos(str(fake_pyodbc.RUT_BASE + 2))[0], "hijos sigue en la réplica")
+    db_pool._routing = {}
+
+    # 4. Réplica caída: se cierran sus conexiones y no puede abrir nuevas
+    replica = db_pool.get_replica_pool()
+    ruta_replica = replica.conn_str
+    replica.close()
+    replica.conn_str = os.path.join(os.path.dirname(ruta_replica), "no-existe", "replica.db")
+    fallback = db_pool.stats()["replica"]["lecturas"]["fallback"]
+    comprobar(origen_perfil(str(fake_pyodbc.RUT_BASE + 3)) == "primario", "réplica caída: perfil desde el primario")
+    comprobar(origen_perfil(str(fake_pyodbc.RUT_BASE + 3)) == "primario", "circuito de la réplica abierto: primario")
+    estado = db_pool.stats()["replica"]
+    comprobar(estado["lecturas"]["fallback"] == fallback + 2 and estado["breaker"]["estado"] == "abierto",
+              "fallback contado y circuito de la réplica abierto")
+    comprobar(db_pool.breaker.stats()["estado"] == "cerrado", "el circuito del primario no se ve afectado")
+
+    replica.conn_str = ruta_replica
+    time.sleep(BREAKER_OPEN_SECONDS + 0.1)
+    comprobar(origen_perfil(str(fake_pyodbc.RUT_BASE + 3)) == "replica", "réplica de vuelta tras cerrar el circuito")
+
+    print(f"\n{len(_fallas)} fallas")
+    sys.exit(1 if _fallas else 0)
+
+
+if __name__ == "__main__":
+    main()
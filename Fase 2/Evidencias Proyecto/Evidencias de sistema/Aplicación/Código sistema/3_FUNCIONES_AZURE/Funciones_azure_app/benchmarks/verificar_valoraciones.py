@@ -0,0 +1,266 @@
+# verificar_valoraciones.py
+#
+# Verifica la escritura diferida de valoraciones (valoraciones.py) y su resumen incremental
+# sobre fake_pyodbc:
+#   1. aritmética de Resumen: cantidad, promedio y distribución contra statistics y Counter, y
+#      combinar resúmenes parciales da lo mismo que agregar todo junto
+#   2. http_trigger_valoracion responde 202 y el hilo escribe todo; ValoracionesResumen coincide
+#      con recalcularlo desde Valoraciones (por día y usuario), y el panel con lo enviado
+#   3. el vaciado por tamaño de lote, por tiempo y al detener el buffer
+#   4. con la base caída las valoraciones quedan en el buffer y se escriben al volver; si la
+#      confirmación de un lote se pierde, el reintento no duplica filas ni el resumen
+#   5. con el buffer lleno la ruta responde 503; validaciones y rango del panel
+#   6. un proceso que termina normalmente escribe lo pendiente (atexit)
+#   7. MemoryValoracionesStore da el mismo resumen que SQL
+#
+# Uso (desde Funciones_azure_app):
+#   python benchmarks/verificar_valoraciones.py
+
+import collections
+import datetime
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fake_pyodbc
+
+USUARIOS = [str(fake_pyodbc.RUT_BASE + i) for i in range(6)]
+
+_fallas = []
+
+
+def comprobar(condicion, descripcion):
+    print(f"{'ok   ' if condicion else 'FALLA'} {descripcion}")
+    if not condicion:
+        _fallas.append(descripcion)
+
+
+def esperar(condicion, segundos=3):
+    limite = time.monotonic() + segundos
+    while not condicion() and time.monotonic() < limite:
+        time.sleep(0.02)
+    return condicion()
+
+
+def _aritmetica(valoraciones):
+    azar = random.Random(7)
+    puntuaciones = [azar.randint(1, 5) for _ in range(1000)]
+    todo = valoraciones.Resumen()
+    for p in puntuaciones:
+        todo.agregar(p)
+    conteo = collections.Counter(puntuaciones)
+    comprobar(todo.cantidad == len(puntuaciones) and todo.suma == sum(puntuaciones), "resumen: cantidad y suma")
+    comprobar(abs(todo.promedio - statistics.mean(puntuaciones)) < 1e-12, "resumen: promedio = statistics.mean")
+    comprobar(todo.distribucion == [conteo[i] for i in range(1, 6)], "resumen: distribución = Counter")
+
+    partes = []
+    for i in range(0, len(puntuaciones), 137):
+        parcial = valoraciones.Resumen()
+        for p in puntuaciones[i:i + 137]:
+            parcial.agregar(p)
+        partes.append(parcial)
+    combinado = valoraciones.Resumen()
+    for parcial in reversed(partes):
+        combinado.combinar(parcial)
+    comprobar(combinado == todo, "resumen: combinar parciales (en cualquier orden) = agregar todo")
+    vacio = valoraciones.Resumen().a_dict()
+    comprobar(vacio["cantidad"] == 0 and vacio["promedio"] is None, "resumen vacío: promedio None, no división por cero")
+
+
+def _recalcular(ruta_db):
+    """ValoracionesResumen recalculado desde Valoraciones (lo que el resumen incremental evita)."""
+    db = sqlite3.connect(ruta_db)
+    try:
+        esperado = {(dia, usuario): [c, s, *p] for dia, usuario, c, s, *p in db.execute("""
+            SELECT substr(Fecha, 1, 10), Usuario, COUNT(*), SUM(Puntuacion),
+                   SUM(Puntuacion = 1), SUM(Puntuacion = 2), SUM(Puntuacion = 3),
+                   SUM(Puntuacion = 4), SUM(Puntuacion = 5)
+            FROM Valoraciones GROUP BY substr(Fecha, 1, 10), Usuario""")}
+        resumen = {(dia, usuario): list(resto) for dia, usuario, *resto in
+                   db.execute("SELECT * FROM ValoracionesResumen")}
+        filas = db.execute("SELECT COUNT(*) FROM Valoraciones").fetchone()[0]
+        return esperado, resumen, filas
+    finally:
+        db.close()
+
+
+def main():
+    directorio = tempfile.mkdtemp(prefix="construye_valoraciones_")
+    ruta_db = os.path.join(directorio, "valoraciones.db")
+    fake_pyodbc.crear_base(ruta_db, usuarios=10, sin_registrar=0, hijos_por_usuario=0, hash_contrasena="x")
+    fake_pyodbc.instalar()
+    os.environ.update({"SqlConnectionString": ruta_db, "AuthRequired": "0", "PrewarmOnStartup": "0",
+                       "DbCircuitBreaker": "0", "RetryBaseDelaySeconds": "0.01",
+                       "ValoracionesBatchSize": "50", "ValoracionesFlushSeconds": "0.3"})
+
+    import azure.functions as func
+    import function_app
+    import valoraciones
+
+    def solicitud(ruta, cuerpo):
+        req = func.HttpRequest(method="POST", url=f"/api/{ruta}", headers={},
+                               body=json.dumps(cuerpo).encode("utf-8") if cuerpo is not None else b"")
+        return getattr(function_app, ruta)(req)
+
+    # 1. Aritmética
+    _aritmetica(valoraciones)
+
+    # 2. Ruta, hilo escritor y resumen
+    azar = random.Random(11)
+    enviadas = [(azar.choice(USUARIOS), azar.randint(1, 5)) for _ in range(120)]
+    estados = collections.Counter(solicitud("http_trigger_valoracion", {"rut": rut, "puntuacion": p,
+                                                                        "comentario": "Buena atención"}).status_code
+                                  for rut, p in enviadas)
+    comprobar(estados == {202: 120}, f"ruta: 120 respuestas 202 ({dict(estados)})")
+    buffer = valoraciones.get_buffer()
+    comprobar(esperar(lambda: buffer.pendientes() == 0 and buffer.stats()["guardadas"] == 120),
+              f"hilo: las 120 valoraciones se escriben ({buffer.stats()})")
+    comprobar(buffer.stats()["lotes"] >= 3, "hilo: en lotes de a lo más 50")
+
+    # Otros días, directo al buffer
+    for dias in range(1, 4):
+        fecha = valoraciones._ahora() - datetime.timedelta(days=dias)
+        for rut in USUARIOS[:3]:
+            p = azar.randint(1, 5)
+            buffer.agregar(valoraciones.Valoracion(str(dias) + rut + "-" + str(p), rut, p, None, fecha))
+            enviadas.append((rut, p))
+    buffer.vaciar()
+    esperado, resumen, filas = _recalcular(ruta_db)
+    comprobar(filas == len(enviadas) and resumen == esperado,
+              f"ValoracionesResumen = recalcular desde Valoraciones ({len(resumen)} grupos día-usuario)")
+
+    panel = solicitud("http_trigger_valoraciones_resumen", None)
+    informe = json.loads(panel.get_body())
+    total = valoraciones.Resumen()
+    for _, p in enviadas:
+        total.agregar(p)
+    comprobar(panel.status_code == 200 and informe["total"] == total.a_dict(),
+              f"panel: total = lo enviado ({informe['total']['cantidad']}, promedio {informe['total']['promedio']})")
+    comprobar(len(informe["por_dia"]) == 4 and sum(d["cantidad"] for d in informe["por_dia"]) == len(enviadas),
+              "panel: 4 días que suman el total")
+    por_usuario = {u["usuario"]: u["cantidad"] for u in informe["por_usuario"]}
+    comprobar(por_usuario == dict(collections.Counter(rut for rut, _ in enviadas)), "panel: cantidad por usuario")
+    rut = USUARIOS[0]
+    solo = json.loads(solicitud("http_trigger_valoraciones_resumen", {"usuario": rut}).get_body())
+    comprobar(solo["total"]["cantidad"] == por_usuario[rut] and [u["usuario"] for u in solo["por_usuario"]] == [rut],
+              "panel: filtro por usuario")
+
+    # 3. Vaciado por tamaño, por tiempo y al detener
+    store = valoraciones.SqlValoracionesStore()
+
+    def nueva(p=4):
+        return valoraciones.Valoracion(os.urandom(8).hex(), USUARIOS[1], p, None, valoraciones._ahora())
+
+    buffer = valoraciones.configurar(store, tamano_lote=10, intervalo=60)
+    for _ in range(10):
+        buffer.agregar(nueva())
+    comprobar(esperar(lambda: buffer.stats()["guardadas"] == 10, 1), "lote completo: se escribe sin esperar el intervalo")
+    for _ in range(3):
+        buffer.agregar(nueva())
+    time.sleep(0.3)
+    comprobar(buffer.pendientes() == 3, "lote incompleto: espera el intervalo")
+    buffer.detener()
+    comprobar(buffer.pendientes() == 0 and buffer.stats()["guardadas"] == 13, "detener escribe lo pendiente")
+
+    buffer = valoraciones.configurar(store, tamano_lote=1000, intervalo=0.2)
+    for _ in range(3):
+        buffer.agregar(nueva())
+    comprobar(esperar(lambda: buffer.stats()["guardadas"] == 3, 1), "intervalo: un lote incompleto se escribe al vencer")
+
+    # 4. Base caída y confirmación perdida
+    buffer = valoraciones.configurar(store, tamano_lote=4, intervalo=60)
+    fake_pyodbc.configurar(caida=True)
+    for _ in range(5):
+        buffer.agregar(nueva())
+    try:
+        buffer.vaciar()
+        fallo = False
+    except fake_pyodbc.Error:
+        fallo = True
+    comprobar(fallo and buffer.pendientes() == 5, "base caída: el vaciado falla y las 5 quedan en el buffer")
+    fake_pyodbc.configurar(caida=False)
+    _, _, antes = _recalcular(ruta_db)
+    buffer.vaciar()
+    _, _, despues = _recalcular(ruta_db)
+    comprobar(buffer.pendientes() == 0 and despues == antes + 5, "base de vuelta: se escriben las 5, una vez")
+
+    original = fake_pyodbc.PROCEDIMIENTOS["RegistrarValoracionesLote"]
+    perdidas = []
+
+    def confirmacion_perdida(db, filas):
+        resultado = original(db, filas)
+        if not perdidas:
+            db.commit()
+            perdidas.append(len(filas))
+            raise fake_pyodbc.OperationalError("08S01", "Communication link failure (tras el commit)")
+        return resultado
+    fake_pyodbc.PROCEDIMIENTOS["RegistrarValoracionesLote"] = confirmacion_perdida
+    for p in (1, 2, 3):
+        buffer.agregar(nueva(p))
+    buffer.vaciar()
+    fake_pyodbc.PROCEDIMIENTOS["RegistrarValoracionesLote"] = original
+    esperado, resumen, filas = _recalcular(ruta_db)
+    comprobar(perdidas == [3] and filas == despues + 3 and resumen == esperado,
+              "confirmación perdida: el reintento no duplica filas ni resumen")
+    comprobar(buffer.stats()["duplicadas"] == 3, "confirmación perdida: el reintento las cuenta como duplicadas")
+
+    # 5. Buffer lleno, validaciones y rango
+    valoraciones.configurar(store, tamano_lote=100, intervalo=60, max_pendientes=2)
+    respuestas = [solicitud("http_trigger_valoracion", {"rut": USUARIOS[2], "puntuacion": 5}) for _ in range(3)]
+    comprobar([r.status_code for r in respuestas] == [202, 202, 503] and respuestas[2].headers.get("Retry-After"),
+              "buffer lleno: 503 con Retry-After en vez de descartar")
+    invalidas = [{"rut": USUARIOS[2], "puntuacion": p} for p in (0, 6, "5", True, 4.5)]
+    invalidas.append({"rut": USUARIOS[2], "puntuacion": 3, "comentario": "x" * 2001})
+    comprobar(all(solicitud("http_trigger_valoracion", c).status_code == 400 for c in invalidas),
+              "puntuación fuera de 1..5, no entera o comentario demasiado largo: 400")
+    comprobar(solicitud("http_trigger_valoraciones_resumen", {"desde": "2026-02-01", "hasta": "2026-01-01"}).status_code
+              == 400 and solicitud("http_trigger_valoraciones_resumen", {"desde": "2020-01-01", "hasta": "2026-01-01"})
+              .status_code == 400, "panel: rango invertido o demasiado largo: 400")
+    valoraciones.configurar(store, tamano_lote=100, intervalo=60)
+
+    # 6. Apagado ordenado de un proceso
+    _, _, antes = _recalcular(ruta_db)
+    script = ("import fake_pyodbc, json; fake_pyodbc.instalar()\n"
+              "import azure.functions as func, function_app\n"
+              "for p in range(1, 6):\n"
+              "    r = function_app.http_trigger_valoracion(func.HttpRequest(method='POST', url='/', headers={},\n"
+              f"        body=json.dumps({{'rut': '{USUARIOS[3]}', 'puntuacion': p}}).encode()))\n"
+              "    assert r.status_code == 202\n")
+    env = {**os.environ, "ValoracionesBatchSize": "1000", "ValoracionesFlushSeconds": "600",
+           "PYTHONPATH": os.pathsep.join([APP_DIR, BENCH_DIR, os.environ.get("PYTHONPATH", "")])}
+    salida = subprocess.run([sys.executable, "-c", script], env=env, cwd=APP_DIR, capture_output=True, text=True)
+    _, _, despues = _recalcular(ruta_db)
+    comprobar(salida.returncode == 0 and despues == antes + 5,
+              f"proceso que termina: atexit escribe las 5 pendientes ({despues - antes}) {salida.stderr[-200:]}")
+
+    # 7. Almacén en memoria: mismo resumen
+    memoria = valoraciones.MemoryValoracionesStore()
+    db = sqlite3.connect(ruta_db)
+    memoria.guardar([valoraciones.Valoracion(clave, usuario, p, c, datetime.datetime.fromisoformat(f))
+                     for clave, usuario, p, c, f in db.execute(
+                         "SELECT Clave, Usuario, Puntuacion, Comentario, Fecha FROM Valoraciones")])
+    db.close()
+    hasta = valoraciones._ahora().date()
+    desde = hasta - datetime.timedelta(days=10)
+    comprobar(memoria.resumen(desde, hasta) == store.resumen(desde, hasta)
+              and memoria.resumen(desde, hasta, USUARIOS[0]) == store.resumen(desde, hasta, USUARIOS[0]),
+              "memoria y SQL dan el mismo resumen")
+
+    valoraciones.get_buffer().detener()
+    print(f"\n{valoraciones.stats()}\n{len(_fallas)} fallas")
+    sys.exit(1 if _fallas else 0)
+
+
+if __name__ == "__main__":
+    main()
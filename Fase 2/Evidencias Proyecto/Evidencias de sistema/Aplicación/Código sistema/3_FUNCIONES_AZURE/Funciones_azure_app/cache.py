@@ -0,0 +1,101 @@
+# cache.py
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Configuración de los caches de lectura (variables de entorno opcionales)
+CACHE_TTL = float(os.environ.get("CacheTtlSeconds", "300"))
+CACHE_MAX_ENTRIES = int(os.environ.get("CacheMaxEntries", "10000"))
+TOKEN_CACHE_TTL = float(os.environ.get("TokenCacheTtlSeconds", "300"))
+TOKEN_CACHE_MAX_ENTRIES = int(os.environ.get("TokenCacheMaxEntries", "10000"))
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Cache en memoria con expiración por TTL y desalojo LRU al superar `max_entries`."""
+
+    def __init__(self, name, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, default=None):
+        """Devuelve el valor vigente para `key` o `default`."""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Guarda `value`; `ttl` permite una expiración menor a la del cache para esta entrada."""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(key, _MISSING) is not _MISSING:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# Caches compartidos, indexados por RUT. Cada entrada es (datos, ETag) para responder
+# If-None-Match sin ir a la base de datos (ver esquemas.condicional)
+perfiles = TTLCache("perfiles")
+hijos = TTLCache("hijos")
+# Tokens JWT ya verificados, indexados por el digest del token (ver auth.py)
+tokens = TTLCache("tokens", ttl=TOKEN_CACHE_TTL, max_entries=TOKEN_CACHE_MAX_ENTRIES)
+
+
+def invalidate_rut(rut):
+    """Elimina del cache todo lo asociado a un RUT tras una escritura."""
+    rut = str(rut)
+    perfiles.invalidate(rut)
+    hijos.invalidate(rut)
+
+
+def stats():
+    return [perfiles.stats(), hijos.stats(), tokens.stats()]
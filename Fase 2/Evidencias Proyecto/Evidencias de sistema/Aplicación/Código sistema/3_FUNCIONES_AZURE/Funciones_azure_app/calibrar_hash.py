@@ -0,0 +1,80 @@
+# calibrar_hash.py
+#
+# Elige los parámetros de scrypt para los hashes nuevos en la máquina donde corre: el mayor
+# costo (N * r) cuyo tiempo por hash no supera el objetivo y cuya memoria cabe en el límite.
+# Se mide en un solo núcleo, que es lo que paga cada login dentro del pool de procesos.
+# El resultado se aplica con las variables de entorno que imprime; los hashes existentes
+# siguen verificándose con sus propios parámetros y se actualizan en el próximo login.
+#
+# Uso (desde Funciones_azure_app, en una instancia del mismo plan que producción):
+#   python calibrar_hash.py --objetivo-ms 100 --memoria-max-mb 64
+
+import argparse
+import os
+import statistics
+import time
+
+import scrypt
+
+import contrasenas
+
+
+def medir(params, repeticiones):
+    """Mediana en ms de `repeticiones` hashes con estos parámetros."""
+    salt = os.urandom(contrasenas.HASH_SALT_BYTES)
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        scrypt.hash(b"Calibracion1", salt, N=params.n, r=params.r, p=params.p, buflen=params.buflen)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def calibrar(objetivo_ms, memoria_max, valores_r=(8,), p=1, ln_min=10, ln_max=22, repeticiones=3):
+    """Devuelve (parámetros elegidos o None, [(parámetros, ms)] medidos)."""
+    medidos = []
+    elegido = None
+    for r in valores_r:
+        for ln in range(ln_min, ln_max + 1):
+            params = contrasenas.Parametros(2 ** ln, r, p, contrasenas.HASH_BYTES)
+            if contrasenas.memoria_bytes(params) > memoria_max:
+                break
+            ms = medir(params, repeticiones)
+            medidos.append((params, ms))
+            if ms > objetivo_ms:
+                # El tiempo crece con N: los siguientes también se pasan
+                break
+            if elegido is None or params.n * params.r > elegido.n * elegido.r:
+                elegido = params
+    return elegido, medidos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibra los parámetros de scrypt para esta máquina")
+    parser.add_argument("--objetivo-ms", type=float, default=100.0, help="tiempo máximo por hash en un núcleo")
+    parser.add_argument("--memoria-max-mb", type=float, default=64.0, help="memoria máxima por hash")
+    parser.add_argument("--r", default="8", help="valores de r a probar, separados por coma")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    elegido, medidos = calibrar(args.objetivo_ms, args.memoria_max_mb * 1024 * 1024,
+                                tuple(int(r) for r in args.r.split(",")), repeticiones=args.repeticiones)
+
+    print(f"{'ln':>4} {'r':>3} {'p':>3} {'memoria MB':>11} {'ms/hash':>9} {'hashes/s/núcleo':>16}")
+    for params, ms in medidos:
+        print(f"{params.n.bit_length() - 1:>4} {params.r:>3} {params.p:>3} "
+              f"{contrasenas.memoria_bytes(params) / 2 ** 20:>11.1f} {ms:>9.1f} {1000 / ms:>16.1f}")
+
+    actuales = contrasenas.ACTUALES
+    print(f"\nParámetros actuales: ln={actuales.n.bit_length() - 1} r={actuales.r} p={actuales.p}")
+    if elegido is None:
+        print("Ningún parámetro cumple el objetivo; pruebe con un objetivo mayor.")
+        return
+    workers = int(os.environ.get("HashPoolWorkers", str(os.cpu_count() or 1)))
+    print(f"Sugeridos: ln={elegido.n.bit_length() - 1} r={elegido.r} p={elegido.p} "
+          f"({contrasenas.memoria_bytes(elegido) * max(workers, 1) / 2 ** 20:.0f} MB con {workers} trabajadores ocupados)")
+    print(f"\n  PasswordHashLogN={elegido.n.bit_length() - 1}\n  PasswordHashR={elegido.r}\n  PasswordHashP={elegido.p}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# circuit_breaker.py
+
+import logging
+import os
+import threading
+import time
+
+# Configuración del circuit breaker de la base de datos (variables de entorno opcionales)
+BREAKER_ENABLED = os.environ.get("DbCircuitBreaker", "1") == "1"
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("DbBreakerFailureThreshold", "5"))   # fallas consecutivas para abrir
+BREAKER_OPEN_SECONDS = float(os.environ.get("DbBreakerOpenSeconds", "10"))          # tiempo abierto antes de sondear
+BREAKER_PROBES = int(os.environ.get("DbBreakerProbes", "1"))                        # sondas simultáneas en semiabierto
+
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+
+class CircuitoAbierto(Exception):
+    """El servicio se considera caído: la llamada se rechaza sin intentarla (503)."""
+
+    def __init__(self, nombre, reintentar_en):
+        super().__init__(f"Circuito '{nombre}' abierto, reintentar en {reintentar_en:.1f}s")
+        self.reintentar_en = reintentar_en
+
+
+class CircuitBreaker:
+    """Circuit breaker de tres estados compartido por todas las llamadas a un servicio.
+
+    cerrado: las llamadas pasan; `failure_threshold` fallas consecutivas lo abren.
+    abierto: las llamadas fallan de inmediato durante `open_seconds`.
+    semiabierto: pasan hasta `probes` llamadas de sondeo; un éxito lo cierra y una falla lo
+    vuelve a abrir."""
+
+    def __init__(self, nombre, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 open_seconds=BREAKER_OPEN_SECONDS, probes=BREAKER_PROBES, enabled=BREAKER_ENABLED):
+        self.nombre = nombre
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._estado = CERRADO
+        self._fallas = 0
+        self._abierto_hasta = 0.0
+        self._sondas = 0
+        # Métricas
+        self._transiciones = {ABIERTO: 0, SEMIABIERTO: 0, CERRADO: 0}
+        self._rechazadas = 0
+        self._exitos = 0
+        self._fallas_total = 0
+
+    def _cambiar(self, estado):
+        if estado != self._estado:
+            logging.warning(f"Circuit breaker '{self.nombre}': {self._estado} -> {estado}")
+            self._estado = estado
+            self._transiciones[estado] += 1
+
+    def antes(self):
+        """Llamar antes de usar el servicio. Lanza CircuitoAbierto si no se debe intentar.
+        Devuelve True si la llamada es una sonda (debe informarse con exito/falla)."""
+        if not self.enabled:
+            return False
+        with self._lock:
+            if self._estado == CERRADO:
+                return False
+            ahora = time.monotonic()
+            if self._estado == ABIERTO:
+                if ahora < self._abierto_hasta:
+                    self._rechazadas += 1
+                    raise CircuitoAbierto(self.nombre, self._abierto_hasta - ahora)
+                self._cambiar(SEMIABIERTO)
+                self._sondas = 0
+            if self._sondas >= self.probes:
+                self._rechazadas += 1
+                raise CircuitoAbierto(self.nombre, self.open_seconds)
+            self._sondas += 1
+            return True
+
+    def verificar(self):
+        """Lanza CircuitoAbierto si el circuito está abierto, sin ocupar una sonda. Sirve para
+        no hacer trabajo previo caro (como scrypt) cuando la llamada se va a rechazar igual."""
+        if self.enabled and self._estado == ABIERTO:
+            restante = self._abierto_hasta - time.monotonic()
+            if restante > 0:
+                raise CircuitoAbierto(self.nombre, restante)
+
+    def exito(self, sonda=False):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._exitos += 1
+            self._fallas = 0
+            if sonda:
+                self._sondas -= 1
+            if self._estado == SEMIABIERTO:
+                self._cambiar(CERRADO)
+
+    def falla(self, sonda=False):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._fallas_total += 1
+            self._fallas += 1
+            if sonda:
+                self._sondas -= 1
+            if self._estado == SEMIABIERTO or self._fallas >= self.failure_threshold:
+                self._abierto_hasta = time.monotonic() + self.open_seconds
+                self._cambiar(ABIERTO)
+
+    def liberar(self, sonda=False):
+        """La llamada terminó sin informar éxito ni falla del servicio (p. ej. un error del cliente)."""
+        if sonda and self.enabled:
+            with self._lock:
+                self._sondas -= 1
+
+    @property
+    def estado(self):
+        return self._estado
+
+    def stats(self):
+        with self._lock:
+            return {
+                "nombre": self.nombre,
+                "estado": self._estado,
+                "fallas_consecutivas": self._fallas,
+                "abierto_restante_s": max(0.0, self._abierto_hasta - time.monotonic())
+                                      if self._estado == ABIERTO else 0.0,
+                "transiciones": dict(self._transiciones),
+                "rechazadas": self._rechazadas,
+                "exitos": self._exitos,
+                "fallas": self._fallas_total,
+            }
@@ -0,0 +1,335 @@
+# codigos_reset.py
+#
+# Códigos de recuperación de contraseña: un código vigente por usuario (emitir uno nuevo
+# descarta el anterior), comparación de tiempo constante, límite de intentos fallidos por
+# código y purga periódica de los vencidos (timer_reset_codes en function_app.py).
+#
+# El almacén se elige con ResetCodeStore:
+#   sql     tabla ResetCodes (migración 2): compartida por todas las instancias. Con
+#           ResetCodeCacheSegundos > 0 va detrás de un cache local (CacheResetStore)
+#   memory  en memoria del proceso, con TTL: para una sola instancia
+#   sqlite  archivo SQLite compartido por los procesos del host (sustituto local de un
+#           almacén compartido, como en rate_limit)
+
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import jwt
+
+import auth
+import cache
+import db_pool
+import timing
+
+# Configuración (variables de entorno opcionales)
+RESET_CODE_STORE = os.environ.get("ResetCodeStore", "sql")              # sql | memory | sqlite
+RESET_CODE_STORE_PATH = os.environ.get("ResetCodeStorePath", "reset_codes.db")
+RESET_CODE_MINUTOS = int(os.environ.get("ResetCodeMinutos", "15"))
+RESET_CODE_MAX_INTENTOS = int(os.environ.get("ResetCodeMaxIntentos", "5"))
+RESET_CODE_MAX_ENTRIES = int(os.environ.get("ResetCodeMaxEntries", "100000"))
+RESET_CODE_PURGA_LOTE = int(os.environ.get("ResetCodePurgaLote", "5000"))
+# Vigencia en el cache local de los códigos del almacén sql (0 lo desactiva)
+RESET_CODE_CACHE_SEGUNDOS = float(os.environ.get("ResetCodeCacheSegundos", "60"))
+# Vigencia del token que entrega la verificación para cambiar la contraseña
+RESET_TOKEN_MINUTOS = int(os.environ.get("ResetTokenMinutos", "10"))
+
+# Resultados de verificar()
+VALIDO = "valido"
+INCORRECTO = "incorrecto"
+BLOQUEADO = "bloqueado"
+INEXISTENTE = "inexistente"
+
+# Código vigente (no usado ni vencido) de un usuario
+Codigo = namedtuple("Codigo", ["id", "codigo", "intentos"])
+
+
+def generar():
+    """Código de 6 dígitos con un generador criptográfico."""
+    return str(100000 + secrets.randbelow(900000))
+
+
+# --- Almacenes ---------------------------------------------------------------
+
+class SqlResetStore:
+    """Códigos en la tabla ResetCodes. Usar o bloquear un código lo marca como vencido, así
+    que la purga solo necesita ExpirationTime."""
+
+    def _consultar(self, sql, params, commit=False):
+        with db_pool.connection() as conn:
+            with timing.span("db_query"):
+                cursor = conn.cursor()
+                cursor.execute(sql, params)
+                row = cursor.fetchone()
+                if commit:
+                    conn.commit()
+                return row
+
+    def guardar(self, rut, codigo, minutos):
+        """Devuelve el Id del código guardado."""
+        row = self._consultar("{CALL GuardarCodigoReset(?, ?, ?)}", (rut, codigo, minutos), commit=True)
+        return row.Id if row else None
+
+    def obtener(self, rut):
+        row = self._consultar("{CALL ObtenerCodigoReset(?)}", (rut,))
+        return Codigo(row.Id, row.Code, row.Intentos) if row else None
+
+    def consumir(self, rut, id):
+        """Marca el código como usado si seguía vigente. Devuelve True si lo consumió esta llamada."""
+        row = self._consultar("{CALL ConsumirCodigoReset(?)}", (id,), commit=True)
+        return bool(row and row.Consumidos)
+
+    def fallar(self, rut, id, max_intentos):
+        """Suma un intento fallido. Devuelve los intentos restantes (0: el código quedó bloqueado)."""
+        row = self._consultar("{CALL FallarCodigoReset(?, ?)}", (id, max_intentos), commit=True)
+        return max(max_intentos - row.Intentos, 0) if row else 0
+
+    def purgar(self, lote):
+        row = self._consultar("{CALL PurgarResetCodes(?)}", (lote,), commit=True)
+        return row.Borrados if row else 0
+
+
+class MemoryResetStore:
+    """Códigos en memoria con TTL, a lo más `max_entries` (se desaloja el más antiguo)."""
+
+    def __init__(self, max_entries=RESET_CODE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._codigos = OrderedDict()   # rut -> [id, codigo, expira, intentos]
+        self._siguiente_id = 1
+
+    def guardar(self, rut, codigo, minutos):
+        with self._lock:
+            self._codigos.pop(rut, None)
+            id = self._siguiente_id
+            self._codigos[rut] = [id, codigo, time.time() + minutos * 60, 0]
+            self._siguiente_id += 1
+            while len(self._codigos) > self.max_entries:
+                self._codigos.popitem(last=False)
+            return id
+
+    def _vigente(self, rut, id=None):
+        entrada = self._codigos.get(rut)
+        if entrada is None or (id is not None and entrada[0] != id):
+            return None
+        if entrada[2] <= time.time():
+            del self._codigos[rut]
+            return None
+        return entrada
+
+    def obtener(self, rut):
+        with self._lock:
+            entrada = self._vigente(rut)
+            return Codigo(entrada[0], entrada[1], entrada[3]) if entrada else None
+
+    def consumir(self, rut, id):
+        with self._lock:
+            if self._vigente(rut, id) is None:
+                return False
+            del self._codigos[rut]
+            return True
+
+    def fallar(self, rut, id, max_intentos):
+        with self._lock:
+            entrada = self._vigente(rut, id)
+            if entrada is None:
+                return 0
+            entrada[3] += 1
+            if entrada[3] >= max_intentos:
+                del self._codigos[rut]
+                return 0
+            return max_intentos - entrada[3]
+
+    def purgar(self, lote):
+        ahora = time.time()
+        with self._lock:
+            vencidos = [rut for rut, entrada in self._codigos.items() if entrada[2] <= ahora][:lote]
+            for rut in vencidos:
+                del self._codigos[rut]
+            return len(vencidos)
+
+
+class SqliteResetStore:
+    """Códigos en un archivo SQLite compartido por los procesos del host. Cada operación es
+    atómica entre procesos (una sentencia o una transacción BEGIN IMMEDIATE)."""
+
+    def __init__(self, ruta=RESET_CODE_STORE_PATH):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._conexion().execute("CREATE TABLE IF NOT EXISTS Codigos ("
+                                 "Id INTEGER PRIMARY KEY AUTOINCREMENT, Rut TEXT NOT NULL UNIQUE, "
+                                 "Codigo TEXT NOT NULL, Expira REAL NOT NULL, Intentos INTEGER NOT NULL DEFAULT 0)")
+        self._conexion().execute("CREATE INDEX IF NOT EXISTS IX_Codigos_Expira ON Codigos (Expira)")
+
+    def _conexion(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def guardar(self, rut, codigo, minutos):
+        # INSERT OR REPLACE asigna un Id nuevo: los intentos sobre el código anterior ya no aplican
+        cur = self._conexion().execute("INSERT OR REPLACE INTO Codigos (Rut, Codigo, Expira) VALUES (?, ?, ?)",
+                                       (rut, codigo, time.time() + minutos * 60))
+        return cur.lastrowid
+
+    def obtener(self, rut):
+        row = self._conexion().execute("SELECT Id, Codigo, Intentos FROM Codigos WHERE Rut = ? AND Expira > ?",
+                                       (rut, time.time())).fetchone()
+        return Codigo(*row) if row else None
+
+    def consumir(self, rut, id):
+        cur = self._conexion().execute("DELETE FROM Codigos WHERE Id = ? AND Expira > ?", (id, time.time()))
+        return cur.rowcount > 0
+
+    def fallar(self, rut, id, max_intentos):
+        conn = self._conexion()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE Codigos SET Intentos = Intentos + 1 WHERE Id = ? AND Expira > ?", (id, time.time()))
+            row = conn.execute("SELECT Intentos FROM Codigos WHERE Id = ? AND Expira > ?", (id, time.time())).fetchone()
+            if row and row[0] >= max_intentos:
+                conn.execute("DELETE FROM Codigos WHERE Id = ?", (id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return max(max_intentos - row[0], 0) if row else 0
+
+    def purgar(self, lote):
+        cur = self._conexion().execute(
+            "DELETE FROM Codigos WHERE Id IN (SELECT Id FROM Codigos WHERE Expira <= ? LIMIT ?)", (time.time(), lote))
+        return cur.rowcount
+
+
+class CacheResetStore:
+    """Cache local delante de otro almacén (el sql): un código correcto que esta instancia
+    emitió o ya leyó se verifica sin leerlo de la base (cacheado). Consumir y fallar siguen
+    yendo al almacén, por Id, así que un código viejo en el cache no puede validarse; y como
+    otra instancia pudo reemplazarlo, ante cualquier otro resultado verificar() lee el
+    almacén (obtener) antes de contar un intento fallido."""
+
+    def __init__(self, store, ttl=RESET_CODE_CACHE_SEGUNDOS, max_entries=RESET_CODE_MAX_ENTRIES):
+        self.store = store
+        self.cache = cache.TTLCache("codigos_reset", ttl=ttl, max_entries=max_entries)
+
+    def guardar(self, rut, codigo, minutos):
+        id = self.store.guardar(rut, codigo, minutos)
+        if id is None:
+            self.cache.invalidate(rut)
+        else:
+            self.cache.set(rut, Codigo(id, codigo, 0), ttl=minutos * 60)
+        return id
+
+    def cacheado(self, rut):
+        return self.cache.get(rut)
+
+    def obtener(self, rut):
+        vigente = self.store.obtener(rut)
+        if vigente is None:
+            self.cache.invalidate(rut)
+        else:
+            self.cache.set(rut, vigente)
+        return vigente
+
+    def consumir(self, rut, id):
+        self.cache.invalidate(rut)
+        return self.store.consumir(rut, id)
+
+    def fallar(self, rut, id, max_intentos):
+        restantes = self.store.fallar(rut, id, max_intentos)
+        vigente = self.cache.get(rut)
+        if restantes and vigente is not None and vigente.id == id:
+            # Sigue vigente: el próximo intento (quizás el correcto) no necesita leerlo
+            self.cache.set(rut, vigente._replace(intentos=max_intentos - restantes))
+        else:
+            self.cache.invalidate(rut)
+        return restantes
+
+    def purgar(self, lote):
+        return self.store.purgar(lote)
+
+
+# --- Servicio ----------------------------------------------------------------
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def configurar(store=None):
+    """Reemplaza el almacén compartido (por ejemplo, con MemoryResetStore en pruebas locales)."""
+    global _store
+    with _store_lock:
+        if store is None:
+            store = {"memory": MemoryResetStore, "sqlite": SqliteResetStore}.get(RESET_CODE_STORE, SqlResetStore)()
+            if isinstance(store, SqlResetStore) and RESET_CODE_CACHE_SEGUNDOS > 0:
+                store = CacheResetStore(store)
+        _store = store
+        return _store
+
+
+def get_store():
+    if _store is None:
+        configurar()
+    return _store
+
+
+def guardar(rut, codigo, minutos=RESET_CODE_MINUTOS):
+    """Guarda el código del usuario; el que tuviera antes deja de ser válido."""
+    get_store().guardar(str(rut), codigo, minutos)
+
+
+def _coincide(vigente, codigo):
+    return hmac.compare_digest(vigente.codigo.encode("utf-8"), codigo.encode("utf-8"))
+
+
+def verificar(rut, codigo, max_intentos=RESET_CODE_MAX_INTENTOS):
+    """Devuelve (resultado, intentos restantes). Un código correcto se consume: solo sirve una vez."""
+    store = get_store()
+    rut = str(rut)
+    cacheado = getattr(store, "cacheado", None)
+    vigente = cacheado(rut) if cacheado is not None else None
+    if vigente is None or not _coincide(vigente, codigo):
+        # Sin cache, o el del cache puede ser un código que otra instancia ya reemplazó
+        vigente = store.obtener(rut)
+    if vigente is None:
+        return INEXISTENTE, 0
+    if _coincide(vigente, codigo):
+        # Dos verificaciones simultáneas del mismo código: solo una lo consume
+        return (VALIDO, 0) if store.consumir(rut, vigente.id) else (INEXISTENTE, 0)
+    restantes = store.fallar(rut, vigente.id, max_intentos)
+    return (INCORRECTO, restantes) if restantes else (BLOQUEADO, 0)
+
+
+def purgar(lote=RESET_CODE_PURGA_LOTE):
+    """Borra los códigos vencidos, usados o bloqueados, en lotes de `lote`. Devuelve cuántos borró."""
+    store = get_store()
+    total = 0
+    while True:
+        borrados = store.purgar(lote)
+        total += borrados
+        if borrados < lote:
+            return total
+
+
+def token_reset(rut):
+    """Token de corta duración que acredita la verificación del código. No lleva `user_id`,
+    así que las rutas de datos (auth.rut_autenticado) no lo aceptan como sesión."""
+    ahora = int(time.time())
+    payload = {"reset_rut": str(rut), "exp": ahora + RESET_TOKEN_MINUTOS * 60, "iat": ahora}
+    return jwt.encode(payload, auth.JWT_SECRET, algorithm="HS256")
+
+
+def rut_de_token_reset(token):
+    """RUT del token de token_reset, o None si no es válido, expiró o es un token de sesión."""
+    try:
+        claims = jwt.decode(token, auth.JWT_SECRET, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return None
+    return str(claims.get("reset_rut") or "") or None
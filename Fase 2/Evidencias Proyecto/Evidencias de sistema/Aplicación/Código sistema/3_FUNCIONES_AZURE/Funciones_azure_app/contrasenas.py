@@ -0,0 +1,122 @@
+# contrasenas.py
+#
+# Formato de los hashes de contraseña. Cada hash guarda sus propios parámetros, así que el
+# costo de scrypt se puede ajustar (ver calibrar_hash.py) sin invalidar lo ya almacenado:
+#
+#   $scrypt$v=1$ln=14,r=8,p=1$<salt>$<hash>      salt y hash en base64 sin relleno
+#
+# Los hashes anteriores (base64 de 8 bytes de salt + 24 de scrypt con N=16384, r=8, p=1) se
+# siguen aceptando como versión 0. Tras un login exitoso con parámetros distintos de los
+# actuales, login_chat vuelve a calcular el hash con los actuales (PasswordRehash=1).
+#
+# scrypt siempre corre en el pool de procesos de hash_pool.
+
+import base64
+import binascii
+import hmac
+import os
+from collections import namedtuple
+
+import hash_pool
+
+# Parámetros para hashes nuevos (variables de entorno opcionales; calibrar_hash.py sugiere valores)
+HASH_LOG_N = int(os.environ.get("PasswordHashLogN", "14"))     # N = 2 ** ln
+HASH_R = int(os.environ.get("PasswordHashR", "8"))
+HASH_P = int(os.environ.get("PasswordHashP", "1"))
+HASH_SALT_BYTES = 16
+HASH_BYTES = 32
+PASSWORD_REHASH = os.environ.get("PasswordRehash", "1") == "1"
+
+VERSION = 1
+_PREFIJO = "$scrypt$"
+
+Parametros = namedtuple("Parametros", ["n", "r", "p", "buflen"])
+
+ACTUALES = Parametros(2 ** HASH_LOG_N, HASH_R, HASH_P, HASH_BYTES)
+# Formato original: N=16384, r=8, p=1, 24 bytes de hash y 8 de salt
+LEGADO = Parametros(16384, 8, 1, 24)
+
+
+def memoria_bytes(params):
+    """Memoria que usa scrypt con estos parámetros (128 * r * N * p bytes)."""
+    return 128 * params.r * params.n * params.p
+
+
+def _b64(datos):
+    return base64.b64encode(datos).decode("ascii").rstrip("=")
+
+
+def _desde_b64(texto):
+    return base64.b64decode(texto + "=" * (-len(texto) % 4), validate=True)
+
+
+def codificar(salt, digest, params=ACTUALES):
+    ln = params.n.bit_length() - 1
+    return f"{_PREFIJO}v={VERSION}$ln={ln},r={params.r},p={params.p}${_b64(salt)}${_b64(digest)}"
+
+
+def decodificar(almacenado):
+    """Devuelve (parámetros, salt, hash) del valor almacenado. Lanza ValueError si no tiene
+    ninguno de los formatos conocidos."""
+    if not almacenado.startswith(_PREFIJO):
+        datos = base64.b64decode(almacenado)
+        return LEGADO, datos[:8], datos[8:]
+    try:
+        _, _, version, costo, salt, digest = almacenado.split("$")
+        if version != f"v={VERSION}":
+            raise ValueError(f"Versión de hash no soportada: {version}")
+        valores = dict(par.split("=") for par in costo.split(","))
+        digest = _desde_b64(digest)
+        params = Parametros(2 ** int(valores["ln"]), int(valores["r"]), int(valores["p"]), len(digest))
+        return params, _desde_b64(salt), digest
+    except (KeyError, binascii.Error) as e:
+        raise ValueError(f"Hash de contraseña mal formado: {e}")
+
+
+def requiere_rehash(params):
+    return PASSWORD_REHASH and params != ACTUALES
+
+
+def _scrypt_args(params):
+    return {"N": params.n, "r": params.r, "p": params.p, "buflen": params.buflen}
+
+
+def hashear(password, params=ACTUALES):
+    """Hash nuevo (con salt aleatorio) listo para almacenar."""
+    salt = os.urandom(HASH_SALT_BYTES)
+    digest = hash_pool.hash_password(password.encode("utf-8"), salt, **_scrypt_args(params))
+    return codificar(salt, digest, params)
+
+
+async def hashear_async(password, params=ACTUALES):
+    salt = os.urandom(HASH_SALT_BYTES)
+    digest = await hash_pool.hash_password_async(password.encode("utf-8"), salt, **_scrypt_args(params))
+    return codificar(salt, digest, params)
+
+
+def hashear_lote(passwords, params=ACTUALES):
+    """Hashes de varias contraseñas, repartidos en el pool de procesos, en el mismo orden."""
+    pares = [(password.encode("utf-8"), os.urandom(HASH_SALT_BYTES)) for password in passwords]
+    digests = hash_pool.hash_passwords(pares, **_scrypt_args(params))
+    return [codificar(salt, digest, params) for (_, salt), digest in zip(pares, digests)]
+
+
+async def hashear_lote_async(passwords, params=ACTUALES):
+    pares = [(password.encode("utf-8"), os.urandom(HASH_SALT_BYTES)) for password in passwords]
+    digests = await hash_pool.hash_passwords_async(pares, **_scrypt_args(params))
+    return [codificar(salt, digest, params) for (_, salt), digest in zip(pares, digests)]
+
+
+def verificar(password, almacenado):
+    """Devuelve (coincide, requiere rehash). La comparación es de tiempo constante."""
+    params, salt, esperado = decodificar(almacenado)
+    calculado = hash_pool.hash_password(password.encode("utf-8"), salt, **_scrypt_args(params))
+    coincide = hmac.compare_digest(calculado, esperado)
+    return coincide, coincide and requiere_rehash(params)
+
+
+async def verificar_async(password, almacenado):
+    params, salt, esperado = decodificar(almacenado)
+    calculado = await hash_pool.hash_password_async(password.encode("utf-8"), salt, **_scrypt_args(params))
+    coincide = hmac.compare_digest(calculado, esperado)
+    return coincide, coincide and requiere_rehash(params)
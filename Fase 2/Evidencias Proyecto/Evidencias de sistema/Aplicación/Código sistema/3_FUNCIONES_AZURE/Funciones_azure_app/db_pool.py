@@ -0,0 +1,424 @@
+# db_pool.py
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack, contextmanager
+
+import pyodbc
+
+import cache
+import timing
+from circuit_breaker import CircuitBreaker, CircuitoAbierto
+
+# Configuración del pool (variables de entorno opcionales)
+POOL_MIN_SIZE = int(os.environ.get("SqlPoolMinSize", "1"))
+POOL_MAX_SIZE = int(os.environ.get("SqlPoolMaxSize", "10"))
+POOL_MAX_AGE = float(os.environ.get("SqlPoolMaxAgeSeconds", "1800"))      # reciclar conexiones cada 30 min
+POOL_TIMEOUT = float(os.environ.get("SqlPoolTimeoutSeconds", "15"))       # espera máxima por una conexión libre
+POOL_VALIDATE_AFTER = float(os.environ.get("SqlPoolValidateAfterSeconds", "5"))  # validar si estuvo ociosa más de esto
+
+# Réplica de lectura (opcional). Con SqlReadOnlyConnectionString (p. ej. la misma cadena con
+# ApplicationIntent=ReadOnly) las lecturas de lectura() van a la réplica y todo lo demás al
+# primario. SqlReadRouting cambia el destino por ruta: "perfil=primary,hijos=replica".
+READ_REPLICA_CONN_STR = os.environ.get("SqlReadOnlyConnectionString", "")
+READ_ROUTING = os.environ.get("SqlReadRouting", "")
+# Tras una escritura, las lecturas del mismo RUT van al primario durante este tiempo (retraso de la réplica)
+REPLICA_STICKY_SECONDS = float(os.environ.get("SqlReplicaStickySeconds", "30"))
+# Una falla de la réplica la saca de uso por un tiempo: las lecturas van al primario
+REPLICA_BREAKER_THRESHOLD = int(os.environ.get("SqlReplicaBreakerThreshold", "1"))
+REPLICA_BREAKER_OPEN_SECONDS = float(os.environ.get("SqlReplicaBreakerOpenSeconds", "30"))
+
+PRIMARIO = "primary"
+REPLICA = "replica"
+
+
+class PoolTimeoutError(pyodbc.Error):
+    """No se obtuvo una conexión libre dentro del tiempo de espera."""
+
+
+# Errores de la consulta o de los datos: repetir la llamada da el mismo error
+ERRORES_DE_CONSULTA = (pyodbc.ProgrammingError, pyodbc.IntegrityError, pyodbc.DataError)
+
+
+def es_transitorio(error):
+    """Errores que un reintento puede resolver (retry.call_with_retries solo reintenta estos)."""
+    return not isinstance(error, ERRORES_DE_CONSULTA)
+
+
+def _es_falla_de_servicio(error):
+    """Errores que indican que la base de datos no responde (y no un problema de la consulta
+    o del propio pool). Solo estos cuentan para el circuit breaker."""
+    return not isinstance(error, PoolTimeoutError) and es_transitorio(error)
+
+
+class _PooledConnection:
+    """Conexión física junto a sus marcas de tiempo."""
+
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    def expired(self, max_age):
+        return max_age > 0 and time.monotonic() - self.created_at > max_age
+
+    def close(self):
+        try:
+            self.conn.close()
+        except pyodbc.Error:
+            pass
+
+
+class ConnectionPool:
+    """Pool de conexiones pyodbc con tamaño mínimo/máximo, validación y reciclaje por antigüedad."""
+
+    def __init__(self, conn_str, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+                 max_age=POOL_MAX_AGE, timeout=POOL_TIMEOUT, validate_after=POOL_VALIDATE_AFTER,
+                 connect=None, breaker=None):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("Tamaños de pool inválidos")
+        self.conn_str = conn_str
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self.timeout = timeout
+        self.validate_after = validate_after
+        self._connect = connect or pyodbc.connect
+        self.breaker = breaker
+        self._idle = deque()
+        self._size = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        # Métricas
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._peak_in_use = 0
+        self._created = 0
+        self._recycled = 0
+        self._discarded = 0
+
+    def _open(self):
+        with timing.span("db_connect"):
+            pooled = _PooledConnection(self._connect(self.conn_str))
+        with self._cond:
+            self._created += 1
+        return pooled
+
+    def prewarm(self, count=None):
+        """Abre conexiones hasta alcanzar el tamaño mínimo (o `count`). Devuelve cuántas se abrieron."""
+        target = self.min_size if count is None else min(count, self.max_size)
+        opened = 0
+        while True:
+            with self._cond:
+                if self._size >= target:
+                    break
+                self._size += 1
+            try:
+                pooled = self._open()
+            except pyodbc.Error:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append(pooled)
+                self._cond.notify()
+            opened += 1
+        return opened
+
+    def _validate(self, pooled):
+        """Comprueba que la conexión siga viva antes de entregarla."""
+        if time.monotonic() - pooled.last_used < self.validate_after:
+            return True
+        try:
+            cursor = pooled.conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def acquire(self, timeout=None):
+        """Obtiene una conexión del pool, abriendo una nueva si hay cupo."""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            pooled = None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"Pool de conexiones agotado ({self.max_size} en uso) tras {timeout:.1f}s")
+                    waited = True
+                    self._cond.wait(remaining)
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    self._size += 1
+                self._in_use += 1
+
+            if pooled is not None and pooled.expired(self.max_age):
+                pooled.close()
+                pooled = None
+                with self._cond:
+                    self._recycled += 1
+            elif pooled is not None and not self._validate(pooled):
+                pooled.close()
+                pooled = None
+                with self._cond:
+                    self._discarded += 1
+
+            if pooled is None:
+                try:
+                    pooled = self._open()
+                except pyodbc.Error:
+                    with self._cond:
+                        self._size -= 1
+                        self._in_use -= 1
+                        self._cond.notify()
+                    raise
+
+            wait = time.monotonic() - started
+            with self._cond:
+                self._checkouts += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                if waited:
+                    self._waits += 1
+                self._peak_in_use = max(self._peak_in_use, self._in_use)
+            return pooled
+
+    def release(self, pooled, discard=False):
+        """Devuelve la conexión al pool, o la cierra si está rota o vencida."""
+        if not discard:
+            try:
+                # Descartar cualquier transacción que haya quedado abierta
+                pooled.conn.rollback()
+            except pyodbc.Error:
+                discard = True
+        if not discard and pooled.expired(self.max_age):
+            discard = True
+            with self._cond:
+                self._recycled += 1
+
+        if discard:
+            pooled.close()
+        else:
+            pooled.last_used = time.monotonic()
+
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._size -= 1
+                self._discarded += 1
+            else:
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    def _informar(self, sonda, error=None):
+        """Informa al circuit breaker el resultado de un uso de la base de datos."""
+        if self.breaker is None:
+            return
+        if error is None:
+            self.breaker.exito(sonda)
+        elif isinstance(error, pyodbc.Error) and _es_falla_de_servicio(error):
+            self.breaker.falla(sonda)
+        else:
+            self.breaker.liberar(sonda)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Entrega una conexión y la devuelve siempre, incluso si ocurre una excepción.
+        Con el circuit breaker abierto lanza CircuitoAbierto sin tocar la base de datos."""
+        sonda = self.breaker.antes() if self.breaker is not None else False
+        try:
+            with timing.span("db_checkout"):
+                pooled = self.acquire(timeout)
+        except BaseException as e:
+            self._informar(sonda, e)
+            raise
+        discard = False
+        try:
+            yield pooled.conn
+        except pyodbc.Error as e:
+            # La conexión puede haber quedado en mal estado
+            discard = True
+            self._informar(sonda, e)
+            raise
+        except BaseException as e:
+            self._informar(sonda, e)
+            raise
+        else:
+            self._informar(sonda)
+        finally:
+            self.release(pooled, discard=discard)
+
+    def close(self):
+        """Cierra todas las conexiones ociosas."""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for pooled in idle:
+            pooled.close()
+
+    def stats(self):
+        """Métricas del pool: tiempos de espera y saturación."""
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "max_size": self.max_size,
+                "saturation": self._in_use / self.max_size,
+                "peak_in_use": self._peak_in_use,
+                "checkouts": self._checkouts,
+                "waited_checkouts": self._waits,
+                "timeouts": self._timeouts,
+                "wait_avg_ms": (self._wait_total / self._checkouts * 1000) if self._checkouts else 0.0,
+                "wait_max_ms": self._wait_max * 1000,
+                "created": self._created,
+                "recycled": self._recycled,
+                "discarded": self._discarded,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# Circuit breaker compartido por todos los módulos que usan la base de datos
+breaker = CircuitBreaker("sql")
+
+
+def get_pool():
+    """Devuelve el pool compartido del módulo, creándolo en el primer uso."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(os.environ["SqlConnectionString"], breaker=breaker)
+                try:
+                    _pool.prewarm()
+                except pyodbc.Error as e:
+                    logging.warning(f"No se pudo precalentar el pool de conexiones: {str(e)}")
+    return _pool
+
+
+def iniciado():
+    """Indica si el pool compartido ya se creó (y con él sus conexiones mínimas)."""
+    return _pool is not None
+
+
+def connection(timeout=None):
+    """Atajo para `get_pool().connection()`."""
+    return get_pool().connection(timeout)
+
+
+# --- Réplica de lectura --------------------------------------------------------
+
+def _parse_routing(texto):
+    """"perfil=primary,hijos=replica" -> {"perfil": "primary", "hijos": "replica"}."""
+    rutas = {}
+    for parte in texto.split(","):
+        if not parte.strip():
+            continue
+        ruta, _, destino = parte.partition("=")
+        destino = destino.strip().lower()
+        if destino not in (PRIMARIO, REPLICA):
+            raise ValueError(f"SqlReadRouting: destino inválido para '{ruta.strip()}': '{destino}'")
+        rutas[ruta.strip()] = destino
+    return rutas
+
+
+_routing = _parse_routing(READ_ROUTING)
+_replica = None
+_replica_lock = threading.Lock()
+replica_breaker = CircuitBreaker("sql-replica", failure_threshold=REPLICA_BREAKER_THRESHOLD,
+                                 open_seconds=REPLICA_BREAKER_OPEN_SECONDS)
+# RUTs escritos recientemente por esta instancia (valor sin uso: solo importa la presencia)
+_escrituras = cache.TTLCache("escrituras", ttl=REPLICA_STICKY_SECONDS)
+_lecturas_lock = threading.Lock()
+_lecturas = {REPLICA: 0, PRIMARIO: 0, "sticky": 0, "fallback": 0}
+
+
+def get_replica_pool():
+    """Pool de la réplica, creado en el primer uso; None si no hay réplica configurada."""
+    global _replica
+    if _replica is None and READ_REPLICA_CONN_STR:
+        with _replica_lock:
+            if _replica is None:
+                _replica = ConnectionPool(READ_REPLICA_CONN_STR, breaker=replica_breaker)
+                try:
+                    _replica.prewarm()
+                except pyodbc.Error as e:
+                    logging.warning(f"No se pudo precalentar el pool de la réplica: {str(e)}")
+    return _replica
+
+
+def _contar(destino):
+    with _lecturas_lock:
+        _lecturas[destino] += 1
+
+
+def destino_lectura(ruta, *ruts):
+    """'replica' o 'primary' para una lectura de `ruta` sobre `ruts`."""
+    if not READ_REPLICA_CONN_STR or _routing.get(ruta, REPLICA) != REPLICA:
+        return PRIMARIO
+    if any(_escrituras.get(str(rut)) is not None for rut in ruts):
+        _contar("sticky")
+        return PRIMARIO
+    return REPLICA
+
+
+def marcar_escritura(rut):
+    """Registra una escritura sobre el RUT: sus lecturas van al primario por REPLICA_STICKY_SECONDS.
+    Solo cubre esta instancia, igual que la invalidación de cache.py."""
+    if READ_REPLICA_CONN_STR:
+        _escrituras.set(str(rut), True)
+
+
+@contextmanager
+def lectura(ruta, *ruts, timeout=None):
+    """Conexión para una consulta de solo lectura: de la réplica si la ruta va a la réplica y
+    ninguno de `ruts` se escribió recién; del primario si no. Si la réplica no entrega una
+    conexión (caída, circuito abierto o pool agotado) se usa el primario. Una falla durante la
+    consulta abre replica_breaker, así que el reintento de retry.py ya va al primario."""
+    with ExitStack() as stack:
+        conn = None
+        if destino_lectura(ruta, *ruts) == REPLICA:
+            try:
+                conn = stack.enter_context(get_replica_pool().connection(timeout))
+            except CircuitoAbierto:
+                _contar("fallback")
+            except pyodbc.Error as e:
+                logging.warning(f"Réplica no disponible para '{ruta}', se usa el primario: {str(e)}")
+                _contar("fallback")
+            else:
+                _contar(REPLICA)
+        if conn is None:
+            conn = stack.enter_context(get_pool().connection(timeout))
+            _contar(PRIMARIO)
+        yield conn
+
+
+def stats():
+    resultado = {**get_pool().stats(), "breaker": breaker.stats()}
+    if READ_REPLICA_CONN_STR:
+        with _lecturas_lock:
+            lecturas = dict(_lecturas)
+        resultado["replica"] = {**get_replica_pool().stats(), "breaker": replica_breaker.stats(),
+                                "lecturas": lecturas}
+    return resultado
@@ -0,0 +1,390 @@
+# esquemas.py
+#
+# Capa común de lectura de solicitudes y construcción de respuestas: cada ruta declara su
+# esquema una vez y se valida en una sola pasada con patrones precompilados. Los cuerpos de
+# error estáticos se serializan una sola vez y se reutilizan como bytes.
+
+import azure.functions as func
+import datetime
+import functools
+import math
+import re
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional: sin él se usa el módulo json estándar
+    orjson = None
+    import json
+
+MIMETYPE = "application/json"
+
+# --- JSON --------------------------------------------------------------------
+
+if orjson is not None:
+    def dumps(obj):
+        return orjson.dumps(obj)
+
+    loads = orjson.loads
+else:
+    def dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+
+    loads = json.loads
+
+
+# --- Validaciones ------------------------------------------------------------
+
+RE_EMAIL = re.compile(r'^[\w\.-]+@[\w\.-]+\.\w+$')
+RE_RUT = re.compile(r'^(\d{1,8})-([0-9kK])$')
+RE_PASSWORD = re.compile(r'^(?=.*[a-zA-ZñÑ])(?=.*[A-ZÑ])(?=.*\d)[a-zA-ZñÑ\d]{8,}$')
+_RE_SANITIZE = re.compile(r"[;'\"*? =&]")
+
+
+def sanitize_input(input_string):
+    """Elimina espacios y caracteres potencialmente peligrosos."""
+    return _RE_SANITIZE.sub("", input_string)
+
+
+def digito_verificador(numero):
+    """Dígito verificador (módulo 11) del número de RUT."""
+    suma, factor = 0, 2
+    for digito in reversed(str(numero)):
+        suma += int(digito) * factor
+        factor = 2 if factor == 7 else factor + 1
+    resto = 11 - suma % 11
+    return "0" if resto == 11 else "K" if resto == 10 else str(resto)
+
+
+def rut_valido(rut):
+    """Devuelve el número del RUT (sin guión ni dígito verificador) si el formato y el
+    dígito verificador son correctos; None en caso contrario."""
+    m = RE_RUT.match(rut)
+    if m is None or digito_verificador(m.group(1)) != m.group(2).upper():
+        return None
+    return m.group(1)
+
+
+def identificador_valido(identifier):
+    """Email, o RUT con dígito verificador (se devuelve solo el número)."""
+    if RE_EMAIL.match(identifier):
+        return identifier
+    return rut_valido(identifier)
+
+
+def password_valida(password):
+    return password if RE_PASSWORD.match(password) else None
+
+
+_RE_NUMERO_RUT = re.compile(r'^\d{1,8}$')
+
+
+def lista_de_ruts(valor):
+    """Lista de RUTs, con o sin dígito verificador (si viene, se verifica). Devuelve los números
+    sin repetir y en el orden recibido, o None si alguno es inválido."""
+    if not isinstance(valor, list):
+        return None
+    ruts = {}
+    for rut in valor:
+        if isinstance(rut, int) and not isinstance(rut, bool):
+            rut = str(rut)
+        if not isinstance(rut, str):
+            return None
+        numero = rut if _RE_NUMERO_RUT.match(rut) else rut_valido(rut)
+        if numero is None:
+            return None
+        ruts[numero] = None
+    return list(ruts) or None
+
+
+def numero_rut(valor):
+    """Número de RUT sin dígito verificador (por ejemplo, el cursor de una exportación)."""
+    return valor if isinstance(valor, str) and _RE_NUMERO_RUT.match(valor) else None
+
+
+def entero_positivo(valor):
+    if isinstance(valor, int) and not isinstance(valor, bool) and valor > 0:
+        return valor
+    return None
+
+
+def opcion(*valores):
+    """Validador que acepta solo uno de `valores`."""
+    def validar(valor):
+        return valor if valor in valores else None
+    return validar
+
+
+_RE_CODIGO = re.compile(r'^\d{6}$')
+
+
+def codigo_valido(valor):
+    """Código de recuperación de 6 dígitos (como texto)."""
+    return valor if isinstance(valor, str) and _RE_CODIGO.match(valor) else None
+
+
+def token_valido(valor):
+    """Token JWT como texto; la firma y la vigencia se verifican en la ruta."""
+    return valor if isinstance(valor, str) and valor.count(".") == 2 else None
+
+
+def puntuacion_valida(valor):
+    """Puntuación entera de 1 a 5 (CK_Puntuacion de Valoraciones)."""
+    if isinstance(valor, int) and not isinstance(valor, bool) and 1 <= valor <= 5:
+        return valor
+    return None
+
+
+COMENTARIO_MAX = 2000
+
+
+def comentario_valido(valor):
+    """Comentario libre de una valoración: texto de hasta COMENTARIO_MAX caracteres. No se
+    sanitiza (se guarda tal cual, como parámetro)."""
+    if isinstance(valor, str) and len(valor) <= COMENTARIO_MAX:
+        return valor.strip()
+    return None
+
+
+def fecha_valida(valor):
+    """Fecha AAAA-MM-DD; devuelve datetime.date."""
+    try:
+        return datetime.date.fromisoformat(valor) if isinstance(valor, str) else None
+    except ValueError:
+        return None
+
+
+def lista_de_objetos(valor):
+    if isinstance(valor, list) and valor and all(isinstance(v, dict) for v in valor):
+        return valor
+    return None
+
+
+# --- Respuestas --------------------------------------------------------------
+
+@functools.lru_cache(maxsize=256)
+def _cuerpo_error(message):
+    return dumps({"error": message})
+
+
+def respuesta(datos, status_code=200, headers=None):
+    return func.HttpResponse(dumps(datos), mimetype=MIMETYPE, status_code=status_code, headers=headers)
+
+
+def error(message, status_code=400, headers=None):
+    """Respuesta de error. Los mensajes repetidos reutilizan el cuerpo ya serializado."""
+    return func.HttpResponse(_cuerpo_error(message), mimetype=MIMETYPE, status_code=status_code,
+                             headers=headers)
+
+
+def no_disponible(message, reintentar_en=1):
+    """503 con Retry-After (segundos enteros, al menos 1)."""
+    return error(message, 503, headers={"Retry-After": str(max(1, math.ceil(reintentar_en)))})
+
+
+# --- Respuestas condicionales (ETag / If-None-Match) -------------------------
+
+# Datos de un usuario: ningún cache compartido los guarda y el cliente revalida siempre
+_CACHE_CONTROL = "private, no-cache"
+
+
+def etag(*partes):
+    """ETag fuerte a partir de la versión de fila (ROWVERSION, bytes) y otras partes; las
+    partes None se omiten. Devuelve None si no hay versión (base sin la migración 3)."""
+    partes = [p.hex() if isinstance(p, bytes) else str(p) for p in partes if p is not None]
+    return f'"{"-".join(partes)}"' if partes else None
+
+
+def etag_coincide(si_none_match, etag_vigente):
+    """Compara If-None-Match (lista de ETags o *) con el ETag vigente. If-None-Match usa la
+    comparación débil: W/"x" coincide con "x"."""
+    if not si_none_match or not etag_vigente:
+        return False
+    for candidato in si_none_match.split(","):
+        candidato = candidato.strip()
+        if candidato.startswith("W/"):
+            candidato = candidato[2:]
+        if candidato == "*" or candidato == etag_vigente:
+            return True
+    return False
+
+
+def condicional(entrada, si_none_match):
+    """Entrada (datos, ETag) de un cache versionado. Si el cliente ya tiene esa versión devuelve
+    (None, ETag): la respuesta es 304 y los datos no se serializan."""
+    datos, etag_vigente = entrada
+    if etag_coincide(si_none_match, etag_vigente):
+        return None, etag_vigente
+    return entrada
+
+
+def respuesta_versionada(datos, etag_vigente):
+    """200 con ETag, o 304 sin cuerpo si `datos` es None (ver condicional)."""
+    headers = {"Cache-Control": _CACHE_CONTROL}
+    if etag_vigente:
+        headers["ETag"] = etag_vigente
+    if datos is None:
+        return func.HttpResponse(status_code=304, headers=headers)
+    return respuesta(datos, headers=headers)
+
+
+CUERPO_INVALIDO = "Cuerpo de solicitud inválido"
+BASE_NO_DISPONIBLE = "Base de datos no disponible, intente nuevamente"
+
+
+# --- Esquemas ----------------------------------------------------------------
+
+class Campo:
+    """Campo del cuerpo JSON. `validar` recibe el valor (ya sanitizado si corresponde) y
+    devuelve el valor normalizado, o None si es inválido."""
+
+    __slots__ = ("nombre", "requerido", "sanitizar", "validar", "mensaje")
+
+    def __init__(self, nombre, requerido=False, sanitizar=False, validar=None, mensaje=None):
+        self.nombre = nombre
+        self.requerido = requerido
+        self.sanitizar = sanitizar
+        self.validar = validar
+        self.mensaje = mensaje
+
+
+class Esquema:
+    """Campos esperados de una ruta y el mensaje para campos obligatorios ausentes."""
+
+    def __init__(self, *campos, faltantes, cuerpo_opcional=False):
+        self.campos = campos
+        self.faltantes = faltantes
+        self.cuerpo_opcional = cuerpo_opcional
+        # Serializar los errores al declarar el esquema y no en cada solicitud
+        for mensaje in [faltantes, CUERPO_INVALIDO] + [c.mensaje for c in campos if c.mensaje]:
+            _cuerpo_error(mensaje)
+
+    def leer(self, req):
+        """Lee y valida el cuerpo. Devuelve (datos, None) o (None, respuesta de error 400)."""
+        cuerpo = req.get_body()
+        if not cuerpo and self.cuerpo_opcional:
+            body = {}
+        else:
+            try:
+                body = loads(cuerpo)
+            except ValueError:
+                return None, error(CUERPO_INVALIDO)
+            if not isinstance(body, dict):
+                return None, error(CUERPO_INVALIDO)
+
+        datos, mensaje = self.validar(body)
+        if mensaje:
+            return None, error(mensaje)
+        return datos, None
+
+    def validar(self, body):
+        """Valida un objeto ya decodificado (por ejemplo, cada elemento de un lote). Devuelve
+        (datos, None) o (None, mensaje de error)."""
+        datos = {}
+        for campo in self.campos:
+            valor = body.get(campo.nombre)
+            if not valor:
+                if campo.requerido:
+                    return None, self.faltantes
+                datos[campo.nombre] = valor
+                continue
+            if campo.sanitizar:
+                if not isinstance(valor, str):
+                    return None, campo.mensaje or CUERPO_INVALIDO
+                valor = sanitize_input(valor)
+            if campo.validar is not None:
+                valor = campo.validar(valor)
+                if valor is None:
+                    return None, campo.mensaje or CUERPO_INVALIDO
+            datos[campo.nombre] = valor
+        return datos, None
+
+
+# Esquemas por ruta
+PASSWORD_INVALIDA = ("Formato de contraseña inválido. La contraseña debe tener al menos 8 caracteres, "
+                     "contener una letra mayúscula, una minúscula y un número.")
+
+LOGIN = Esquema(
+    Campo("identifier", requerido=True, sanitizar=True, validar=identificador_valido,
+          mensaje="Formato de identificador inválido"),
+    Campo("password", requerido=True, sanitizar=True, validar=password_valida,
+          mensaje="Formato de contraseña inválido"),
+    faltantes="Identificador y contraseña son requeridos",
+)
+
+REGISTRO = Esquema(
+    Campo("rut", requerido=True, sanitizar=True, validar=rut_valido, mensaje="Formato de RUT inválido"),
+    Campo("password", requerido=True, sanitizar=True, validar=password_valida, mensaje=PASSWORD_INVALIDA),
+    Campo("direccion"),
+    Campo("numero"),
+    faltantes="RUT y contraseña son campos obligatorios",
+)
+
+# Alta de colaboradores en lote: cada elemento se valida con REGISTRO por separado
+REGISTRO_LOTE = Esquema(
+    Campo("colaboradores", requerido=True, validar=lista_de_objetos, mensaje="Formato de colaboradores inválido"),
+    faltantes="Lista de colaboradores es requerida",
+)
+
+PASSWORD_RETRY = Esquema(
+    Campo("identifier", requerido=True, sanitizar=True, validar=identificador_valido,
+          mensaje="Formato de identificador inválido"),
+    faltantes="Identificador es requerido",
+)
+
+VERIFICAR_CODIGO = Esquema(
+    Campo("identifier", requerido=True, sanitizar=True, validar=identificador_valido,
+          mensaje="Formato de identificador inválido"),
+    Campo("code", requerido=True, validar=codigo_valido, mensaje="Formato de código inválido"),
+    faltantes="Identificador y código son requeridos",
+)
+
+# El token es el reset_token que entrega la verificación del código
+CAMBIAR_CONTRASENA = Esquema(
+    Campo("reset_token", requerido=True, validar=token_valido, mensaje="Token inválido o expirado"),
+    Campo("password", requerido=True, sanitizar=True, validar=password_valida, mensaje=PASSWORD_INVALIDA),
+    faltantes="Token y contraseña son requeridos",
+)
+
+# El RUT de las rutas de datos viene del token; el del cuerpo solo se contrasta con él
+RUT = Esquema(
+    Campo("rut"),
+    faltantes="RUT es requerido",
+    cuerpo_opcional=True,
+)
+
+HIJOS = Esquema(
+    Campo("rut"),
+    Campo("hijos", requerido=True, validar=lista_de_objetos, mensaje="Formato de hijos inválido"),
+    faltantes="RUT y datos de hijos son requeridos",
+)
+
+PERFIL_BATCH = Esquema(
+    Campo("ruts", requerido=True, validar=lista_de_ruts, mensaje="Formato de RUTs inválido"),
+    faltantes="Lista de RUTs es requerida",
+)
+
+VALORACION = Esquema(
+    Campo("rut"),
+    Campo("puntuacion", requerido=True, validar=puntuacion_valida, mensaje="Puntuación inválida: use un entero de 1 a 5"),
+    Campo("comentario", validar=comentario_valido,
+          mensaje=f"Comentario inválido: máximo {COMENTARIO_MAX} caracteres"),
+    faltantes="RUT y puntuación son requeridos",
+)
+
+# Panel de valoraciones (administradores): sin cuerpo, los últimos días de todos los usuarios
+RESUMEN_VALORACIONES = Esquema(
+    Campo("desde", validar=fecha_valida, mensaje="Fecha inválida: use AAAA-MM-DD"),
+    Campo("hasta", validar=fecha_valida, mensaje="Fecha inválida: use AAAA-MM-DD"),
+    Campo("usuario", validar=numero_rut, mensaje="RUT inválido"),
+    faltantes="Rango de fechas inválido",
+    cuerpo_opcional=True,
+)
+
+EXPORTAR = Esquema(
+    Campo("conjunto", requerido=True, validar=opcion("empleados", "hijos"),
+          mensaje="Conjunto inválido: use empleados o hijos"),
+    Campo("formato", validar=opcion("ndjson", "csv"), mensaje="Formato inválido: use ndjson o csv"),
+    Campo("desde", validar=numero_rut, mensaje="Cursor de exportación inválido"),
+    Campo("limite", validar=entero_positivo, mensaje="Límite inválido"),
+    faltantes="Conjunto a exportar es requerido",
+)
@@ -0,0 +1,276 @@
+# exportar.py
+#
+# Exportación de Empleados (con su cuenta de UsuarioColaborador, sin la contraseña) y de Hijos
+# para reportes. Se pagina por clave sobre RUTUsuario: cada página son los N RUTs siguientes al
+# último leído (procedimientos ExportarEmpleados y ExportarHijos), así que una página cuesta lo
+# mismo al principio que al final de la tabla y no hay transacciones abiertas entre páginas.
+# Las filas se leen con fetchmany y pasan por generadores hasta el serializador (NDJSON o CSV,
+# con gzip opcional): la memoria queda acotada por una página, crezca lo que crezca la tabla.
+#
+# La ruta HTTP devuelve una página por solicitud y el cursor de la siguiente en la cabecera
+# X-Siguiente-Desde. El CLI recorre todas las páginas y escribe a un archivo o a stdout:
+#   python exportar.py empleados --formato csv --gzip -o empleados.csv.gz
+#   python exportar.py hijos > hijos.ndjson
+
+import azure.functions as func
+import argparse
+import csv
+import io
+import logging
+import os
+import sys
+import zlib
+import pyodbc
+import async_support
+import auth
+import circuit_breaker
+import db_pool
+import esquemas
+import retry
+import timing
+
+EXPORT_PAGE_SIZE = int(os.environ.get("ExportPageSize", "5000"))      # RUTs por página (y máximo por solicitud HTTP)
+EXPORT_FETCH_SIZE = int(os.environ.get("ExportFetchSize", "1000"))    # filas por fetchmany
+EXPORT_CHUNK_BYTES = 64 * 1024                                        # tamaño de los bloques de salida
+
+MIMETYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _fila_empleado(row):
+    fila = tuple(row)
+    return fila[:8] + (bool(fila[8]),) + fila[9:]
+
+
+def _fila_hijo(row):
+    rut, nombre, fecha, es_estudiante = row
+    if fecha is None:
+        # Empleado sin hijos: solo sirve para avanzar el cursor
+        return None
+    if isinstance(es_estudiante, bytes):
+        es_estudiante = int.from_bytes(es_estudiante, "big")
+    return rut, nombre, fecha.isoformat(), bool(es_estudiante) if es_estudiante is not None else None
+
+
+# conjunto -> (procedimiento, columnas, conversión de fila)
+CONJUNTOS = {
+    "empleados": ("ExportarEmpleados",
+                  ("RUTUsuario", "DV", "NombreCompleto", "Email", "Edad", "Sexo", "Ciudad",
+                   "Nacionalidad", "Colaborador", "Direccion", "NumeroTelefono"),
+                  _fila_empleado),
+    "hijos": ("ExportarHijos",
+              ("RUTUsuario", "NombreCompletoHijo", "FechaNacimientoHijo", "EsEstudiante"),
+              _fila_hijo),
+}
+
+
+# --- Lectura -----------------------------------------------------------------
+
+def _filas_cursor(cursor):
+    """Filas del cursor de a EXPORT_FETCH_SIZE, sin materializar el resultado completo."""
+    while True:
+        bloque = cursor.fetchmany(EXPORT_FETCH_SIZE)
+        if not bloque:
+            return
+        yield from bloque
+
+
+def _leer_pagina(conjunto, desde, limite):
+    """Un intento de lectura de una página. Devuelve (filas convertidas, último RUT, cantidad de
+    RUTs). La página se lee completa antes de devolver la conexión al pool, para que un consumidor
+    lento no retenga la conexión y un reintento no duplique filas ya entregadas."""
+    procedimiento, _, convertir = CONJUNTOS[conjunto]
+    filas = []
+    ultimo, ruts = None, 0
+    with db_pool.connection() as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            cursor.execute(f"{{CALL {procedimiento}(?, ?)}}", (desde, limite))
+            for row in _filas_cursor(cursor):
+                if row[0] != ultimo:
+                    ultimo = row[0]
+                    ruts += 1
+                fila = convertir(row)
+                if fila is not None:
+                    filas.append(fila)
+    return filas, ultimo, ruts
+
+
+def pagina(conjunto, desde="", limite=EXPORT_PAGE_SIZE, max_retries=3, delay=None):
+    """Lee una página con reintentos. Devuelve (filas, cursor de la siguiente página o None si
+    era la última)."""
+    filas, ultimo, ruts = retry.call_with_retries(_leer_pagina, (conjunto, desde, limite), max_retries, delay)
+    return filas, ultimo if ruts >= limite else None
+
+
+async def pagina_async(conjunto, desde="", limite=EXPORT_PAGE_SIZE, max_retries=3, delay=None):
+    """Variante async de pagina."""
+    filas, ultimo, ruts = await retry.call_with_retries_async(
+        _leer_pagina, (conjunto, desde, limite), max_retries, delay)
+    return filas, ultimo if ruts >= limite else None
+
+
+def filas(conjunto, desde="", limite=EXPORT_PAGE_SIZE, max_retries=3, delay=None):
+    """Generador de todas las filas del conjunto a partir de `desde`, página por página."""
+    while desde is not None:
+        pagina_filas, desde = pagina(conjunto, desde, limite, max_retries, delay)
+        yield from pagina_filas
+
+
+# --- Serialización -----------------------------------------------------------
+
+def ndjson(filas, columnas):
+    """Un objeto JSON por línea, agrupado en bloques de ~EXPORT_CHUNK_BYTES."""
+    partes, tamano = [], 0
+    for fila in filas:
+        linea = esquemas.dumps(dict(zip(columnas, fila)))
+        partes.append(linea)
+        tamano += len(linea) + 1
+        if tamano >= EXPORT_CHUNK_BYTES:
+            partes.append(b"")
+            yield b"\n".join(partes)
+            partes, tamano = [], 0
+    if partes:
+        partes.append(b"")
+        yield b"\n".join(partes)
+
+
+def csv_(filas, columnas, encabezado=True):
+    """CSV con encabezado, en bloques de ~EXPORT_CHUNK_BYTES."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if encabezado:
+        writer.writerow(columnas)
+    for fila in filas:
+        writer.writerow(fila)
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+SERIALIZADORES = {"ndjson": ndjson, "csv": csv_}
+
+
+def comprimir(partes, nivel=6):
+    """Comprime un flujo de bytes en formato gzip sin juntarlo en memoria."""
+    compresor = zlib.compressobj(nivel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for parte in partes:
+        salida = compresor.compress(parte)
+        if salida:
+            yield salida
+    yield compresor.flush()
+
+
+def exportar(conjunto, formato="ndjson", gzip=False, desde="", limite=EXPORT_PAGE_SIZE):
+    """Flujo de bytes con la exportación completa del conjunto."""
+    columnas = CONJUNTOS[conjunto][1]
+    partes = SERIALIZADORES[formato](filas(conjunto, desde, limite), columnas)
+    return comprimir(partes) if gzip else partes
+
+
+# --- HTTP --------------------------------------------------------------------
+
+def _leer_solicitud(req):
+    """Parámetros de la exportación, solo para administradores. Devuelve (datos, None) o
+    (None, respuesta de error)."""
+    _, error = auth.admin_autenticado(req)
+    if error:
+        return None, error
+    datos, error = esquemas.EXPORTAR.leer(req)
+    if error:
+        return None, error
+    datos['formato'] = datos['formato'] or "ndjson"
+    datos['desde'] = datos['desde'] or ""
+    datos['limite'] = min(datos['limite'] or EXPORT_PAGE_SIZE, EXPORT_PAGE_SIZE)
+    datos['gzip'] = "gzip" in req.headers.get("Accept-Encoding", "")
+    return datos, None
+
+
+def _cuerpo(datos, filas):
+    """Serializa la página (en el executor en la variante async: es trabajo de CPU)."""
+    columnas = CONJUNTOS[datos['conjunto']][1]
+    # En HTTP el encabezado CSV va solo en la primera página, para poder concatenarlas
+    if datos['formato'] == "csv":
+        partes = csv_(filas, columnas, encabezado=not datos['desde'])
+    else:
+        partes = ndjson(filas, columnas)
+    return b"".join(comprimir(partes) if datos['gzip'] else partes)
+
+
+def _respuesta(datos, cuerpo, siguiente):
+    headers = {}
+    if siguiente is not None:
+        headers["X-Siguiente-Desde"] = siguiente
+    if datos['gzip']:
+        headers["Content-Encoding"] = "gzip"
+    return func.HttpResponse(cuerpo, mimetype=MIMETYPES[datos['formato']], status_code=200, headers=headers)
+
+
+def _respuesta_excepcion(e):
+    if isinstance(e, circuit_breaker.CircuitoAbierto):
+        return esquemas.no_disponible(esquemas.BASE_NO_DISPONIBLE, e.reintentar_en)
+    if isinstance(e, pyodbc.Error):
+        # Tras los reintentos: el cliente puede repetir la página con el mismo cursor
+        logging.error(f"Error de base de datos en la exportación: {str(e)}")
+        return esquemas.no_disponible("Error de base de datos: " + str(e))
+    if isinstance(e, (ValueError, KeyError, TypeError)):
+        return esquemas.error("Solicitud inválida: " + str(e), 400)
+    logging.error(f"Error no manejado: {str(e)}")
+    return esquemas.error("Error interno del servidor", 500)
+
+
+def main_exportar(req: func.HttpRequest) -> func.HttpResponse:
+    """Maneja la solicitud HTTP de una página de exportación."""
+    try:
+        with timing.span("validacion"):
+            datos, error = _leer_solicitud(req)
+        if error:
+            return error
+        filas_pagina, siguiente = pagina(datos['conjunto'], datos['desde'], datos['limite'])
+        with timing.span("respuesta"):
+            return _respuesta(datos, _cuerpo(datos, filas_pagina), siguiente)
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+
+async def main_exportar_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_exportar."""
+    try:
+        with timing.span("validacion"):
+            datos, error = _leer_solicitud(req)
+        if error:
+            return error
+        filas_pagina, siguiente = await pagina_async(datos['conjunto'], datos['desde'], datos['limite'])
+        with timing.span("respuesta"):
+            cuerpo = await async_support.run_blocking(_cuerpo, datos, filas_pagina)
+            return _respuesta(datos, cuerpo, siguiente)
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+
+# --- CLI ---------------------------------------------------------------------
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta Empleados o Hijos (requiere SqlConnectionString)")
+    parser.add_argument("conjunto", choices=list(CONJUNTOS))
+    parser.add_argument("--formato", choices=list(SERIALIZADORES), default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="comprimir la salida")
+    parser.add_argument("--desde", default="", help="RUT después del cual empezar (reanudar)")
+    parser.add_argument("--pagina", type=int, default=EXPORT_PAGE_SIZE, help="RUTs por página")
+    parser.add_argument("-o", "--salida", help="archivo de salida (por defecto stdout)")
+    args = parser.parse_args(argv)
+
+    salida = open(args.salida, "wb") if args.salida else sys.stdout.buffer
+    try:
+        for parte in exportar(args.conjunto, args.formato, args.gzip, args.desde, args.pagina):
+            salida.write(parte)
+    finally:
+        if args.salida:
+            salida.close()
+        db_pool.get_pool().close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,37 +2,124 @@
 
 import azure.functions as func
 import datetime
+import functools
+import importlib
 import json
 import logging
-import login_chat
-import registro_chat
-import perfil_chat
-import hijos_chat
-import password_retry_sms
+import os
+import threading
+import async_support
+import timing
 
 app = func.FunctionApp()
 
-@app.route(route="http_trigger_login", auth_level=func.AuthLevel.FUNCTION)
-def http_trigger_login(req: func.HttpRequest) -> func.HttpResponse:
-    return login_chat.main_login(req)
+# Los módulos de cada ruta (y con ellos pyodbc, scrypt, jwt y el SDK de SMS) se importan
+# en el primer uso de la ruta, no al arrancar el worker: así el cold start no paga por
+# dependencias que esa instancia quizá nunca use.
+_handlers = {}
+_rutas = []
 
-@app.route(route="http_trigger_registro", auth_level=func.AuthLevel.FUNCTION)
-def http_trigger_registro(req: func.HttpRequest) -> func.HttpResponse:
-    return registro_chat.main_register(req)
+def _cargar(modulo, nombre):
+    """Devuelve el handler `modulo.nombre`, importando el módulo la primera vez."""
+    handler = _handlers.get((modulo, nombre))
+    if handler is None:
+        handler = getattr(importlib.import_module(modulo), nombre)
+        _handlers[(modulo, nombre)] = handler
+    return handler
 
-@app.route(route="http_trigger_perfil", auth_level=func.AuthLevel.FUNCTION)
-def http_trigger_perfil(req: func.HttpRequest) -> func.HttpResponse:
-    return perfil_chat.main_perfil(req)
+def precargar():
+    """Importa todos los módulos de handlers de una vez (por ejemplo, al precalentar)."""
+    sufijo = "_async" if async_support.ASYNC_HANDLERS else ""
+    for modulo, nombre in _rutas:
+        _cargar(modulo, nombre + sufijo)
 
-@app.route(route="http_trigger_get_hijos", auth_level=func.AuthLevel.FUNCTION)
-def http_trigger_get_hijos(req: func.HttpRequest) -> func.HttpResponse:
-    return hijos_chat.main_get_hijos(req)
+def _registrar(route, modulo, nombre, idempotente=False):
+    """Registra la ruta con el handler sync, o con su variante async si AsyncHandlers=1.
+    Con RequestTiming=1 cada solicitud se mide por fases (ver timing.py). Cada solicitud abre su
+    presupuesto de reintentos (retry.presupuesto); retry se importa junto al primer handler.
+    Las rutas idempotentes aceptan la cabecera Idempotency-Key (ver idempotencia.py)."""
+    _rutas.append((modulo, nombre))
+    if idempotente and ("idempotencia", "ejecutar") not in _rutas:
+        _rutas.append(("idempotencia", "ejecutar"))
+    if async_support.ASYNC_HANDLERS:
+        async def trigger(req: func.HttpRequest) -> func.HttpResponse:
+            handler = _cargar(modulo, nombre + "_async")
+            if idempotente:
+                handler = functools.partial(_cargar("idempotencia", "ejecutar_async"), route, handler)
+            with _cargar("retry", "presupuesto")():
+                return await timing.medir_async(route, handler, req)
+    else:
+        def trigger(req: func.HttpRequest) -> func.HttpResponse:
+            handler = _cargar(modulo, nombre)
+            if idempotente:
+                handler = functools.partial(_cargar("idempotencia", "ejecutar"), route, handler)
+            with _cargar("retry", "presupuesto")():
+                return timing.medir(route, handler, req)
+    # El nombre de la función en Azure es el nombre de la función Python
+    trigger.__name__ = trigger.__qualname__ = route
+    return app.route(route=route, auth_level=func.AuthLevel.FUNCTION)(trigger)
 
-@app.route(route="http_trigger_save_hijos", auth_level=func.AuthLevel.FUNCTION)
-def http_trigger_save_hijos(req: func.HttpRequest) -> func.HttpResponse:
-    return hijos_chat.main_save_hijos(req)
+http_trigger_login = _registrar("http_trigger_login", "login_chat", "main_login")
 
+http_trigger_registro = _registrar("http_trigger_registro", "registro_chat", "main_register", idempotente=True)
 
-@app.route(route="http_trigger_password_retry_sms", auth_level=func.AuthLevel.FUNCTION)
-def http_trigger_password_retry_sms(req: func.HttpRequest) -> func.HttpResponse:
-    return password_retry_sms.main_password_retry(req)
\ No newline at end of file
+http_trigger_registro_lote = _registrar("http_trigger_registro_lote", "registro_chat", "main_register_lote")
+
+http_trigger_perfil = _registrar("http_trigger_perfil", "perfil_chat", "main_perfil")
+
+http_trigger_perfil_batch = _registrar("http_trigger_perfil_batch", "perfil_chat", "main_perfil_batch")
+
+http_trigger_get_hijos = _registrar("http_trigger_get_hijos", "hijos_chat", "main_get_hijos")
+
+http_trigger_save_hijos = _registrar("http_trigger_save_hijos", "hijos_chat", "main_save_hijos", idempotente=True)
+
+http_trigger_exportar = _registrar("http_trigger_exportar", "exportar", "main_exportar")
+
+# Valoraciones de las conversaciones: se escriben en lotes desde un buffer (ver valoraciones.py)
+http_trigger_valoracion = _registrar("http_trigger_valoracion", "valoraciones", "main_valorar", idempotente=True)
+
+http_trigger_valoraciones_resumen = _registrar("http_trigger_valoraciones_resumen", "valoraciones", "main_resumen")
+
+
+http_trigger_password_retry_sms = _registrar("http_trigger_password_retry_sms", "password_retry_sms", "main_password_retry")
+
+http_trigger_verify_reset_code = _registrar("http_trigger_verify_reset_code", "password_retry_sms", "main_verify_code")
+
+http_trigger_reset_password = _registrar("http_trigger_reset_password", "password_retry_sms", "main_reset_password")
+
+@app.timer_trigger(schedule=os.environ.get("SmsOutboxSchedule", "0 */1 * * * *"), arg_name="timer", run_on_startup=False)
+def timer_sms_outbox(timer: func.TimerRequest) -> None:
+    """Envía los SMS pendientes que hayan quedado en el outbox (por ejemplo, de una instancia
+    reciclada) y purga los ya enviados o fallidos."""
+    enviados = _cargar("sms_outbox", "drenar")()
+    if enviados:
+        logging.info(f"Outbox de SMS: {enviados} mensajes procesados")
+    borrados = _cargar("sms_outbox", "purgar")()
+    if borrados:
+        logging.info(f"Outbox de SMS: {borrados} mensajes purgados")
+
+@app.timer_trigger(schedule=os.environ.get("ResetCodePurgeSchedule", "0 */15 * * * *"), arg_name="timer", run_on_startup=False)
+def timer_reset_codes(timer: func.TimerRequest) -> None:
+    """Borra los códigos de recuperación vencidos, usados o bloqueados."""
+    borrados = _cargar("codigos_reset", "purgar")()
+    if borrados:
+        logging.info(f"Códigos de recuperación: {borrados} purgados")
+
+# Precalentamiento (ver precalentar.py). El timer corre en una sola instancia a la vez, así
+# que mantiene viva la aplicación pero no calienta cada instancia nueva del escalado: de eso
+# se encarga el precalentamiento al arrancar el worker, en un hilo para no retrasar el arranque.
+PREWARM_ON_STARTUP = os.environ.get("PrewarmOnStartup", "1") == "1"
+
+def _precalentar(origen):
+    try:
+        _cargar("precalentar", "ejecutar")(origen, precargar)
+    except Exception as e:
+        logging.warning(f"Precalentamiento ({origen}) interrumpido: {str(e)}")
+
+@app.timer_trigger(schedule=os.environ.get("PrewarmSchedule", "0 */4 * * * *"), arg_name="timer", run_on_startup=False)
+def timer_precalentar(timer: func.TimerRequest) -> None:
+    """Repite el precalentamiento: repone conexiones recicladas o descartadas y mantiene la instancia activa."""
+    _precalentar("timer")
+
+if PREWARM_ON_STARTUP:
+    threading.Thread(target=_precalentar, args=("inicio",), name="precalentar", daemon=True).start()
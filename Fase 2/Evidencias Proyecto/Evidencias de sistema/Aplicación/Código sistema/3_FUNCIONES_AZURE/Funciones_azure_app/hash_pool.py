@@ -0,0 +1,235 @@
+# hash_pool.py
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import scrypt
+
+import async_support
+import timing
+
+# Configuración: capacidad de hashing dimensionada a los núcleos, independiente de la concurrencia HTTP.
+# HashPoolWorkers=0 calcula el hash en el hilo de la solicitud (útil en desarrollo).
+HASH_WORKERS = int(os.environ.get("HashPoolWorkers", str(os.cpu_count() or 1)))
+HASH_MAX_PENDING = int(os.environ.get("HashPoolMaxPending", str(max(HASH_WORKERS, 1) * 4)))
+HASH_TIMEOUT = float(os.environ.get("HashPoolTimeoutSeconds", "10"))
+# Hashes por tarea en hash_lote: reparte el costo de enviar cada tarea al proceso trabajador
+HASH_BATCH_CHUNK = int(os.environ.get("HashPoolBatchChunk", "16"))
+
+
+class HashPoolFull(Exception):
+    """La cola de hashing está llena; la solicitud debe rechazarse con 503."""
+
+
+# Fallas del pool que la solicitud informa como 503: sin cupo, un hash que no terminó dentro de
+# HashPoolTimeoutSeconds o un trabajador que murió (el pool se recrea en el próximo envío)
+NO_DISPONIBLE = (HashPoolFull, FutureTimeoutError, asyncio.TimeoutError, BrokenProcessPool)
+
+
+def _scrypt_worker(password, salt, N, r, p, buflen, submitted_at):
+    """Se ejecuta en el proceso trabajador. Devuelve el hash y las marcas de tiempo."""
+    started_at = time.time()
+    digest = scrypt.hash(password, salt, N=N, r=r, p=p, buflen=buflen)
+    return digest, started_at - submitted_at, time.time() - started_at
+
+
+def _scrypt_worker_lote(pares, N, r, p, buflen, submitted_at):
+    """Como _scrypt_worker, para una lista de (password, salt) en una sola tarea."""
+    started_at = time.time()
+    digests = [scrypt.hash(password, salt, N=N, r=r, p=p, buflen=buflen) for password, salt in pares]
+    return digests, started_at - submitted_at, time.time() - started_at
+
+
+class HashPool:
+    """Pool de procesos para scrypt con límite de trabajos pendientes y rechazo inmediato."""
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING, timeout=HASH_TIMEOUT):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        # Métricas
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._queue_total = 0.0
+        self._queue_max = 0.0
+        self._hash_total = 0.0
+        self._hash_max = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _record(self, queue_time, hash_time, cantidad=1):
+        if queue_time:
+            timing.agregar("hash_cola", queue_time * 1000)
+        timing.agregar("scrypt", hash_time * 1000)
+        with self._lock:
+            self._completed += cantidad
+            self._queue_total += queue_time * cantidad
+            self._queue_max = max(self._queue_max, queue_time)
+            self._hash_total += hash_time
+            self._hash_max = max(self._hash_max, hash_time / cantidad)
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _submit(self, worker, args, esperar=False):
+        """Encola `worker(*args, submitted_at)` ocupando un cupo. Sin cupo lanza HashPoolFull de
+        inmediato, o tras esperar hasta `timeout` si `esperar` es verdadero."""
+        if not self._slots.acquire(blocking=esperar, timeout=self.timeout if esperar else None):
+            with self._lock:
+                self._rejected += 1
+            raise HashPoolFull("Servicio de hashing saturado")
+        with self._lock:
+            self._pending += 1
+            self._submitted += 1
+
+        try:
+            future = self._get_executor().submit(worker, *args, time.time())
+        except BrokenProcessPool:
+            # Un trabajador murió: recrear el pool y reintentar una vez
+            logging.warning("Pool de hashing roto, recreándolo")
+            with self._lock:
+                self._executor = None
+            try:
+                future = self._get_executor().submit(worker, *args, time.time())
+            except Exception:
+                self._release()
+                raise
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def submit(self, password, salt, N, r, p, buflen):
+        """Encola un hash y devuelve un Future con el resultado. Lanza HashPoolFull si no hay cupo."""
+        return self._submit(_scrypt_worker, (password, salt, N, r, p, buflen))
+
+    def hash(self, password, salt, N=16384, r=8, p=1, buflen=24):
+        """Calcula scrypt fuera del hilo de la solicitud y espera el resultado."""
+        if self.workers <= 0:
+            started_at = time.time()
+            digest = scrypt.hash(password, salt, N=N, r=r, p=p, buflen=buflen)
+            self._record(0.0, time.time() - started_at)
+            return digest
+
+        digest, queue_time, hash_time = self.submit(password, salt, N, r, p, buflen).result(self.timeout)
+        self._record(queue_time, hash_time)
+        return digest
+
+    async def hash_async(self, password, salt, N=16384, r=8, p=1, buflen=24):
+        """Variante async de `hash`: espera el resultado sin bloquear el event loop."""
+        if self.workers <= 0:
+            return await async_support.run_blocking(self.hash, password, salt, N, r, p, buflen)
+
+        future = asyncio.wrap_future(self.submit(password, salt, N, r, p, buflen))
+        digest, queue_time, hash_time = await asyncio.wait_for(future, self.timeout)
+        self._record(queue_time, hash_time)
+        return digest
+
+    def hash_lote(self, pares, N=16384, r=8, p=1, buflen=24, chunk=HASH_BATCH_CHUNK):
+        """Hashes de una lista de (password, salt), en el mismo orden. Se envían en tareas de
+        `chunk` hashes y con a lo más `workers` tareas en vuelo, de modo que un lote grande no
+        ocupe todos los cupos y las solicitudes individuales sigan atendiéndose."""
+        if self.workers <= 0:
+            return [self.hash(password, salt, N, r, p, buflen) for password, salt in pares]
+
+        digests = []
+        en_vuelo = deque()
+
+        def esperar_primera():
+            resultado, queue_time, hash_time = en_vuelo.popleft().result(self.timeout * 2)
+            self._record(queue_time, hash_time, len(resultado))
+            digests.extend(resultado)
+
+        for i in range(0, len(pares), chunk):
+            if len(en_vuelo) >= self.workers:
+                esperar_primera()
+            en_vuelo.append(self._submit(_scrypt_worker_lote, (pares[i:i + chunk], N, r, p, buflen), esperar=True))
+        while en_vuelo:
+            esperar_primera()
+        return digests
+
+    async def hash_lote_async(self, pares, N=16384, r=8, p=1, buflen=24, chunk=HASH_BATCH_CHUNK):
+        """Variante async de `hash_lote`: la espera de las tareas corre en el executor."""
+        return await async_support.run_blocking(self.hash_lote, pares, N, r, p, buflen, chunk)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self):
+        """Métricas de cola y de cálculo del hash."""
+        with self._lock:
+            completed = self._completed
+            return {
+                "workers": self.workers,
+                "iniciado": self._executor is not None,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "completed": completed,
+                "queue_avg_ms": (self._queue_total / completed * 1000) if completed else 0.0,
+                "queue_max_ms": self._queue_max * 1000,
+                "hash_avg_ms": (self._hash_total / completed * 1000) if completed else 0.0,
+                "hash_max_ms": self._hash_max * 1000,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Devuelve el pool de hashing compartido, creándolo en el primer uso."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashPool()
+    return _pool
+
+
+def hash_password(password, salt, N=16384, r=8, p=1, buflen=24):
+    """Atajo para `get_pool().hash(...)`."""
+    return get_pool().hash(password, salt, N=N, r=r, p=p, buflen=buflen)
+
+
+async def hash_password_async(password, salt, N=16384, r=8, p=1, buflen=24):
+    """Atajo para `get_pool().hash_async(...)`."""
+    return await get_pool().hash_async(password, salt, N=N, r=r, p=p, buflen=buflen)
+
+
+def hash_passwords(pares, N=16384, r=8, p=1, buflen=24):
+    """Atajo para `get_pool().hash_lote(...)`."""
+    return get_pool().hash_lote(pares, N=N, r=r, p=p, buflen=buflen)
+
+
+async def hash_passwords_async(pares, N=16384, r=8, p=1, buflen=24):
+    """Atajo para `get_pool().hash_lote_async(...)`."""
+    return await get_pool().hash_lote_async(pares, N=N, r=r, p=p, buflen=buflen)
+
+
+def stats():
+    return get_pool().stats()
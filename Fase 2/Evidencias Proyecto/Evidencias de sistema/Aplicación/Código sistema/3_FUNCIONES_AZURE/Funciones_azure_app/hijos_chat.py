@@ -2,178 +2,290 @@
 
 import azure.functions as func
 import logging
-import json
 import pyodbc
 import os
-import time
+import datetime
+import db_pool
+import esquemas
+import auth
+import cache
+import circuit_breaker
+import retry
+import timing
 
-# Obtener la cadena de conexión desde las variables de entorno
-conn_str = os.environ["SqlConnectionString"]
+# Guardado de hijos: en lote (un parámetro tabla por bloque) o una llamada por hijo
+SAVE_HIJOS_BULK = os.environ.get("SaveHijosBulk", "1") == "1"
+SAVE_HIJOS_CHUNK_SIZE = int(os.environ.get("SaveHijosChunkSize", "500"))
 
-def get_hijos(rut, max_retries=3, delay=1):
-    """Realiza lectura de hijos del usuario llamando al procedimiento almacenado con reintentos."""
-    attempts = 0
-    conn = None
-    
+def _etag(cantidad, versiones):
+    """ETag de los hijos de un RUT: la cantidad y la mayor versión de fila (cambia al insertar,
+    modificar o borrar un hijo). None si alguna fila no trae versión (base sin la migración 3)."""
+    if None in versiones:
+        return None
+    return esquemas.etag(cantidad, max(versiones, default=None))
+
+def _leer_hijos(rut):
+    """Un intento de lectura de GetHijos (en la réplica, si hay). El resultado se guarda en
+    cache por RUT, junto con su ETag, hasta que save_hijos lo invalide."""
+    with db_pool.lectura("hijos", rut) as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            cursor.execute("{CALL GetHijos(?)}", (rut,))
+            rows = cursor.fetchall()
+        
+        hijos = []
+        for row in rows:
+            # Convertir la fecha a string en formato dd/MM/yyyy
+            fecha_nacimiento = getattr(row, 'FechaNacimientoHijo', None)
+            if fecha_nacimiento:
+                fecha_str = fecha_nacimiento.strftime('%d/%m/%Y')
+            else:
+                fecha_str = "N/A"
+
+            hijo = {
+                "NombreCompletoHijo": getattr(row, 'NombreCompletoHijo', None),
+                "FechaNacimientoHijo": fecha_str,
+                "EsEstudiante": bool(getattr(row, 'EsEstudiante', None))  # Permitir NULL
+            }
+            hijos.append(hijo)
+        
+        entrada = (hijos, _etag(len(rows), [getattr(row, 'Version', None) for row in rows]))
+        cache.hijos.set(str(rut), entrada)
+        return True, "Hijos encontrados", entrada
+
+def _leer_version(rut):
+    """Un intento de VersionHijos: solo el ETag vigente, sin leer los hijos."""
+    with db_pool.lectura("hijos", rut) as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            cursor.execute("{CALL VersionHijos(?)}", (rut,))
+            row = cursor.fetchone()
+    return _etag(row.Cantidad, [row.Version] if row.Cantidad else [])
+
+def hijos_versionados(rut, si_none_match=None, max_retries=3, delay=None):
+    """Como get_hijos, pero devuelve (success, message, (hijos, etag)). Si la versión vigente
+    coincide con `si_none_match` (If-None-Match) los hijos son None; sin ellos en cache eso se
+    resuelve con VersionHijos, sin leer las filas."""
+    entrada = cache.hijos.get(str(rut))
     try:
-        while attempts < max_retries:
-            try:
-                conn = pyodbc.connect(conn_str)
-                cursor = conn.cursor()
-                cursor.execute("{CALL GetHijos(?)}", (rut,))
-                rows = cursor.fetchall()
-                
-                hijos = []
-                for row in rows:
-                    # Convertir la fecha a string en formato dd/MM/yyyy
-                    fecha_nacimiento = getattr(row, 'FechaNacimientoHijo', None)
-                    if fecha_nacimiento:
-                        fecha_str = fecha_nacimiento.strftime('%d/%m/%Y')
-                    else:
-                        fecha_str = "N/A"
-
-                    hijo = {
-                        "NombreCompletoHijo": getattr(row, 'NombreCompletoHijo', None),
-                        "FechaNacimientoHijo": fecha_str,
-                        "EsEstudiante": bool(getattr(row, 'EsEstudiante', None))  # Permitir NULL
-                    }
-                    hijos.append(hijo)
-                
-                return True, "Hijos encontrados", hijos
-
-            except pyodbc.Error as e:
-                attempts += 1
-                if attempts == max_retries:
-                    return False, f"Error de base de datos: {str(e)}", None
-                time.sleep(delay)
-                
-    finally:
-        if conn:
-            conn.close()
-
-def save_hijos(rut, hijos, max_retries=3, delay=1):
+        if entrada is None and si_none_match:
+            etag = retry.call_with_retries(_leer_version, (rut,), max_retries, delay)
+            if esquemas.etag_coincide(si_none_match, etag):
+                return True, "Hijos encontrados", (None, etag)
+        if entrada is None:
+            _, _, entrada = retry.call_with_retries(_leer_hijos, (rut,), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}", None
+    return True, "Hijos encontrados", esquemas.condicional(entrada, si_none_match)
+
+async def hijos_versionados_async(rut, si_none_match=None, max_retries=3, delay=None):
+    """Variante async de hijos_versionados."""
+    entrada = cache.hijos.get(str(rut))
+    try:
+        if entrada is None and si_none_match:
+            etag = await retry.call_with_retries_async(_leer_version, (rut,), max_retries, delay)
+            if esquemas.etag_coincide(si_none_match, etag):
+                return True, "Hijos encontrados", (None, etag)
+        if entrada is None:
+            _, _, entrada = await retry.call_with_retries_async(_leer_hijos, (rut,), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}", None
+    return True, "Hijos encontrados", esquemas.condicional(entrada, si_none_match)
+
+def get_hijos(rut, max_retries=3, delay=None):
+    """Realiza lectura de hijos del usuario llamando al procedimiento almacenado con reintentos."""
+    success, message, entrada = hijos_versionados(rut, None, max_retries, delay)
+    return success, message, entrada[0] if success else None
+
+async def get_hijos_async(rut, max_retries=3, delay=None):
+    """Variante async de get_hijos: la consulta corre en el executor y los reintentos no bloquean."""
+    success, message, entrada = await hijos_versionados_async(rut, None, max_retries, delay)
+    return success, message, entrada[0] if success else None
+
+def _es_estudiante(hijo):
+    """El EsEstudiante puede ser NULL, así que manejamos ese caso."""
+    if 'esEstudiante' in hijo:
+        return 1 if hijo['esEstudiante'] else 0
+    return None
+
+def _parse_fecha(fecha):
+    """Convierte la fecha de nacimiento (dd/MM/yyyy o yyyy-MM-dd) a date."""
+    if not fecha:
+        raise ValueError("fechaNacimiento es requerida")
+    for formato in ('%d/%m/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(fecha, formato).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Fecha de nacimiento inválida: {fecha}")
+
+def _insertar_hijos_por_fila(cursor, rut, hijos):
+    """Una llamada a RegistrarHijos por cada hijo."""
+    for hijo in hijos:
+        cursor.execute("{CALL RegistrarHijos(?, ?, ?, ?)}", (
+            rut,                           # varchar, not null
+            hijo['nombreCompleto'] or None,# varchar, null
+            hijo['fechaNacimiento'] or None,# date, not null (asumiendo formato dd/MM/yyyy)
+            _es_estudiante(hijo)           # binary, null
+        ))
+    return len(hijos)
+
+def _insertar_hijos_lote(cursor, rut, hijos, chunk_size=None):
+    """Envía los hijos como parámetro tabla a RegistrarHijosLote, en bloques de `chunk_size`.
+    Devuelve la cantidad de filas insertadas."""
+    chunk_size = chunk_size or SAVE_HIJOS_CHUNK_SIZE
+    filas = [
+        (hijo['nombreCompleto'] or None, _parse_fecha(hijo['fechaNacimiento']), _es_estudiante(hijo))
+        for hijo in hijos
+    ]
+    insertados = 0
+    for i in range(0, len(filas), chunk_size):
+        cursor.execute("{CALL RegistrarHijosLote(?, ?)}", (rut, filas[i:i + chunk_size]))
+        row = cursor.fetchone()
+        insertados += row.Insertados if row else 0
+    return insertados
+
+def _guardar_hijos(rut, hijos, bulk):
+    """Un intento de guardado. En modo lote todos los hijos viajan en una sola transacción:
+    si algo falla se hace rollback completo, por lo que el reintento no genera duplicados."""
+    with db_pool.connection() as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+
+            if not bulk:
+                _insertar_hijos_por_fila(cursor, rut, hijos)
+            elif _insertar_hijos_lote(cursor, rut, hijos) < len(hijos):
+                # RegistrarHijosLote no inserta nada si el RUT no existe en Empleados
+                conn.rollback()
+                return False, "El RUT no existe en la tabla Empleados", None
+
+            conn.commit()
+        cache.hijos.invalidate(str(rut))
+        # Que la próxima lectura (y la cache que llena) no venga de una réplica atrasada
+        db_pool.marcar_escritura(rut)
+        return True, "Hijos registrados exitosamente", None
+
+def save_hijos(rut, hijos, max_retries=3, delay=None, bulk=None):
     """Guarda los hijos del usuario llamando al procedimiento almacenado con reintentos."""
-    attempts = 0
-    conn = None
-    
+    bulk = SAVE_HIJOS_BULK if bulk is None else bulk
+    try:
+        return retry.call_with_retries(_guardar_hijos, (rut, hijos, bulk), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}", None
+
+async def save_hijos_async(rut, hijos, max_retries=3, delay=None, bulk=None):
+    """Variante async de save_hijos."""
+    bulk = SAVE_HIJOS_BULK if bulk is None else bulk
     try:
-        while attempts < max_retries:
-            try:
-                conn = pyodbc.connect(conn_str)
-                cursor = conn.cursor()
-                
-                for hijo in hijos:
-                    # El EsEstudiante puede ser NULL, así que manejamos ese caso
-                    es_estudiante = None
-                    if 'esEstudiante' in hijo:
-                        es_estudiante = 1 if hijo['esEstudiante'] else 0
-
-                    cursor.execute("{CALL RegistrarHijos(?, ?, ?, ?)}", (
-                        rut,                           # varchar, not null
-                        hijo['nombreCompleto'] or None,# varchar, null
-                        hijo['fechaNacimiento'] or None,# date, not null (asumiendo formato dd/MM/yyyy)
-                        es_estudiante                  # binary, null
-                    ))
-                
-                conn.commit()
-                return True, "Hijos registrados exitosamente", None
-
-            except pyodbc.Error as e:
-                attempts += 1
-                if attempts == max_retries:
-                    return False, f"Error de base de datos: {str(e)}", None
-                time.sleep(delay)
-                
-    finally:
-        if conn:
-            conn.close()
+        return await retry.call_with_retries_async(_guardar_hijos, (rut, hijos, bulk), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}", None
+
+def _leer_rut(req):
+    """Obtiene el RUT desde el token (o del cuerpo si AuthRequired=0).
+    Devuelve (rut, None) o (None, respuesta de error)."""
+    datos, error = esquemas.RUT.leer(req)
+    if error:
+        return None, error
+    rut, error = auth.rut_autenticado(req, datos['rut'])
+    if error:
+        return None, error
+
+    if not rut:
+        return None, esquemas.error(esquemas.RUT.faltantes, 400)
+    return rut, None
+
+def _leer_rut_e_hijos(req):
+    """Obtiene el RUT desde el token y los hijos del cuerpo.
+    Devuelve ((rut, hijos), None) o (None, respuesta de error)."""
+    datos, error = esquemas.HIJOS.leer(req)
+    if error:
+        return None, error
+    rut, error = auth.rut_autenticado(req, datos['rut'])
+    if error:
+        return None, error
+
+    if not rut:
+        return None, esquemas.error(esquemas.HIJOS.faltantes, 400)
+    return (rut, datos['hijos']), None
+
+def _respuesta_get(success, message, entrada):
+    if success:
+        hijos, etag = entrada
+        # hijos None: el cliente ya tiene esta versión (304)
+        return esquemas.respuesta_versionada(None if hijos is None else {
+            "mensaje": message,
+            "hijos": hijos
+        }, etag)
+    if message.startswith("Error de base de datos"):
+        return esquemas.no_disponible(message)
+    return esquemas.error(message, 401)
+
+def _respuesta_save(success, message, _):
+    if success:
+        return esquemas.respuesta({"mensaje": message})
+    if message.startswith("Error de base de datos"):
+        # Falla transitoria tras los reintentos: 503 para que el cliente reintente (una
+        # respuesta 503 no queda guardada para su Idempotency-Key)
+        return esquemas.no_disponible(message)
+    return esquemas.error(message, 401)
+
+def _respuesta_excepcion(e):
+    if isinstance(e, circuit_breaker.CircuitoAbierto):
+        return esquemas.no_disponible(esquemas.BASE_NO_DISPONIBLE, e.reintentar_en)
+    if isinstance(e, (ValueError, KeyError, TypeError)):
+        return esquemas.error("Solicitud inválida: " + str(e), 400)
+    logging.error(f"Error no manejado: {str(e)}")
+    return esquemas.error("Error interno del servidor", 500)
 
 def main_get_hijos(req: func.HttpRequest) -> func.HttpResponse:
     """Maneja la solicitud HTTP para obtener los hijos del usuario."""
     try:
-        req_body = req.get_json()
-        rut = req_body.get('rut')
-
-        if not rut:
-            return func.HttpResponse(
-                json.dumps({"error": "RUT es requerido"}),
-                mimetype="application/json",
-                status_code=400
-            )
-
-        success, message, hijos = get_hijos(rut)
-
-        if success:
-            return func.HttpResponse(
-                json.dumps({
-                    "mensaje": message,
-                    "hijos": hijos
-                }),
-                mimetype="application/json",
-                status_code=200
-            )
-        
-        return func.HttpResponse(
-            json.dumps({"error": message}),
-            mimetype="application/json",
-            status_code=401
-        )
-
-    except (ValueError, KeyError, TypeError) as e:
-        return func.HttpResponse(
-            json.dumps({"error": "Solicitud inválida: " + str(e)}),
-            mimetype="application/json",
-            status_code=400
-        )
+        with timing.span("validacion"):
+            rut, error = _leer_rut(req)
+        if error:
+            return error
+        resultado = hijos_versionados(rut, req.headers.get("If-None-Match"))
+        with timing.span("respuesta"):
+            return _respuesta_get(*resultado)
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+async def main_get_hijos_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_get_hijos."""
+    try:
+        with timing.span("validacion"):
+            rut, error = _leer_rut(req)
+        if error:
+            return error
+        resultado = await hijos_versionados_async(rut, req.headers.get("If-None-Match"))
+        with timing.span("respuesta"):
+            return _respuesta_get(*resultado)
     except Exception as e:
-        logging.error(f"Error no manejado: {str(e)}")
-        return func.HttpResponse(
-            json.dumps({"error": "Error interno del servidor"}),
-            mimetype="application/json",
-            status_code=500
-        )
+        return _respuesta_excepcion(e)
 
 def main_save_hijos(req: func.HttpRequest) -> func.HttpResponse:
     """Maneja la solicitud HTTP para guardar los hijos del usuario."""
     try:
-        req_body = req.get_json()
-        rut = req_body.get('rut')
-        hijos = req_body.get('hijos')
-
-        if not rut or not hijos:
-            return func.HttpResponse(
-                json.dumps({"error": "RUT y datos de hijos son requeridos"}),
-                mimetype="application/json",
-                status_code=400
-            )
-
-        success, message, _ = save_hijos(rut, hijos)
-
-        if success:
-            return func.HttpResponse(
-                json.dumps({
-                    "mensaje": message
-                }),
-                mimetype="application/json",
-                status_code=200
-            )
-        
-        return func.HttpResponse(
-            json.dumps({"error": message}),
-            mimetype="application/json",
-            status_code=401
-        )
-
-    except (ValueError, KeyError, TypeError) as e:
-        return func.HttpResponse(
-            json.dumps({"error": "Solicitud inválida: " + str(e)}),
-            mimetype="application/json",
-            status_code=400
-        )
+        with timing.span("validacion"):
+            datos, error = _leer_rut_e_hijos(req)
+        if error:
+            return error
+        resultado = save_hijos(*datos)
+        with timing.span("respuesta"):
+            return _respuesta_save(*resultado)
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+async def main_save_hijos_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_save_hijos."""
+    try:
+        with timing.span("validacion"):
+            datos, error = _leer_rut_e_hijos(req)
+        if error:
+            return error
+        resultado = await save_hijos_async(*datos)
+        with timing.span("respuesta"):
+            return _respuesta_save(*resultado)
     except Exception as e:
-        logging.error(f"Error no manejado: {str(e)}")
-        return func.HttpResponse(
-            json.dumps({"error": "Error interno del servidor"}),
-            mimetype="application/json",
-            status_code=500
-        )
\ No newline at end of file
+        return _respuesta_excepcion(e)
@@ -0,0 +1,335 @@
+# idempotencia.py
+#
+# Cabecera Idempotency-Key para los POST que escriben (registro y save_hijos, ver
+# function_app.py). El cliente genera una clave por operación y la repite en sus reintentos:
+#   - la primera solicitud con la clave se ejecuta y su respuesta se guarda por IdempotencyTtlSeconds
+#   - una repetición recibe la respuesta guardada (con Idempotent-Replayed: true), sin
+#     calcular scrypt ni tocar la base de datos
+#   - una repetición que llega mientras la original sigue en curso espera su resultado
+#     (hasta IdempotencyWaitSeconds; después, 409)
+#   - la misma clave con otro cuerpo es un error del cliente (422)
+# Las respuestas 5xx y 429 no se guardan: la falla fue transitoria y el reintento debe
+# ejecutarse de nuevo. Sin la cabecera la solicitud se procesa como siempre.
+#
+# La clave se asocia a la ruta y a la cabecera Authorization, así que un usuario no puede
+# recibir la respuesta guardada de otro.
+#
+# El almacén se elige con IdempotencyStore:
+#   memory  en memoria del proceso, con TTL y a lo más IdempotencyMaxEntries respuestas
+#   sqlite  archivo SQLite compartido por los procesos del host (sustituto local de un
+#           almacén compartido, como en rate_limit)
+
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import azure.functions as func
+
+import async_support
+import esquemas
+import timing
+
+# Configuración (variables de entorno opcionales)
+IDEMPOTENCY_STORE = os.environ.get("IdempotencyStore", "memory")        # memory | sqlite
+IDEMPOTENCY_STORE_PATH = os.environ.get("IdempotencyStorePath", "idempotencia.db")
+IDEMPOTENCY_TTL = float(os.environ.get("IdempotencyTtlSeconds", "86400"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IdempotencyMaxEntries", "10000"))
+# Espera máxima de una repetición por la solicitud original en curso
+IDEMPOTENCY_WAIT = float(os.environ.get("IdempotencyWaitSeconds", "30"))
+# Una reserva en curso más antigua que esto se da por abandonada (la instancia murió)
+IDEMPOTENCY_EN_CURSO = float(os.environ.get("IdempotencyInFlightSeconds", "120"))
+
+CABECERA = "Idempotency-Key"
+CLAVE_MAX = 255
+
+# Resultados de reservar()
+NUEVA = "nueva"
+REPETIDA = "repetida"
+EN_CURSO = "en_curso"
+CONFLICTO = "conflicto"
+
+
+def _guardable(status_code):
+    return status_code < 500 and status_code != 429
+
+
+def _serializar(resp):
+    headers = {k: v for k, v in resp.headers.items() if k.lower() not in ("content-type", "content-length")}
+    return json.dumps({"status": resp.status_code, "mimetype": resp.mimetype, "headers": headers,
+                       "body": base64.b64encode(resp.get_body()).decode("ascii")})
+
+
+def _deserializar(guardada):
+    datos = json.loads(guardada)
+    headers = {**datos["headers"], "Idempotent-Replayed": "true"}
+    return func.HttpResponse(base64.b64decode(datos["body"]), status_code=datos["status"],
+                             mimetype=datos["mimetype"], headers=headers)
+
+
+# --- Almacenes ---------------------------------------------------------------
+
+class MemoryIdempotencyStore:
+    """Respuestas en memoria con TTL. Las repeticiones esperan a la original con un Event."""
+
+    def __init__(self, max_entries=IDEMPOTENCY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()   # clave -> [huella, respuesta o None, expira, Event]
+        self.desalojos = 0
+
+    def reservar(self, clave, huella):
+        """Devuelve (NUEVA, None), (REPETIDA, respuesta), (EN_CURSO, None) o (CONFLICTO, None)."""
+        ahora = time.time()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[2] <= ahora:
+                entrada[3].set()
+                del self._entradas[clave]
+                entrada = None
+            if entrada is None:
+                self._entradas[clave] = [huella, None, ahora + IDEMPOTENCY_EN_CURSO, threading.Event()]
+                while len(self._entradas) > self.max_entries:
+                    _, desalojada = self._entradas.popitem(last=False)
+                    desalojada[3].set()
+                    self.desalojos += 1
+                return NUEVA, None
+            if entrada[0] != huella:
+                return CONFLICTO, None
+            if entrada[1] is None:
+                return EN_CURSO, None
+            return REPETIDA, entrada[1]
+
+    def completar(self, clave, respuesta, ttl):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return
+            entrada[1] = respuesta
+            entrada[2] = time.time() + ttl
+            self._entradas.move_to_end(clave)
+            entrada[3].set()
+
+    def liberar(self, clave):
+        """Descarta la reserva sin respuesta: una repetición que espera pasa a ejecutarse."""
+        with self._lock:
+            entrada = self._entradas.pop(clave, None)
+        if entrada is not None:
+            entrada[3].set()
+
+    def esperar(self, clave, timeout):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+        if entrada is not None:
+            entrada[3].wait(timeout)
+
+    def entradas(self):
+        with self._lock:
+            return len(self._entradas)
+
+
+class SqliteIdempotencyStore:
+    """Respuestas en un archivo SQLite compartido por los procesos del host. La reserva es una
+    transacción BEGIN IMMEDIATE, atómica entre procesos; la espera consulta cada `sondeo` s."""
+
+    def __init__(self, ruta=IDEMPOTENCY_STORE_PATH, max_entries=IDEMPOTENCY_MAX_ENTRIES, sondeo=0.05,
+                 limpiar_cada=1000):
+        self.ruta = ruta
+        self.max_entries = max_entries
+        self.sondeo = sondeo
+        self.limpiar_cada = limpiar_cada
+        self._local = threading.local()
+        self._operaciones = 0
+        self._conexion().execute("CREATE TABLE IF NOT EXISTS Respuestas ("
+                                 "Clave TEXT PRIMARY KEY, Huella TEXT NOT NULL, Respuesta TEXT, "
+                                 "Expira REAL NOT NULL)")
+        self._conexion().execute("CREATE INDEX IF NOT EXISTS IX_Respuestas_Expira ON Respuestas (Expira)")
+
+    def _conexion(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _limpiar(self, conn, ahora):
+        conn.execute("DELETE FROM Respuestas WHERE Expira <= ?", (ahora,))
+        conn.execute("DELETE FROM Respuestas WHERE Clave IN (SELECT Clave FROM Respuestas "
+                     "ORDER BY Expira DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def reservar(self, clave, huella):
+        ahora = time.time()
+        conn = self._conexion()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT Huella, Respuesta FROM Respuestas WHERE Clave = ? AND Expira > ?",
+                               (clave, ahora)).fetchone()
+            if row is None:
+                conn.execute("INSERT OR REPLACE INTO Respuestas (Clave, Huella, Respuesta, Expira) "
+                             "VALUES (?, ?, NULL, ?)", (clave, huella, ahora + IDEMPOTENCY_EN_CURSO))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            self._operaciones += 1
+            if self._operaciones % self.limpiar_cada == 0:
+                self._limpiar(conn, ahora)
+            return NUEVA, None
+        if row[0] != huella:
+            return CONFLICTO, None
+        if row[1] is None:
+            return EN_CURSO, None
+        return REPETIDA, row[1]
+
+    def completar(self, clave, respuesta, ttl):
+        self._conexion().execute("UPDATE Respuestas SET Respuesta = ?, Expira = ? WHERE Clave = ?",
+                                 (respuesta, time.time() + ttl, clave))
+
+    def liberar(self, clave):
+        self._conexion().execute("DELETE FROM Respuestas WHERE Clave = ? AND Respuesta IS NULL", (clave,))
+
+    def esperar(self, clave, timeout):
+        limite = time.monotonic() + timeout
+        conn = self._conexion()
+        while time.monotonic() < limite:
+            row = conn.execute("SELECT Respuesta FROM Respuestas WHERE Clave = ? AND Expira > ?",
+                               (clave, time.time())).fetchone()
+            if row is None or row[0] is not None:
+                return
+            time.sleep(self.sondeo)
+
+    def entradas(self):
+        return self._conexion().execute("SELECT COUNT(*) FROM Respuestas").fetchone()[0]
+
+
+# --- Servicio ----------------------------------------------------------------
+
+_store = None
+_store_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"ejecutadas": 0, "repetidas": 0, "esperas": 0, "conflictos": 0, "en_curso": 0}
+
+
+def configurar(store=None):
+    """Reemplaza el almacén compartido (por ejemplo, con otro archivo SQLite en pruebas locales)."""
+    global _store
+    with _store_lock:
+        if store is None:
+            store = SqliteIdempotencyStore() if IDEMPOTENCY_STORE == "sqlite" else MemoryIdempotencyStore()
+        _store = store
+        return _store
+
+
+def get_store():
+    if _store is None:
+        configurar()
+    return _store
+
+
+def _contar(evento):
+    with _stats_lock:
+        _stats[evento] += 1
+
+
+def _leer_clave(ruta, req):
+    """Devuelve ((clave, huella), None), (None, None) sin cabecera, o (None, respuesta de error)."""
+    valor = req.headers.get(CABECERA)
+    if valor is None:
+        return None, None
+    valor = valor.strip()
+    if not valor or len(valor) > CLAVE_MAX or not valor.isprintable():
+        return None, esquemas.error(f"{CABECERA} inválida", 400)
+    ambito = hashlib.sha256(f"{ruta}\n{valor}\n{req.headers.get('Authorization', '')}".encode("utf-8"))
+    huella = hashlib.sha256(req.get_body() or b"").hexdigest()
+    return (ambito.hexdigest(), huella), None
+
+
+def _respuesta_conflicto():
+    return esquemas.error(f"{CABECERA} reutilizada con otro cuerpo", 422)
+
+
+def _respuesta_en_curso():
+    return esquemas.error("Solicitud con la misma Idempotency-Key aún en curso", 409,
+                          headers={"Retry-After": "1"})
+
+
+def _resultado(estado, guardada):
+    """Respuesta para una solicitud que no se ejecuta."""
+    if estado == REPETIDA:
+        _contar("repetidas")
+        return _deserializar(guardada)
+    if estado == CONFLICTO:
+        _contar("conflictos")
+        return _respuesta_conflicto()
+    _contar("en_curso")
+    return _respuesta_en_curso()
+
+
+def _guardar(clave, resp):
+    store = get_store()
+    if resp is not None and _guardable(resp.status_code):
+        store.completar(clave, _serializar(resp), IDEMPOTENCY_TTL)
+    else:
+        store.liberar(clave)
+
+
+def _reservar(ruta, req):
+    """Reserva la clave de la solicitud, esperando a la original si está en curso. Devuelve
+    (clave, None) si esta solicitud debe ejecutarse (clave None: sin cabecera) o (None, respuesta)."""
+    with timing.span("idempotencia"):
+        clave, error = _leer_clave(ruta, req)
+        if error or clave is None:
+            return None, error
+        clave, huella = clave
+        store = get_store()
+        limite = time.monotonic() + IDEMPOTENCY_WAIT
+        while True:
+            estado, guardada = store.reservar(clave, huella)
+            if estado != EN_CURSO or time.monotonic() >= limite:
+                break
+            _contar("esperas")
+            store.esperar(clave, limite - time.monotonic())
+        if estado != NUEVA:
+            return None, _resultado(estado, guardada)
+        _contar("ejecutadas")
+        return clave, None
+
+
+def ejecutar(ruta, handler, req):
+    """Ejecuta `handler(req)` aplicando Idempotency-Key si la solicitud la trae."""
+    clave, resp = _reservar(ruta, req)
+    if resp is not None:
+        return resp
+    if clave is None:
+        return handler(req)
+    try:
+        resp = handler(req)
+    finally:
+        _guardar(clave, resp)
+    return resp
+
+
+async def ejecutar_async(ruta, handler, req):
+    """Variante async de ejecutar: la reserva (y la espera por la original) corre en el executor."""
+    clave, resp = await async_support.run_blocking(_reservar, ruta, req)
+    if resp is not None:
+        return resp
+    if clave is None:
+        return await handler(req)
+    try:
+        resp = await handler(req)
+    finally:
+        await async_support.run_blocking(_guardar, clave, resp)
+    return resp
+
+
+def stats():
+    with _stats_lock:
+        resultado = dict(_stats)
+    return {**resultado, "entradas": get_store().entradas()}
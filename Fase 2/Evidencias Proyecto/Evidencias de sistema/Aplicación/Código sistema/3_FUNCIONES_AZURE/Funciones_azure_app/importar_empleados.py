@@ -0,0 +1,283 @@
+# importar_empleados.py
+#
+# Carga masiva de Empleados desde CSV o XLSX (por ejemplo, al incorporar una obra nueva). El
+# archivo se lee en bloques de ImportBatchSize filas sin cargarlo completo; cada bloque se
+# valida en una pasada (RUT y dígito verificador, email, edad, largos) y las filas válidas se
+# insertan o actualizan con ImportarEmpleado usando fast_executemany, en una transacción por
+# bloque. Las filas rechazadas van a <origen>.rechazos.csv con su número de fila y el motivo.
+#
+# Tras cada bloque confirmado se guarda <origen>.checkpoint.json; si la carga se interrumpe,
+# volver a ejecutarla continúa desde el último bloque confirmado (el upsert hace que repetir un
+# bloque no tenga efecto). Al terminar el checkpoint se elimina.
+#
+# Uso (desde Funciones_azure_app, con SqlConnectionString en el entorno):
+#   python importar_empleados.py obra_iquique.csv
+#   python importar_empleados.py obra_iquique.xlsx --lote 2000
+#   python importar_empleados.py obra_iquique.csv --desde-cero     # ignora el checkpoint
+
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import pyodbc
+import db_pool
+import esquemas
+import retry
+import timing
+
+try:
+    import openpyxl
+except ImportError:  # openpyxl es opcional: solo se necesita para importar XLSX
+    openpyxl = None
+
+IMPORT_BATCH_SIZE = int(os.environ.get("ImportBatchSize", "1000"))
+IMPORT_FAST_EXECUTEMANY = os.environ.get("ImportFastExecutemany", "1") == "1"
+IMPORT_EDAD_MIN = int(os.environ.get("ImportEdadMinima", "15"))
+IMPORT_EDAD_MAX = int(os.environ.get("ImportEdadMaxima", "100"))
+
+# Columnas de Empleados, en el orden de los parámetros de ImportarEmpleado
+COLUMNAS = ("NombreCompleto", "RUTUsuario", "DV", "Email", "Edad", "Sexo", "Ciudad", "Nacionalidad")
+_LARGOS = {"NombreCompleto": 150, "Email": 150, "Ciudad": 30, "Nacionalidad": 30}
+
+# RUT con o sin puntos, con o sin dígito verificador: 12.345.678-5, 12345678-5, 12345678
+_RE_RUT_IMPORTACION = re.compile(r'^(\d{1,8})(?:-([0-9K]))?$')
+
+
+class ErrorImportacion(Exception):
+    """El archivo no se puede importar (formato o encabezado)."""
+
+
+# --- Lectura del origen --------------------------------------------------------
+
+def _filas_csv(ruta):
+    with open(ruta, newline="", encoding="utf-8-sig") as f:
+        # Excel en configuración regional de Chile exporta con punto y coma
+        try:
+            dialecto = csv.Sniffer().sniff(f.read(64 * 1024), delimiters=",;\t")
+        except csv.Error:
+            dialecto = csv.excel
+        f.seek(0)
+        yield from csv.reader(f, dialecto)
+
+
+def _celda(valor):
+    if valor is None:
+        return ""
+    if isinstance(valor, float) and valor.is_integer():
+        # Las celdas numéricas de Excel llegan como float (12345678.0)
+        valor = int(valor)
+    return str(valor)
+
+
+def _filas_xlsx(ruta):
+    if openpyxl is None:
+        raise ErrorImportacion("Para importar XLSX instale openpyxl")
+    # read_only recorre la hoja sin cargarla completa en memoria
+    libro = openpyxl.load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        for fila in libro.active.iter_rows(values_only=True):
+            yield [_celda(v) for v in fila]
+    finally:
+        libro.close()
+
+
+def leer_filas(ruta):
+    """Filas del archivo como listas de strings, incluido el encabezado."""
+    if ruta.lower().endswith((".xlsx", ".xlsm")):
+        return _filas_xlsx(ruta)
+    return _filas_csv(ruta)
+
+
+def _indices(encabezado):
+    """Posición de cada columna de Empleados en el archivo (sin distinguir mayúsculas)."""
+    posiciones = {nombre.strip().lower(): i for i, nombre in enumerate(encabezado)}
+    indices = {columna: posiciones.get(columna.lower()) for columna in COLUMNAS}
+    faltantes = [c for c in ("NombreCompleto", "RUTUsuario") if indices[c] is None]
+    if faltantes:
+        raise ErrorImportacion(f"Faltan columnas obligatorias: {', '.join(faltantes)}")
+    return indices
+
+
+def _bloques(filas, tamano):
+    bloque = []
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) >= tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+# --- Validación ------------------------------------------------------------------
+
+def _validar_fila(valores):
+    """Normaliza una fila ya repartida por columna. Devuelve (tupla para ImportarEmpleado, None)
+    o (None, motivo del rechazo)."""
+    nombre = valores["NombreCompleto"]
+    if not nombre:
+        return None, "NombreCompleto vacío"
+
+    m = _RE_RUT_IMPORTACION.match(valores["RUTUsuario"].replace(".", "").upper())
+    if m is None:
+        return None, "Formato de RUT inválido"
+    numero = str(int(m.group(1)))
+    dv = (valores["DV"] or m.group(2) or "").upper()
+    if not dv:
+        return None, "Falta el dígito verificador"
+    if m.group(2) and m.group(2) != dv:
+        return None, "El DV no coincide con el del RUT"
+    if esquemas.digito_verificador(numero) != dv:
+        return None, "Dígito verificador incorrecto"
+
+    email = valores["Email"] or None
+    if email is not None and not esquemas.RE_EMAIL.match(email):
+        return None, "Formato de email inválido"
+
+    edad = valores["Edad"] or None
+    if edad is not None:
+        if not edad.isdigit() or not IMPORT_EDAD_MIN <= int(edad) <= IMPORT_EDAD_MAX:
+            return None, f"Edad fuera de rango ({IMPORT_EDAD_MIN}-{IMPORT_EDAD_MAX})"
+        edad = int(edad)
+
+    sexo = (valores["Sexo"] or "").upper() or None
+    if sexo is not None and sexo not in ("M", "F"):
+        return None, "Sexo debe ser M o F"
+
+    for columna, largo in _LARGOS.items():
+        if valores[columna] and len(valores[columna]) > largo:
+            return None, f"{columna} excede {largo} caracteres"
+
+    # El DV se guarda como en el resto de la tabla: 'k' en minúscula
+    return (nombre, numero, dv.lower(), email, edad, sexo,
+            valores["Ciudad"] or None, valores["Nacionalidad"] or None), None
+
+
+def validar_bloque(filas, indices, primera_fila):
+    """Valida un bloque en una pasada. `primera_fila` es el número de fila (1 = primera fila de
+    datos) de filas[0]. Devuelve (filas válidas, [(fila, RUT, motivo)])."""
+    validas, rechazos = [], []
+    for numero, fila in enumerate(filas, primera_fila):
+        valores = {columna: fila[i].strip() if i is not None and i < len(fila) else ""
+                   for columna, i in indices.items()}
+        normalizada, motivo = _validar_fila(valores)
+        if motivo:
+            rechazos.append((numero, valores["RUTUsuario"], motivo))
+        else:
+            validas.append(normalizada)
+    return validas, rechazos
+
+
+# --- Carga -------------------------------------------------------------------------
+
+def _upsert(filas):
+    """Un intento de carga del bloque, en una transacción."""
+    with db_pool.connection() as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            cursor.fast_executemany = IMPORT_FAST_EXECUTEMANY
+            cursor.executemany("{CALL ImportarEmpleado(?, ?, ?, ?, ?, ?, ?, ?)}", filas)
+            conn.commit()
+
+
+def _leer_checkpoint(ruta, origen):
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    estado = os.stat(origen)
+    if checkpoint.get("tamano") != estado.st_size or checkpoint.get("modificado") != estado.st_mtime:
+        logging.warning(f"El archivo {origen} cambió desde el checkpoint; se importa desde el inicio")
+        return None
+    return checkpoint
+
+
+def _guardar_checkpoint(ruta, checkpoint):
+    """Escritura atómica: un corte a mitad de camino deja el checkpoint anterior intacto."""
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, ruta)
+
+
+def importar(origen, lote=None, reanudar=True, rechazos=None, checkpoint=None, max_retries=3, delay=None):
+    """Importa el archivo a Empleados. Devuelve un resumen con las filas leídas, importadas y
+    rechazadas. Ante un error de base de datos (tras los reintentos) relanza la excepción: el
+    checkpoint queda en el último bloque confirmado y la próxima ejecución continúa desde ahí."""
+    lote = lote or IMPORT_BATCH_SIZE
+    rechazos = rechazos or origen + ".rechazos.csv"
+    checkpoint = checkpoint or origen + ".checkpoint.json"
+    estado = os.stat(origen)
+
+    previo = _leer_checkpoint(checkpoint, origen) if reanudar else None
+    resumen = {"filas": 0, "importadas": 0, "rechazadas": 0, "rechazos_bytes": 0}
+    if previo:
+        resumen.update({clave: previo[clave] for clave in resumen})
+        logging.info(f"Reanudando {origen} desde la fila {resumen['filas'] + 1}")
+
+    filas = iter(leer_filas(origen))
+    encabezado = next(filas, None)
+    if encabezado is None:
+        raise ErrorImportacion("El archivo está vacío")
+    indices = _indices(encabezado)
+
+    with open(rechazos, "a+", newline="", encoding="utf-8") as salida_rechazos:
+        # Descartar rechazos escritos después del último checkpoint (bloque no confirmado)
+        salida_rechazos.truncate(resumen["rechazos_bytes"])
+        salida_rechazos.seek(resumen["rechazos_bytes"])
+        escritor = csv.writer(salida_rechazos, lineterminator="\n")
+        if not resumen["rechazos_bytes"]:
+            escritor.writerow(("Fila", "RUTUsuario", "Motivo"))
+
+        # Saltar las filas ya confirmadas
+        for _ in range(resumen["filas"]):
+            next(filas, None)
+
+        for bloque in _bloques(filas, lote):
+            validas, rechazadas = validar_bloque(bloque, indices, resumen["filas"] + 1)
+            if validas:
+                retry.call_with_retries(_upsert, (validas,), max_retries, delay)
+            escritor.writerows(rechazadas)
+            salida_rechazos.flush()
+
+            resumen["filas"] += len(bloque)
+            resumen["importadas"] += len(validas)
+            resumen["rechazadas"] += len(rechazadas)
+            resumen["rechazos_bytes"] = salida_rechazos.tell()
+            _guardar_checkpoint(checkpoint, {**resumen, "tamano": estado.st_size,
+                                             "modificado": estado.st_mtime})
+            logging.info(f"Importación de {origen}: {resumen['filas']} filas procesadas")
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    del resumen["rechazos_bytes"]
+    return {**resumen, "archivo_rechazos": rechazos}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa Empleados desde CSV o XLSX (requiere SqlConnectionString)")
+    parser.add_argument("origen", help="archivo .csv o .xlsx con encabezado")
+    parser.add_argument("--lote", type=int, default=IMPORT_BATCH_SIZE, help="filas por transacción")
+    parser.add_argument("--desde-cero", action="store_true", help="ignorar el checkpoint de una carga anterior")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    try:
+        resumen = importar(args.origen, args.lote, reanudar=not args.desde_cero)
+    except ErrorImportacion as e:
+        sys.exit(f"No se puede importar: {e}")
+    except pyodbc.Error as e:
+        sys.exit(f"Error de base de datos: {e}. Vuelva a ejecutar para continuar desde el último bloque.")
+    finally:
+        db_pool.get_pool().close()
+    print(json.dumps(resumen, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,34 +2,23 @@
 
 import azure.functions as func
 import logging
-import json
-import re
 import pyodbc
-import os
 import time
-import scrypt
-import base64
 import jwt
+import async_support
+import auth
+import circuit_breaker
+import contrasenas
+import db_pool
+import esquemas
+import hash_pool
+import rate_limit
+import retry
+import timing
 
 # Configuración
-conn_str = os.environ["SqlConnectionString"]
-JWT_SECRET = os.environ.get("JWT_SECRET", "fe85ac5165c700310f9cb9e33e748d8802129676b6c66543cf344cd4d4f501ff")
-
-# Validaciones
-def validate_email(email):
-    return re.match(r'^[\w\.-]+@[\w\.-]+\.\w+$', email) is not None
-
-def validate_rut(rut):
-    return re.match(r'^\d{1,8}-[0-9kK]$', rut) is not None
-
-def validate_password(password):
-    return re.match(r'^(?=.*[a-zA-ZñÑ])(?=.*[A-ZÑ])(?=.*\d)[a-zA-ZñÑ\d]{8,}$', password) is not None
-
-def sanitize_input(input_string):
-    return re.sub(r"[;'\"*?=&]", "", input_string.replace(" ", ""))
-
-def clean_rut(rut):
-    return rut.split('-')[0]
+# El secreto se comparte con auth.py, que verifica los tokens en las rutas de datos
+JWT_SECRET = auth.JWT_SECRET
 
 def generate_token(user_id):
     payload = {
@@ -39,111 +28,170 @@ def generate_token(user_id):
     }
     return jwt.encode(payload, JWT_SECRET, algorithm='HS256')
 
-def login_usuario(identifier, password, max_retries=3, delay=1):
+def _buscar_usuario(identifier):
+    """Un intento de LoginUsuario. Devuelve la fila del usuario o None."""
+    with db_pool.connection() as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            cursor.execute("{CALL LoginUsuario(?)}", (identifier,))
+            return cursor.fetchone()
+
+def _resultado_login(row, coincide):
+    if coincide:
+        user_id = str(row.RUTUsuario) if hasattr(row, 'RUTUsuario') else "1"
+        return True, "Login exitoso", user_id
+    return False, "Contraseña incorrecta", None
+
+# LoginUsuario: Origen 0 es UsuarioSocio, 1 es UsuarioColaborador
+ORIGEN_SOCIO = 0
+
+def _requiere_rehash(row, rehash):
+    """Solo se actualiza el hash de los colaboradores: ActualizarContrasena no escribe en
+    UsuarioSocio (antes de la migración 6 su columna no admitía el formato actual). Sin la
+    columna Origen (LoginUsuario anterior) la fila se trata como de colaborador."""
+    return rehash and getattr(row, 'Origen', None) != ORIGEN_SOCIO
+
+def _actualizar_hash(rut, anterior, nuevo):
+    """Un intento de ActualizarContrasena: reemplaza el hash solo si no cambió desde el login."""
+    with db_pool.connection() as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            cursor.execute("{CALL ActualizarContrasena(?, ?, ?)}", (rut, anterior, nuevo))
+            row = cursor.fetchone()
+            conn.commit()
+    if row is not None and not row.Actualizadas:
+        # La contraseña cambió desde que se verificó, o la fila no está en UsuarioColaborador
+        logging.warning(f"ActualizarContrasena no actualizó el hash de {rut}")
+
+def _rehash(row, password):
+    """Vuelve a guardar la contraseña con los parámetros actuales. Es de mejor esfuerzo: si falla,
+    el login igual es exitoso y se reintenta en el próximo."""
+    try:
+        nuevo = contrasenas.hashear(password)
+        _actualizar_hash(str(row.RUTUsuario), row.Contraseña, nuevo)
+    except (pyodbc.Error, circuit_breaker.CircuitoAbierto, *hash_pool.NO_DISPONIBLE) as e:
+        logging.warning(f"No se pudo actualizar el hash de {row.RUTUsuario}: {str(e)}")
+
+async def _rehash_async(row, password):
+    try:
+        nuevo = await contrasenas.hashear_async(password)
+        await async_support.run_blocking(_actualizar_hash, str(row.RUTUsuario), row.Contraseña, nuevo)
+    except (pyodbc.Error, circuit_breaker.CircuitoAbierto, *hash_pool.NO_DISPONIBLE) as e:
+        logging.warning(f"No se pudo actualizar el hash de {row.RUTUsuario}: {str(e)}")
+
+def _resultado_registrado(identifier, resultado):
+    """Informa el resultado al limitador: los fallos acercan el identificador al bloqueo."""
+    rate_limit.registrar_login(identifier, resultado[0])
+    return resultado
+
+def login_usuario(identifier, password, max_retries=3, delay=None):
     """Realiza el login del usuario llamando al procedimiento almacenado con reintentos."""
-    attempts = 0
-    conn = None
-    
     try:
-        while attempts < max_retries:
-            try:
-                conn = pyodbc.connect(conn_str)
-                cursor = conn.cursor()
-                cursor.execute("{CALL LoginUsuario(?)}", (identifier,))
-                row = cursor.fetchone()
-
-                if not row or not hasattr(row, 'Contraseña'):
-                    return False, "Usuario no encontrado", None
-
-                stored_password_bytes = base64.b64decode(row.Contraseña)
-                salt = stored_password_bytes[:8]
-                stored_hash = stored_password_bytes[8:]
-                
-                calculated_hash = scrypt.hash(
-                    password.encode('utf-8'),
-                    salt,
-                    N=16384,
-                    r=8,
-                    p=1,
-                    buflen=24
-                )
-                
-                if calculated_hash == stored_hash:
-                    user_id = str(row.RUTUsuario) if hasattr(row, 'RUTUsuario') else "1"
-                    return True, "Login exitoso", user_id
-                return False, "Contraseña incorrecta", None
-
-            except pyodbc.Error as e:
-                attempts += 1
-                if attempts == max_retries:
-                    return False, f"Error de base de datos: {str(e)}", None
-                time.sleep(delay)
-                
-    finally:
-        if conn:
-            conn.close()
+        row = retry.call_with_retries(_buscar_usuario, (identifier,), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}", None
+
+    # La conexión ya volvió al pool: el hash no la retiene
+    if not row or not hasattr(row, 'Contraseña'):
+        return _resultado_registrado(identifier, (False, "Usuario no encontrado", None))
+
+    # scrypt corre en el pool de procesos con los parámetros guardados en el hash;
+    # las fallas del pool (hash_pool.NO_DISPONIBLE) se propagan como 503
+    coincide, rehash = contrasenas.verificar(password, row.Contraseña)
+    if _requiere_rehash(row, rehash):
+        _rehash(row, password)
+    return _resultado_registrado(identifier, _resultado_login(row, coincide))
+
+async def login_usuario_async(identifier, password, max_retries=3, delay=None):
+    """Variante async de login_usuario: consulta en el executor y hash en el pool de procesos."""
+    try:
+        row = await retry.call_with_retries_async(_buscar_usuario, (identifier,), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}", None
+
+    if not row or not hasattr(row, 'Contraseña'):
+        return _resultado_registrado(identifier, (False, "Usuario no encontrado", None))
+
+    coincide, rehash = await contrasenas.verificar_async(password, row.Contraseña)
+    if _requiere_rehash(row, rehash):
+        await _rehash_async(row, password)
+    return _resultado_registrado(identifier, _resultado_login(row, coincide))
+
+def _leer_credenciales(req):
+    """Extrae y valida las credenciales. Devuelve ((identifier, password), None) o (None, respuesta de error)."""
+    datos, error = esquemas.LOGIN.leer(req)
+    if error:
+        return None, error
+    return (datos['identifier'], datos['password']), None
+
+def _respuesta(success, message, user_id):
+    if success:
+        with timing.span("jwt"):
+            token = generate_token(user_id)
+        return esquemas.respuesta({
+            "mensaje": message,
+            "token": token,
+            "user_id": user_id
+        })
+    if message.startswith("Error de base de datos"):
+        # La base no respondió tras los reintentos: no son credenciales inválidas
+        return esquemas.no_disponible(message)
+    return esquemas.error(message, 401)
+
+def _respuesta_limitada(espera):
+    return esquemas.error("Demasiados intentos, intente nuevamente más tarde", 429,
+                          headers={"Retry-After": rate_limit.retry_after(espera)})
+
+def _limitar(req, identifier):
+    """Aplica el rate limit antes de tocar la base de datos o scrypt. Devuelve la respuesta 429 o None."""
+    with timing.span("rate_limit"):
+        rechazo = rate_limit.verificar_login(identifier, rate_limit.direccion_cliente(req))
+    if rechazo is None:
+        return None
+    motivo, espera = rechazo
+    logging.warning(f"Login rechazado por rate limit ({motivo}) para {identifier}")
+    return _respuesta_limitada(espera)
+
+def _respuesta_excepcion(e):
+    if isinstance(e, hash_pool.NO_DISPONIBLE):
+        if not isinstance(e, hash_pool.HashPoolFull):
+            logging.error(f"Falla del pool de hashing: {type(e).__name__}: {str(e)}")
+        return esquemas.no_disponible("Servicio ocupado, intente nuevamente")
+    if isinstance(e, circuit_breaker.CircuitoAbierto):
+        return esquemas.no_disponible(esquemas.BASE_NO_DISPONIBLE, e.reintentar_en)
+    if isinstance(e, ValueError):
+        return esquemas.error(esquemas.CUERPO_INVALIDO, 400)
+    logging.error(f"Error no manejado: {str(e)}")
+    return esquemas.error("Error interno del servidor", 500)
 
 def main_login(req: func.HttpRequest) -> func.HttpResponse:
     """Maneja la solicitud HTTP para el login de usuario."""
     try:
-        req_body = req.get_json()
-        identifier = req_body.get('identifier')
-        password = req_body.get('password')
-
-        if not identifier or not password:
-            return func.HttpResponse(
-                json.dumps({"error": "Identificador y contraseña son requeridos"}),
-                mimetype="application/json",
-                status_code=400
-            )
-
-        identifier = sanitize_input(identifier)
-        password = sanitize_input(password)
-
-        if not (validate_email(identifier) or (validate_rut(identifier) and (identifier := clean_rut(identifier)))):
-            return func.HttpResponse(
-                json.dumps({"error": "Formato de identificador inválido"}),
-                mimetype="application/json",
-                status_code=400
-            )
-
-        if not validate_password(password):
-            return func.HttpResponse(
-                json.dumps({"error": "Formato de contraseña inválido"}),
-                mimetype="application/json",
-                status_code=400
-            )
-
-        success, message, user_id = login_usuario(identifier, password)
-
-        if success:
-            token = generate_token(user_id)
-            return func.HttpResponse(
-                json.dumps({
-                    "mensaje": message,
-                    "token": token,
-                    "user_id": user_id
-                }),
-                mimetype="application/json",
-                status_code=200
-            )
-        
-        return func.HttpResponse(
-            json.dumps({"error": message}),
-            mimetype="application/json",
-            status_code=401
-        )
-
-    except ValueError:
-        return func.HttpResponse(
-            json.dumps({"error": "Cuerpo de solicitud inválido"}),
-            mimetype="application/json",
-            status_code=400
-        )
+        with timing.span("validacion"):
+            credenciales, error = _leer_credenciales(req)
+        if error:
+            return error
+        limitada = _limitar(req, credenciales[0])
+        if limitada:
+            return limitada
+        resultado = login_usuario(*credenciales)
+        with timing.span("respuesta"):
+            return _respuesta(*resultado)
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+async def main_login_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_login."""
+    try:
+        with timing.span("validacion"):
+            credenciales, error = _leer_credenciales(req)
+        if error:
+            return error
+        limitada = _limitar(req, credenciales[0])
+        if limitada:
+            return limitada
+        resultado = await login_usuario_async(*credenciales)
+        with timing.span("respuesta"):
+            return _respuesta(*resultado)
     except Exception as e:
-        logging.error(f"Error no manejado: {str(e)}")
-        return func.HttpResponse(
-            json.dumps({"error": "Error interno del servidor"}),
-            mimetype="application/json",
-            status_code=500
-        )
\ No newline at end of file
+        return _respuesta_excepcion(e)
@@ -2,184 +2,428 @@
 
 import azure.functions as func
 import logging
-import json
-import re
 import pyodbc
-import os
-import time
-import random
-from azure.communication.sms import SmsClient
+import circuit_breaker
+import codigos_reset
+import contrasenas
+import db_pool
+import esquemas
+import hash_pool
+import retry
+import async_support
+import sms_outbox
+import timing
 
-# Configuración
-conn_str = os.environ["SqlConnectionString"]
-#Reemplaza "tu_connection_string_de_communication_services" con el connection string real de Azure Communication Services
-COMMUNICATION_CONNECTION_STRING = os.environ.get("CommunicationServicesConnectionString", "tu_connection_string_de_communication_services")
-#Reemplaza "+tu_numero_de_sender" con el número de teléfono real que obtuviste de Azure Communication Services
-SMS_FROM_NUMBER = os.environ.get("SmsFromNumber", "+tu_numero_de_sender")
+def generate_code():
+    """Genera un código de 6 dígitos."""
+    return codigos_reset.generar()
 
-def validate_email(email):
-    return re.match(r'^[\w\.-]+@[\w\.-]+\.\w+$', email) is not None
+def _buscar_usuario(identifier):
+    """Un intento de BuscarUsuarioReset (en la réplica, si hay). Devuelve ((rut, teléfono), mensaje)
+    o (None, mensaje)."""
+    with db_pool.lectura("telefono", identifier) as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            cursor.execute("{CALL BuscarUsuarioReset(?)}", (identifier,))
+            row = cursor.fetchone()
 
-def validate_rut(rut):
-    return re.match(r'^\d{1,8}-[0-9kK]$', rut) is not None
+        if not row:
+            return None, "Usuario no encontrado"
 
-def sanitize_input(input_string):
-    return re.sub(r"[;'\"*?=&]", "", input_string.replace(" ", ""))
+        phone = getattr(row, 'NumeroTelefono', None)
+        if not phone:
+            return None, "Usuario no tiene teléfono registrado"
 
-def clean_rut(rut):
-    return rut.split('-')[0]
+        return (str(row.RUTUsuario), phone), "Teléfono encontrado"
 
-def generate_code():
-    """Genera un código de 6 dígitos."""
-    return str(random.randint(100000, 999999))
+def buscar_usuario(identifier, max_retries=3, delay=None):
+    """Obtiene el RUT de la cuenta (el identificador puede ser un email) y su teléfono."""
+    try:
+        return retry.call_with_retries(_buscar_usuario, (identifier,), max_retries, delay)
+    except pyodbc.Error as e:
+        return None, f"Error de base de datos: {str(e)}"
+
+async def buscar_usuario_async(identifier, max_retries=3, delay=None):
+    """Variante async de buscar_usuario."""
+    try:
+        return await retry.call_with_retries_async(_buscar_usuario, (identifier,), max_retries, delay)
+    except pyodbc.Error as e:
+        return None, f"Error de base de datos: {str(e)}"
+
+def get_user_phone(identifier, max_retries=3, delay=None):
+    """Obtiene el número de teléfono del usuario. Se conserva para los llamadores existentes;
+    buscar_usuario devuelve además el RUT de la cuenta."""
+    usuario, message = buscar_usuario(identifier, max_retries, delay)
+    return (usuario[1] if usuario else None), message
+
+async def get_user_phone_async(identifier, max_retries=3, delay=None):
+    """Variante async de get_user_phone."""
+    usuario, message = await buscar_usuario_async(identifier, max_retries, delay)
+    return (usuario[1] if usuario else None), message
+
+def _guardar_codigo(rut, code):
+    """Un intento de guardar el código en el almacén de codigos_reset."""
+    codigos_reset.guardar(rut, code)
+    return True, "Código guardado exitosamente"
 
-def get_user_phone(identifier, max_retries=3, delay=1):
-    """Obtiene el número de teléfono del usuario."""
-    attempts = 0
-    conn = None
-    
+def save_reset_code(rut, code, phone=None, max_retries=3, delay=None):
+    """Guarda el código de recuperación del RUT; el código anterior deja de ser válido. El código
+    se verifica por el RUT de la cuenta, no por el email (ver buscar_usuario). `phone` ya no se usa:
+    se conserva para no correr los argumentos de los llamadores existentes."""
     try:
-        while attempts < max_retries:
-            try:
-                conn = pyodbc.connect(conn_str)
-                cursor = conn.cursor()
-                cursor.execute("{CALL GetUserPhone(?)}", (identifier,))
-                row = cursor.fetchone()
-
-                if not row:
-                    return None, "Usuario no encontrado"
-
-                phone = row.Telefono if hasattr(row, 'Telefono') else None
-                if not phone:
-                    return None, "Usuario no tiene teléfono registrado"
-
-                return phone, "Teléfono encontrado"
-
-            except pyodbc.Error as e:
-                attempts += 1
-                if attempts == max_retries:
-                    return None, f"Error de base de datos: {str(e)}"
-                time.sleep(delay)
-    finally:
-        if conn:
-            conn.close()
-
-def save_reset_code(identifier, code, phone, max_retries=3, delay=1):
-    """Guarda el código de recuperación en la base de datos."""
-    attempts = 0
-    conn = None
-    
+        return retry.call_with_retries(_guardar_codigo, (rut, code), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error al guardar código: {str(e)}"
+
+async def save_reset_code_async(rut, code, phone=None, max_retries=3, delay=None):
+    """Variante async de save_reset_code."""
     try:
-        while attempts < max_retries:
-            try:
-                conn = pyodbc.connect(conn_str)
-                cursor = conn.cursor()
-                expiration = time.time() + (15 * 60)  # 15 minutos de validez
-                
-                cursor.execute(
-                    "{CALL SaveResetCode (?, ?, ?, ?)}",
-                    (identifier, code, phone, expiration)
-                )
-                conn.commit()
-                return True, "Código guardado exitosamente"
-
-            except pyodbc.Error as e:
-                attempts += 1
-                if attempts == max_retries:
-                    return False, f"Error al guardar código: {str(e)}"
-                time.sleep(delay)
-    finally:
-        if conn:
-            conn.close()
+        return await retry.call_with_retries_async(_guardar_codigo, (rut, code), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error al guardar código: {str(e)}"
 
 def send_sms(phone_number, code):
-    """Envía el SMS usando Azure Communication Services."""
+    """Encola el SMS en el outbox; el despachador lo envía en segundo plano reutilizando un cliente."""
+    return sms_outbox.encolar_codigo(phone_number, code)
+
+async def send_sms_async(phone_number, code):
+    """Variante async de send_sms: encolar toca la base de datos, así que corre en el executor."""
+    return await async_support.run_blocking(send_sms, phone_number, code)
+
+def reservar_sms(phone_number, code):
+    """Reserva el SMS (y el throttle del teléfono) sin enviarlo. Devuelve (reserva, message),
+    con reserva None si el throttle lo rechaza."""
+    return sms_outbox.reservar_codigo(phone_number, code)
+
+def liberar_sms(reserva, max_retries=3, delay=None):
+    """Deja salir el SMS reservado, una vez guardado el código."""
     try:
-        sms_client = SmsClient.from_connection_string(COMMUNICATION_CONNECTION_STRING)
-        response = sms_client.send(
-            from_=SMS_FROM_NUMBER,
-            to=phone_number,
-            message=f"Tu código de recuperación de contraseña es: {code}"
-        )
-        return True, "SMS enviado exitosamente"
-    except Exception as e:
-        logging.error(f"Error enviando SMS: {str(e)}")
-        return False, f"Error al enviar SMS: {str(e)}"
+        retry.call_with_retries(sms_outbox.liberar, (reserva,), max_retries, delay)
+        return True, "SMS encolado"
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}"
+
+def cancelar_sms(reserva):
+    """Descarta el SMS reservado cuando el código no se guardó. Es de mejor esfuerzo: si falla,
+    el SMS queda retenido (no sale) y el throttle se libera al cumplirse la ventana."""
+    try:
+        sms_outbox.cancelar(reserva)
+    except (pyodbc.Error, circuit_breaker.CircuitoAbierto) as e:
+        logging.warning(f"No se pudo cancelar el SMS {reserva}: {str(e)}")
+
+async def reservar_sms_async(phone_number, code):
+    return await async_support.run_blocking(reservar_sms, phone_number, code)
+
+async def liberar_sms_async(reserva, max_retries=3, delay=None):
+    try:
+        await retry.call_with_retries_async(sms_outbox.liberar, (reserva,), max_retries, delay)
+        return True, "SMS encolado"
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}"
+
+async def cancelar_sms_async(reserva):
+    await async_support.run_blocking(cancelar_sms, reserva)
+
+def _leer_identificador(req):
+    """Extrae y valida el identificador. Devuelve (identifier, None) o (None, respuesta de error)."""
+    datos, error = esquemas.PASSWORD_RETRY.leer(req)
+    if error:
+        return None, error
+    return datos['identifier'], None
+
+def _respuesta_error(message, status_code):
+    return esquemas.error(message, status_code)
+
+def _respuesta_sin_usuario(message):
+    if message.startswith("Error de base de datos"):
+        return esquemas.no_disponible(message)
+    return _respuesta_error(message, 404)
+
+def _respuesta_enviado(phone):
+    # Enmascarar el número de teléfono
+    masked_phone = f"****{phone[-4:]}"
+
+    return esquemas.respuesta({
+        "mensaje": "Código enviado exitosamente",
+        "phone": masked_phone
+    })
+
+def _respuesta_excepcion(e):
+    if isinstance(e, hash_pool.NO_DISPONIBLE):
+        if not isinstance(e, hash_pool.HashPoolFull):
+            logging.error(f"Falla del pool de hashing: {type(e).__name__}: {str(e)}")
+        return esquemas.no_disponible("Servicio ocupado, intente nuevamente")
+    if isinstance(e, circuit_breaker.CircuitoAbierto):
+        return esquemas.no_disponible(esquemas.BASE_NO_DISPONIBLE, e.reintentar_en)
+    if isinstance(e, ValueError):
+        return _respuesta_error(esquemas.CUERPO_INVALIDO, 400)
+    logging.error(f"Error no manejado: {str(e)}")
+    return _respuesta_error("Error interno del servidor", 500)
 
 def main_password_retry(req: func.HttpRequest) -> func.HttpResponse:
     """Maneja la solicitud HTTP para la recuperación de contraseña."""
     try:
-        req_body = req.get_json()
-        identifier = req_body.get('identifier')
-
-        if not identifier:
-            return func.HttpResponse(
-                json.dumps({"error": "Identificador es requerido"}),
-                mimetype="application/json",
-                status_code=400
-            )
-
-        identifier = sanitize_input(identifier)
-
-        if not (validate_email(identifier) or (validate_rut(identifier) and (identifier := clean_rut(identifier)))):
-            return func.HttpResponse(
-                json.dumps({"error": "Formato de identificador inválido"}),
-                mimetype="application/json",
-                status_code=400
-            )
-
-        # Obtener teléfono del usuario
-        phone, message = get_user_phone(identifier)
-        if not phone:
-            return func.HttpResponse(
-                json.dumps({"error": message}),
-                mimetype="application/json",
-                status_code=404
-            )
+        with timing.span("validacion"):
+            identifier, error = _leer_identificador(req)
+        if error:
+            return error
+
+        # Obtener RUT y teléfono del usuario
+        usuario, message = buscar_usuario(identifier)
+        if not usuario:
+            return _respuesta_sin_usuario(message)
+        rut, phone = usuario
 
         # Generar código
         code = generate_code()
 
-        # Guardar código en la base de datos
-        success, db_message = save_reset_code(identifier, code, phone)
+        # Reservar el SMS antes de guardar el código: guardarlo reemplaza el anterior, y si el
+        # throttle rechaza el SMS el usuario se quedaría sin un código válido. La reserva no se
+        # envía hasta liberarla, para no mandar un código que no se guardó
+        with timing.span("sms_encolar"):
+            reserva, sms_message = reservar_sms(phone, code)
+        if reserva is None:
+            return _respuesta_error(sms_message, 429)
+
+        # Guardar código (por RUT, aunque la solicitud venga con el email)
+        success, db_message = save_reset_code(rut, code)
         if not success:
-            return func.HttpResponse(
-                json.dumps({"error": db_message}),
-                mimetype="application/json",
-                status_code=500
-            )
-
-        # Enviar SMS
-        sms_success, sms_message = send_sms(phone, code)
+            cancelar_sms(reserva)
+            return esquemas.no_disponible(db_message)
+
+        # Encolar SMS (el envío ocurre fuera de la solicitud)
+        with timing.span("sms_encolar"):
+            sms_success, sms_message = liberar_sms(reserva)
         if not sms_success:
-            return func.HttpResponse(
-                json.dumps({"error": sms_message}),
-                mimetype="application/json",
-                status_code=500
-            )
-
-        # Enmascarar el número de teléfono
-        masked_phone = f"****{phone[-4:]}"
-
-        return func.HttpResponse(
-            json.dumps({
-                "mensaje": "Código enviado exitosamente",
-                "phone": masked_phone
-            }),
-            mimetype="application/json",
-            status_code=200
-        )
-
-    except ValueError:
-        return func.HttpResponse(
-            json.dumps({"error": "Cuerpo de solicitud inválido"}),
-            mimetype="application/json",
-            status_code=400
-        )
+            # Sin cancelar, el reintento del cliente chocaría con el throttle
+            cancelar_sms(reserva)
+            return esquemas.no_disponible(sms_message)
+
+        with timing.span("respuesta"):
+            return _respuesta_enviado(phone)
+
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+async def main_password_retry_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_password_retry."""
+    try:
+        with timing.span("validacion"):
+            identifier, error = _leer_identificador(req)
+        if error:
+            return error
+
+        usuario, message = await buscar_usuario_async(identifier)
+        if not usuario:
+            return _respuesta_sin_usuario(message)
+        rut, phone = usuario
+
+        code = generate_code()
+
+        with timing.span("sms_encolar"):
+            reserva, sms_message = await reservar_sms_async(phone, code)
+        if reserva is None:
+            return _respuesta_error(sms_message, 429)
+
+        success, db_message = await save_reset_code_async(rut, code)
+        if not success:
+            await cancelar_sms_async(reserva)
+            return esquemas.no_disponible(db_message)
+
+        with timing.span("sms_encolar"):
+            sms_success, sms_message = await liberar_sms_async(reserva)
+        if not sms_success:
+            await cancelar_sms_async(reserva)
+            return esquemas.no_disponible(sms_message)
+
+        with timing.span("respuesta"):
+            return _respuesta_enviado(phone)
+
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+# --- Verificación del código ---------------------------------------------------
+
+def _leer_verificacion(req):
+    """Extrae y valida identificador y código. Devuelve ((identifier, code), None) o (None, respuesta de error)."""
+    datos, error = esquemas.VERIFICAR_CODIGO.leer(req)
+    if error:
+        return None, error
+    return (datos['identifier'], datos['code']), None
+
+def _rut_de(identifier):
+    """RUT con el que se guardó el código. Un RUT válido se usa tal cual; un email requiere la
+    consulta. Devuelve None si no hay cuenta; las fallas de la base se propagan (503), para no
+    informarlas como un código inválido."""
+    if "@" not in identifier:
+        return identifier
+    usuario, _ = retry.call_with_retries(_buscar_usuario, (identifier,))
+    return usuario[0] if usuario else None
+
+async def _rut_de_async(identifier):
+    if "@" not in identifier:
+        return identifier
+    usuario, _ = await retry.call_with_retries_async(_buscar_usuario, (identifier,))
+    return usuario[0] if usuario else None
+
+def verificar_codigo(rut, code, max_retries=3, delay=None):
+    """Verifica el código del RUT. Devuelve (resultado, intentos restantes) con los resultados de
+    codigos_reset. Un reintento tras una falla transitoria puede contar dos veces un intento
+    fallido: el error queda del lado seguro."""
+    return retry.call_with_retries(codigos_reset.verificar, (rut, code), max_retries, delay)
+
+async def verificar_codigo_async(rut, code, max_retries=3, delay=None):
+    """Variante async de verificar_codigo."""
+    return await retry.call_with_retries_async(codigos_reset.verificar, (rut, code), max_retries, delay)
+
+def _respuesta_verificacion(rut, resultado, restantes):
+    if resultado == codigos_reset.VALIDO:
+        return esquemas.respuesta({
+            "mensaje": "Código verificado",
+            "reset_token": codigos_reset.token_reset(rut)
+        })
+    if resultado == codigos_reset.INCORRECTO:
+        return esquemas.respuesta({"error": "Código incorrecto", "intentos_restantes": restantes}, 400)
+    if resultado == codigos_reset.BLOQUEADO:
+        return _respuesta_error("Demasiados intentos, solicite un nuevo código", 429)
+    return _respuesta_error("Código inválido o expirado", 400)
+
+def main_verify_code(req: func.HttpRequest) -> func.HttpResponse:
+    """Verifica el código enviado por SMS y entrega un token de corta duración para cambiar la contraseña."""
+    try:
+        with timing.span("validacion"):
+            datos, error = _leer_verificacion(req)
+        if error:
+            return error
+        identifier, code = datos
+
+        try:
+            rut = _rut_de(identifier)
+            if not rut:
+                # Mismo mensaje que un código incorrecto: no revela si la cuenta existe
+                return _respuesta_error("Código inválido o expirado", 400)
+            resultado, restantes = verificar_codigo(rut, code)
+        except pyodbc.Error as e:
+            # Falla transitoria tras los reintentos: 503 para que el cliente conserve el código
+            # y reintente
+            return esquemas.no_disponible(f"Error de base de datos: {str(e)}")
+
+        with timing.span("respuesta"):
+            return _respuesta_verificacion(rut, resultado, restantes)
+
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+async def main_verify_code_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_verify_code."""
+    try:
+        with timing.span("validacion"):
+            datos, error = _leer_verificacion(req)
+        if error:
+            return error
+        identifier, code = datos
+
+        try:
+            rut = await _rut_de_async(identifier)
+            if not rut:
+                return _respuesta_error("Código inválido o expirado", 400)
+            resultado, restantes = await verificar_codigo_async(rut, code)
+        except pyodbc.Error as e:
+            # Falla transitoria tras los reintentos: 503 para que el cliente conserve el código
+            # y reintente
+            return esquemas.no_disponible(f"Error de base de datos: {str(e)}")
+
+        with timing.span("respuesta"):
+            return _respuesta_verificacion(rut, resultado, restantes)
+
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+# --- Cambio de contraseña ------------------------------------------------------
+
+def _leer_cambio(req):
+    """Extrae y valida token y contraseña nueva. Devuelve ((token, password), None) o (None, respuesta de error)."""
+    datos, error = esquemas.CAMBIAR_CONTRASENA.leer(req)
+    if error:
+        return None, error
+    return (datos['reset_token'], datos['password']), None
+
+def _cambiar_contrasena(rut, nuevo):
+    """Un intento de CambiarContrasena. Devuelve True si encontró la cuenta."""
+    with db_pool.connection() as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            cursor.execute("{CALL CambiarContrasena(?, ?)}", (rut, nuevo))
+            row = cursor.fetchone()
+            conn.commit()
+    return bool(row and row.Actualizadas)
+
+def _resultado_cambio(actualizada):
+    if not actualizada:
+        return False, "Usuario no encontrado"
+    return True, "Contraseña actualizada"
+
+def cambiar_contrasena(rut, password, max_retries=3, delay=None):
+    """Guarda la contraseña nueva (con los parámetros de hash actuales). Devuelve (success, message).
+    Las fallas del pool de hashing (hash_pool.NO_DISPONIBLE) se propagan como 503."""
+    nuevo = contrasenas.hashear(password)
+    try:
+        actualizada = retry.call_with_retries(_cambiar_contrasena, (rut, nuevo), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}"
+    return _resultado_cambio(actualizada)
+
+async def cambiar_contrasena_async(rut, password, max_retries=3, delay=None):
+    """Variante async de cambiar_contrasena."""
+    nuevo = await contrasenas.hashear_async(password)
+    try:
+        actualizada = await retry.call_with_retries_async(_cambiar_contrasena, (rut, nuevo), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}"
+    return _resultado_cambio(actualizada)
+
+def _respuesta_cambio(success, message):
+    if success:
+        return esquemas.respuesta({"mensaje": message})
+    return _respuesta_sin_usuario(message)
+
+def main_reset_password(req: func.HttpRequest) -> func.HttpResponse:
+    """Cambia la contraseña con el reset_token de main_verify_code. El token sirve hasta que
+    vence (ResetTokenMinutos): solo lo obtiene quien verificó el código."""
+    try:
+        with timing.span("validacion"):
+            datos, error = _leer_cambio(req)
+        if error:
+            return error
+        token, password = datos
+
+        rut = codigos_reset.rut_de_token_reset(token)
+        if not rut:
+            return _respuesta_error("Token inválido o expirado", 401)
+
+        resultado = cambiar_contrasena(rut, password)
+        with timing.span("respuesta"):
+            return _respuesta_cambio(*resultado)
+
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+async def main_reset_password_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_reset_password."""
+    try:
+        with timing.span("validacion"):
+            datos, error = _leer_cambio(req)
+        if error:
+            return error
+        token, password = datos
+
+        rut = codigos_reset.rut_de_token_reset(token)
+        if not rut:
+            return _respuesta_error("Token inválido o expirado", 401)
+
+        resultado = await cambiar_contrasena_async(rut, password)
+        with timing.span("respuesta"):
+            return _respuesta_cambio(*resultado)
+
     except Exception as e:
-        logging.error(f"Error no manejado: {str(e)}")
-        return func.HttpResponse(
-            json.dumps({"error": "Error interno del servidor"}),
-            mimetype="application/json",
-            status_code=500
-        )
\ No newline at end of file
+        return _respuesta_excepcion(e)
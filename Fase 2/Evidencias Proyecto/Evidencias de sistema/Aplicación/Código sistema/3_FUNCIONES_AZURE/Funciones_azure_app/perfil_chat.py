@@ -2,97 +2,268 @@
 
 import azure.functions as func
 import logging
-import json
-import re
 import pyodbc
 import os
-import time
+import db_pool
+import esquemas
+import auth
+import cache
+import circuit_breaker
+import retry
+import timing
 
-# Obtener la cadena de conexión desde las variables de entorno
-conn_str = os.environ["SqlConnectionString"]
+# Consulta de perfiles en lote (panel de administración)
+PERFIL_BATCH_MAX = int(os.environ.get("PerfilBatchMaxRuts", "200"))
+PERFIL_BATCH_CHUNK_SIZE = int(os.environ.get("PerfilBatchChunkSize", "100"))
+_MENSAJE_MAXIMO = f"Máximo {PERFIL_BATCH_MAX} RUTs por solicitud"
+
+def _perfil_desde_fila(row):
+    return {
+        "NombreCompleto": getattr(row, 'NombreCompleto', "N/A"),
+        "RUTUsuario": getattr(row, 'RUTUsuario', "N/A"),
+        "DV": getattr(row, 'DV', "N/A"),
+        "NumeroTelefono": getattr(row, 'NumeroTelefono', "N/A"),
+        "Email": getattr(row, 'Email', "N/A"),
+        "Edad": getattr(row, 'Edad', "N/A"),
+        "Sexo": getattr(row, 'Sexo', "N/A"),
+        "Ciudad": getattr(row, 'Ciudad', "N/A"),
+        "Nacionalidad": getattr(row, 'Nacionalidad', "N/A"),
+        "Direccion": getattr(row, 'Direccion', "N/A")
+    }
+
+def _entrada(row):
+    """(perfil, ETag) de una fila de ObtenerPerfil u ObtenerPerfilesLote, como se guarda en cache."""
+    return _perfil_desde_fila(row), esquemas.etag(getattr(row, 'Version', None))
+
+def _leer_perfil(rut):
+    """Un intento de lectura de ObtenerPerfil (en la réplica, si hay). Los perfiles encontrados
+    se guardan en cache por RUT, junto con su ETag."""
+    with db_pool.lectura("perfil", rut) as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            cursor.execute("{CALL ObtenerPerfil(?)}", (rut,))
+            row = cursor.fetchone()
+
+        if not row or not hasattr(row, 'RUTUsuario'):
+            return False, "Usuario no encontrado", None
+
+        entrada = _entrada(row)
+        cache.perfiles.set(str(rut), entrada)
+        return True, "Usuario encontrado", entrada
+
+def _leer_version(rut):
+    """Un intento de VersionPerfil: solo el ETag vigente (None si el usuario no existe), sin
+    leer ni armar el perfil."""
+    with db_pool.lectura("perfil", rut) as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            cursor.execute("{CALL VersionPerfil(?)}", (rut,))
+            row = cursor.fetchone()
+    return esquemas.etag(row.Version) if row else None
+
+def perfil_versionado(rut, si_none_match=None, max_retries=3, delay=None):
+    """Como perfil_usuario, pero devuelve (success, message, (perfil, etag)). Si la versión
+    vigente coincide con `si_none_match` (If-None-Match) el perfil es None; sin el perfil en
+    cache eso se resuelve con VersionPerfil, sin leer el registro completo."""
+    entrada = cache.perfiles.get(str(rut))
+    try:
+        if entrada is None and si_none_match:
+            etag = retry.call_with_retries(_leer_version, (rut,), max_retries, delay)
+            if esquemas.etag_coincide(si_none_match, etag):
+                return True, "Usuario encontrado", (None, etag)
+        if entrada is None:
+            success, message, entrada = retry.call_with_retries(_leer_perfil, (rut,), max_retries, delay)
+            if not success:
+                return success, message, None
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}", None
+    return True, "Usuario encontrado", esquemas.condicional(entrada, si_none_match)
+
+async def perfil_versionado_async(rut, si_none_match=None, max_retries=3, delay=None):
+    """Variante async de perfil_versionado."""
+    entrada = cache.perfiles.get(str(rut))
+    try:
+        if entrada is None and si_none_match:
+            etag = await retry.call_with_retries_async(_leer_version, (rut,), max_retries, delay)
+            if esquemas.etag_coincide(si_none_match, etag):
+                return True, "Usuario encontrado", (None, etag)
+        if entrada is None:
+            success, message, entrada = await retry.call_with_retries_async(_leer_perfil, (rut,), max_retries, delay)
+            if not success:
+                return success, message, None
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}", None
+    return True, "Usuario encontrado", esquemas.condicional(entrada, si_none_match)
 
 # Función para leer los datos de perfil de empleado en la base de datos
-def perfil_usuario(rut, max_retries=3, delay=1):
+def perfil_usuario(rut, max_retries=3, delay=None):
     """Realiza lectura de perfil de usuario llamando al procedimiento almacenado con reintentos."""
-    attempts = 0
-    conn = None
-    
-    try:
-        while attempts < max_retries:
-            try:
-                conn = pyodbc.connect(conn_str)
-                cursor = conn.cursor()
-                cursor.execute("{CALL ObtenerPerfil(?)}", (rut,))
-                row = cursor.fetchone()
-
-                if not row or not hasattr(row, 'RUTUsuario'):
-                    return False, "Usuario no encontrado", None
-                
-                perfil = {
-                    "NombreCompleto": getattr(row, 'NombreCompleto', "N/A"),
-                    "RUTUsuario": getattr(row, 'RUTUsuario', "N/A"),
-                    "DV": getattr(row, 'DV', "N/A"),
-                    "NumeroTelefono": getattr(row, 'NumeroTelefono', "N/A"),
-                    "Email": getattr(row, 'Email', "N/A"),
-                    "Edad": getattr(row, 'Edad', "N/A"),
-                    "Sexo": getattr(row, 'Sexo', "N/A"),
-                    "Ciudad": getattr(row, 'Ciudad', "N/A"),
-                    "Nacionalidad": getattr(row, 'Nacionalidad', "N/A"),
-                    "Direccion": getattr(row, 'Direccion', "N/A")
-                }
-                return True, "Usuario encontrado", perfil
-
-            except pyodbc.Error as e:
-                attempts += 1
-                if attempts == max_retries:
-                    return False, f"Error de base de datos: {str(e)}", None
-                time.sleep(delay)
-                
-    finally:
-        if conn:
-            conn.close()
+    success, message, entrada = perfil_versionado(rut, None, max_retries, delay)
+    return success, message, entrada[0] if success else None
+
+async def perfil_usuario_async(rut, max_retries=3, delay=None):
+    """Variante async de perfil_usuario: la consulta corre en el executor y los reintentos no bloquean."""
+    success, message, entrada = await perfil_versionado_async(rut, None, max_retries, delay)
+    return success, message, entrada[0] if success else None
+
+def _leer_perfiles(ruts):
+    """Un intento de ObtenerPerfilesLote: los RUTs viajan como parámetro tabla, en bloques de
+    PERFIL_BATCH_CHUNK_SIZE, sobre una sola conexión. Devuelve {rut: perfil} de los encontrados."""
+    encontrados = {}
+    with db_pool.lectura("perfil_lote", *ruts) as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            for i in range(0, len(ruts), PERFIL_BATCH_CHUNK_SIZE):
+                bloque = [(rut,) for rut in ruts[i:i + PERFIL_BATCH_CHUNK_SIZE]]
+                cursor.execute("{CALL ObtenerPerfilesLote(?)}", (bloque,))
+                for row in cursor.fetchall():
+                    encontrados[str(row.RUTUsuario)] = _entrada(row)
+    for rut, entrada in encontrados.items():
+        cache.perfiles.set(rut, entrada)
+    return {rut: perfil for rut, (perfil, _) in encontrados.items()}
+
+def _separar_cacheados(ruts):
+    """Devuelve ({rut: perfil o None}, RUTs que no estaban en cache)."""
+    resultado = {}
+    faltantes = []
+    for rut in ruts:
+        entrada = cache.perfiles.get(rut)
+        resultado[rut] = entrada[0] if entrada is not None else None
+        if entrada is None:
+            faltantes.append(rut)
+    return resultado, faltantes
+
+def perfiles_usuarios(ruts, max_retries=3, delay=None):
+    """Variante en lote de perfil_usuario: los RUTs en cache no van a la base de datos y el resto
+    se resuelve en una consulta. Devuelve (success, message, {rut: perfil o None})."""
+    resultado, faltantes = _separar_cacheados(ruts)
+    if faltantes:
+        try:
+            encontrados = retry.call_with_retries(_leer_perfiles, (faltantes,), max_retries, delay)
+        except pyodbc.Error as e:
+            return False, f"Error de base de datos: {str(e)}", None
+        for rut in faltantes:
+            resultado[rut] = encontrados.get(rut)
+    return True, "Perfiles consultados", resultado
+
+async def perfiles_usuarios_async(ruts, max_retries=3, delay=None):
+    """Variante async de perfiles_usuarios."""
+    resultado, faltantes = _separar_cacheados(ruts)
+    if faltantes:
+        try:
+            encontrados = await retry.call_with_retries_async(_leer_perfiles, (faltantes,), max_retries, delay)
+        except pyodbc.Error as e:
+            return False, f"Error de base de datos: {str(e)}", None
+        for rut in faltantes:
+            resultado[rut] = encontrados.get(rut)
+    return True, "Perfiles consultados", resultado
+
+def _leer_solicitud(req):
+    """Obtiene el RUT desde el token (o del cuerpo si AuthRequired=0).
+    Devuelve (rut, None) o (None, respuesta de error)."""
+    datos, error = esquemas.RUT.leer(req)
+    if error:
+        return None, error
+    rut, error = auth.rut_autenticado(req, datos['rut'])
+    if error:
+        return None, error
+
+    if not rut:
+        return None, esquemas.error(esquemas.RUT.faltantes, 400)
+    return rut, None
+
+def _respuesta(success, message, entrada):
+    if success:
+        perfil, etag = entrada
+        # perfil None: el cliente ya tiene esta versión (304)
+        return esquemas.respuesta_versionada(None if perfil is None else {
+            "mensaje": message,
+            **perfil
+        }, etag)
+    if message.startswith("Error de base de datos"):
+        # Falla transitoria tras los reintentos: 503 para que el cliente reintente
+        return esquemas.no_disponible(message)
+    return esquemas.error(message, 401)
+
+def _leer_solicitud_batch(req):
+    """Lista de RUTs del cuerpo, solo para administradores. Devuelve (ruts, None) o (None, respuesta de error)."""
+    _, error = auth.admin_autenticado(req)
+    if error:
+        return None, error
+    datos, error = esquemas.PERFIL_BATCH.leer(req)
+    if error:
+        return None, error
+    if len(datos['ruts']) > PERFIL_BATCH_MAX:
+        return None, esquemas.error(_MENSAJE_MAXIMO, 400)
+    return datos['ruts'], None
+
+def _respuesta_batch(success, message, perfiles):
+    if success:
+        return esquemas.respuesta({
+            "mensaje": message,
+            "perfiles": perfiles,
+            "no_encontrados": [rut for rut, perfil in perfiles.items() if perfil is None]
+        })
+    if message.startswith("Error de base de datos"):
+        return esquemas.no_disponible(message)
+    return esquemas.error(message, 500)
+
+def _respuesta_excepcion(e):
+    if isinstance(e, circuit_breaker.CircuitoAbierto):
+        return esquemas.no_disponible(esquemas.BASE_NO_DISPONIBLE, e.reintentar_en)
+    if isinstance(e, (ValueError, KeyError, TypeError)):
+        return esquemas.error("Solicitud inválida: " + str(e), 400)
+    logging.error(f"Error no manejado: {str(e)}")
+    return esquemas.error("Error interno del servidor", 500)
 
 def main_perfil(req: func.HttpRequest) -> func.HttpResponse:
     """Maneja la solicitud HTTP para el perfil de usuario."""
     try:
-        req_body = req.get_json()
-        rut = req_body.get('rut')
-
-        if not rut:
-            return func.HttpResponse(
-                json.dumps({"error": "RUT es requerido"}),
-                mimetype="application/json",
-                status_code=400
-            )
-
-        success, message, perfil = perfil_usuario(rut)
-
-        if success:
-            return func.HttpResponse(
-                json.dumps({
-                    "mensaje": message,
-                    **perfil
-                }),
-                mimetype="application/json",
-                status_code=200
-            )
-        
-        return func.HttpResponse(
-            json.dumps({"error": message}),
-            mimetype="application/json",
-            status_code=401
-        )
-
-    except (ValueError, KeyError, TypeError) as e:
-        return func.HttpResponse(
-            json.dumps({"error": "Solicitud inválida: " + str(e)}),
-            mimetype="application/json",
-            status_code=400
-        )
+        with timing.span("validacion"):
+            rut, error = _leer_solicitud(req)
+        if error:
+            return error
+        resultado = perfil_versionado(rut, req.headers.get("If-None-Match"))
+        with timing.span("respuesta"):
+            return _respuesta(*resultado)
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+async def main_perfil_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_perfil."""
+    try:
+        with timing.span("validacion"):
+            rut, error = _leer_solicitud(req)
+        if error:
+            return error
+        resultado = await perfil_versionado_async(rut, req.headers.get("If-None-Match"))
+        with timing.span("respuesta"):
+            return _respuesta(*resultado)
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+def main_perfil_batch(req: func.HttpRequest) -> func.HttpResponse:
+    """Maneja la solicitud HTTP para consultar varios perfiles a la vez."""
+    try:
+        with timing.span("validacion"):
+            ruts, error = _leer_solicitud_batch(req)
+        if error:
+            return error
+        resultado = perfiles_usuarios(ruts)
+        with timing.span("respuesta"):
+            return _respuesta_batch(*resultado)
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+async def main_perfil_batch_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_perfil_batch."""
+    try:
+        with timing.span("validacion"):
+            ruts, error = _leer_solicitud_batch(req)
+        if error:
+            return error
+        resultado = await perfiles_usuarios_async(ruts)
+        with timing.span("respuesta"):
+            return _respuesta_batch(*resultado)
     except Exception as e:
-        logging.error(f"Error no manejado: {str(e)}")
-        return func.HttpResponse(
-            json.dumps({"error": "Error interno del servidor"}),
-            mimetype="application/json",
-            status_code=500
-        )
+        return _respuesta_excepcion(e)
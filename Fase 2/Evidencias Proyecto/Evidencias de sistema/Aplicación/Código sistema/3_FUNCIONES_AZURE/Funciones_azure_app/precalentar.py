@@ -0,0 +1,131 @@
+# precalentar.py
+#
+# Precalentamiento de una instancia: deja listo lo que la primera solicitud pagaría en frío.
+#   modulos     importar los módulos de todas las rutas (function_app.precargar)
+#   conexiones  abrir las conexiones mínimas del pool (PrewarmConexiones, por defecto SqlPoolMinSize)
+#   planes      un LoginUsuario y un ObtenerPerfil de prueba, para compilar y dejar en cache
+#               sus planes en SQL Server (el identificador no existe: no devuelven filas)
+#   hash        un hash por trabajador, que arranca los procesos del pool de hashing y
+#               reserva la memoria de scrypt con los parámetros actuales
+#
+# Lo ejecutan el timer timer_precalentar (cada PrewarmSchedule, también mantiene viva la
+# instancia) y el arranque del worker (PrewarmOnStartup), ambos en function_app.py. Cada paso
+# es independiente: si la base no responde se registra el error y se sigue con el siguiente.
+#
+# La duración de cada paso queda en los histogramas de timing (ruta "precalentar") y cada
+# ejecución se registra como una línea JSON con su efecto: conexiones abiertas y trabajadores
+# de hashing arrancados (0 si la instancia ya estaba caliente).
+
+import json
+import logging
+import os
+import threading
+import time
+
+import pyodbc
+
+import circuit_breaker
+import contrasenas
+import db_pool
+import hash_pool
+import timing
+
+# Configuración (variables de entorno opcionales)
+PREWARM_CONEXIONES = int(os.environ.get("PrewarmConexiones", str(db_pool.POOL_MIN_SIZE)))
+PREWARM_HASH = os.environ.get("PrewarmHash", "1") == "1"
+# Identificador de las consultas de prueba: no debe corresponder a un usuario real
+PREWARM_IDENTIFICADOR = os.environ.get("PrewarmIdentificador", "0")
+
+_lock = threading.Lock()
+_ejecuciones = 0
+_fallidas = 0
+_ultima = None
+
+
+def _paso(resultado, nombre, funcion):
+    """Ejecuta un paso midiendo su duración; un error se anota y no detiene los demás."""
+    inicio = time.perf_counter()
+    try:
+        efecto = funcion()
+    except (pyodbc.Error, circuit_breaker.CircuitoAbierto, *hash_pool.NO_DISPONIBLE) as e:
+        resultado["errores"][nombre] = str(e)
+        logging.warning(f"Precalentamiento: falló el paso {nombre}: {str(e)}")
+        efecto = None
+    ms = (time.perf_counter() - inicio) * 1000
+    timing.registrar("precalentar", nombre, ms)
+    resultado["fases"][nombre] = round(ms, 3)
+    return efecto
+
+
+def _conexiones():
+    """Abre las conexiones que falten para llegar a PREWARM_CONEXIONES (también en la réplica)."""
+    db_pool.get_pool().prewarm(PREWARM_CONEXIONES)
+    replica = db_pool.get_replica_pool()
+    if replica is not None:
+        replica.prewarm(PREWARM_CONEXIONES)
+
+
+def _consulta(conexion, procedimiento):
+    inicio = time.perf_counter()
+    with conexion as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"{{CALL {procedimiento}(?)}}", (PREWARM_IDENTIFICADOR,))
+        cursor.fetchall()
+    return round((time.perf_counter() - inicio) * 1000, 3)
+
+
+def _planes():
+    """Consultas de prueba, cada una en la base donde corre en producción (ObtenerPerfil en la
+    réplica, si hay). Devuelve ms de cada una."""
+    return {
+        "LoginUsuario": _consulta(db_pool.connection(), "LoginUsuario"),
+        "ObtenerPerfil": _consulta(db_pool.lectura("perfil"), "ObtenerPerfil"),
+    }
+
+
+def _hash():
+    """Un hash por trabajador (tareas de a uno) para que arranquen todos los procesos."""
+    pool = hash_pool.get_pool()
+    params = contrasenas.ACTUALES
+    pares = [(b"precalentar", os.urandom(contrasenas.HASH_SALT_BYTES))] * max(pool.workers, 1)
+    pool.hash_lote(pares, N=params.n, r=params.r, p=params.p, buflen=params.buflen, chunk=1)
+
+
+def ejecutar(origen, precargar=None):
+    """Precalienta la instancia y devuelve el resumen de la ejecución. `precargar` importa los
+    módulos de las rutas (function_app.precargar; aquí no se importa function_app)."""
+    global _ejecuciones, _fallidas, _ultima
+    inicio = time.perf_counter()
+    resultado = {"evento": "precalentamiento", "origen": origen, "fases": {}, "errores": {}}
+
+    creadas_antes = db_pool.get_pool().stats()["created"] if db_pool.iniciado() else 0
+    hash_frio = PREWARM_HASH and not hash_pool.get_pool().stats()["iniciado"]
+    if precargar is not None:
+        _paso(resultado, "modulos", precargar)
+    _paso(resultado, "conexiones", _conexiones)
+    resultado["consultas_ms"] = _paso(resultado, "planes", _planes) or {}
+    if PREWARM_HASH:
+        _paso(resultado, "hash", _hash)
+
+    total_ms = (time.perf_counter() - inicio) * 1000
+    timing.registrar("precalentar", "total", total_ms)
+    resultado["total_ms"] = round(total_ms, 3)
+    # get_pool() abre las conexiones mínimas al crear el pool: se cuentan todas las creadas
+    resultado["conexiones_abiertas"] = (db_pool.get_pool().stats()["created"] - creadas_antes
+                                        if db_pool.iniciado() else 0)
+    resultado["trabajadores_iniciados"] = (hash_pool.get_pool().workers
+                                           if hash_frio and "hash" not in resultado["errores"] else 0)
+    logging.info(json.dumps(resultado))
+
+    with _lock:
+        _ejecuciones += 1
+        if resultado["errores"]:
+            _fallidas += 1
+        _ultima = resultado
+    return resultado
+
+
+def stats():
+    """Ejecuciones del precalentamiento y el detalle de la última."""
+    with _lock:
+        return {"ejecuciones": _ejecuciones, "fallidas": _fallidas, "ultima": _ultima}
@@ -0,0 +1,223 @@
+# rate_limit.py
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Límites de intentos de login (variables de entorno opcionales). Se aplican antes de
+# consultar la base de datos o calcular scrypt.
+LOGIN_RATE_LIMIT = os.environ.get("LoginRateLimit", "1") == "1"
+LOGIN_RATE_STORE = os.environ.get("LoginRateStore", "memory")            # memory | sqlite
+LOGIN_RATE_STORE_PATH = os.environ.get("LoginRateStorePath", "login_rate.db")
+LOGIN_RATE_SHARDS = int(os.environ.get("LoginRateShards", "16"))
+LOGIN_RATE_MAX_ENTRIES = int(os.environ.get("LoginRateMaxEntries", "100000"))
+# Intentos por dirección de cliente: ráfaga y recarga por minuto
+LOGIN_CLIENTE_RAFAGA = int(os.environ.get("LoginClienteRafaga", "20"))
+LOGIN_CLIENTE_POR_MINUTO = float(os.environ.get("LoginClientePorMinuto", "10"))
+# Intentos por identificador (RUT o email), vengan de donde vengan
+LOGIN_IDENTIFICADOR_RAFAGA = int(os.environ.get("LoginIdentificadorRafaga", "10"))
+LOGIN_IDENTIFICADOR_POR_MINUTO = float(os.environ.get("LoginIdentificadorPorMinuto", "5"))
+# Bloqueo: tras LoginMaxFallos contraseñas incorrectas el identificador queda bloqueado
+# hasta que se recupere un intento (LoginBloqueoSegundos / LoginMaxFallos)
+LOGIN_MAX_FALLOS = int(os.environ.get("LoginMaxFallos", "5"))
+LOGIN_BLOQUEO_SEGUNDOS = float(os.environ.get("LoginBloqueoSegundos", "900"))
+
+
+def direccion_cliente(req):
+    """Dirección IP del cliente según X-Forwarded-For (la fija el front end de Azure), sin puerto."""
+    reenviado = req.headers.get("X-Forwarded-For") or req.headers.get("x-forwarded-for")
+    if not reenviado:
+        return None
+    direccion = reenviado.split(",")[0].strip()
+    if direccion.startswith("["):
+        # IPv6 con puerto: [2001:db8::1]:443
+        return direccion[1:].split("]")[0]
+    if direccion.count(":") == 1:
+        # IPv4 con puerto: 203.0.113.7:51234
+        return direccion.split(":")[0]
+    return direccion
+
+
+def _recargar(tokens, actualizado, capacidad, por_segundo, ahora):
+    return min(capacidad, tokens + (ahora - actualizado) * por_segundo)
+
+
+# --- Almacenes ---------------------------------------------------------------
+
+class MemoryRateStore:
+    """Token buckets en memoria del proceso, repartidos en shards con su propio lock.
+    Cada shard guarda a lo más `max_entries / shards` claves y desaloja la menos reciente."""
+
+    def __init__(self, shards=LOGIN_RATE_SHARDS, max_entries=LOGIN_RATE_MAX_ENTRIES):
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(max(shards, 1))]
+        self._max_por_shard = max(max_entries // len(self._shards), 1)
+        self.desalojos = 0
+
+    def _shard(self, clave):
+        return self._shards[hash(clave) % len(self._shards)]
+
+    def consumir(self, clave, capacidad, por_segundo, costo=1):
+        """Descuenta `costo` fichas si hay al menos max(costo, 1). Con costo=0 solo consulta.
+        Devuelve (permitido, segundos hasta la próxima ficha)."""
+        ahora = time.time()
+        lock, buckets = self._shard(clave)
+        with lock:
+            tokens, actualizado = buckets.get(clave, (capacidad, ahora))
+            tokens = _recargar(tokens, actualizado, capacidad, por_segundo, ahora)
+            if tokens < max(costo, 1):
+                return False, (max(costo, 1) - tokens) / por_segundo
+            if costo:
+                buckets[clave] = (tokens - costo, ahora)
+                buckets.move_to_end(clave)
+                while len(buckets) > self._max_por_shard:
+                    buckets.popitem(last=False)
+                    self.desalojos += 1
+            return True, 0.0
+
+    def reiniciar(self, clave):
+        lock, buckets = self._shard(clave)
+        with lock:
+            buckets.pop(clave, None)
+
+    def entradas(self):
+        return sum(len(buckets) for _, buckets in self._shards)
+
+
+class SqliteRateStore:
+    """Token buckets en un archivo SQLite compartido por varios procesos o instancias del
+    mismo host (sustituto local de un almacén compartido). Cada operación es una transacción
+    BEGIN IMMEDIATE, así que el descuento es atómico entre procesos."""
+
+    def __init__(self, ruta=LOGIN_RATE_STORE_PATH, limpiar_cada=1000):
+        self.ruta = ruta
+        self.limpiar_cada = limpiar_cada
+        self._local = threading.local()
+        self._operaciones = 0
+        with self._conexion() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS Buckets ("
+                         "Clave TEXT PRIMARY KEY, Tokens REAL NOT NULL, "
+                         "Actualizado REAL NOT NULL, LlenoEn REAL NOT NULL)")
+
+    def _conexion(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def consumir(self, clave, capacidad, por_segundo, costo=1):
+        ahora = time.time()
+        conn = self._conexion()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT Tokens, Actualizado FROM Buckets WHERE Clave = ?", (clave,)).fetchone()
+            tokens = _recargar(row[0], row[1], capacidad, por_segundo, ahora) if row else capacidad
+            if tokens < max(costo, 1):
+                conn.execute("COMMIT")
+                return False, (max(costo, 1) - tokens) / por_segundo
+            if costo:
+                tokens -= costo
+                # LlenoEn permite borrar los buckets que ya se recargaron por completo
+                lleno_en = ahora + (capacidad - tokens) / por_segundo
+                conn.execute("INSERT OR REPLACE INTO Buckets (Clave, Tokens, Actualizado, LlenoEn) "
+                             "VALUES (?, ?, ?, ?)", (clave, tokens, ahora, lleno_en))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._operaciones += 1
+        if self._operaciones % self.limpiar_cada == 0:
+            conn.execute("DELETE FROM Buckets WHERE LlenoEn < ?", (ahora,))
+        return True, 0.0
+
+    def reiniciar(self, clave):
+        self._conexion().execute("DELETE FROM Buckets WHERE Clave = ?", (clave,))
+
+    def entradas(self):
+        return self._conexion().execute("SELECT COUNT(*) FROM Buckets").fetchone()[0]
+
+
+# --- Limitador ---------------------------------------------------------------
+
+class LoginLimiter:
+    """Aplica los límites por cliente, por identificador y el bloqueo por contraseñas incorrectas."""
+
+    def __init__(self, store):
+        self.store = store
+        self.permitidos = 0
+        self.rechazados = {"bloqueo": 0, "cliente": 0, "identificador": 0}
+
+    def verificar(self, identifier, cliente=None):
+        """Consume un intento. Devuelve None si se permite, o (motivo, segundos de espera)."""
+        permitido, espera = self.store.consumir(
+            "fallos:" + identifier, LOGIN_MAX_FALLOS, LOGIN_MAX_FALLOS / LOGIN_BLOQUEO_SEGUNDOS, costo=0)
+        if not permitido:
+            return self._rechazo("bloqueo", espera)
+        if cliente:
+            permitido, espera = self.store.consumir(
+                "cliente:" + cliente, LOGIN_CLIENTE_RAFAGA, LOGIN_CLIENTE_POR_MINUTO / 60)
+            if not permitido:
+                return self._rechazo("cliente", espera)
+        permitido, espera = self.store.consumir(
+            "id:" + identifier, LOGIN_IDENTIFICADOR_RAFAGA, LOGIN_IDENTIFICADOR_POR_MINUTO / 60)
+        if not permitido:
+            return self._rechazo("identificador", espera)
+        self.permitidos += 1
+        return None
+
+    def _rechazo(self, motivo, espera):
+        self.rechazados[motivo] += 1
+        return motivo, espera
+
+    def registrar(self, identifier, exitoso):
+        """Un login exitoso limpia los fallos del identificador; uno fallido descuenta del bloqueo."""
+        if exitoso:
+            self.store.reiniciar("fallos:" + identifier)
+        else:
+            self.store.consumir("fallos:" + identifier, LOGIN_MAX_FALLOS,
+                                LOGIN_MAX_FALLOS / LOGIN_BLOQUEO_SEGUNDOS)
+
+    def stats(self):
+        return {"permitidos": self.permitidos, "rechazados": dict(self.rechazados),
+                "entradas": self.store.entradas()}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def configurar(store=None):
+    """Reemplaza el limitador compartido (por ejemplo, con otro almacén)."""
+    global _limiter
+    with _limiter_lock:
+        if store is None:
+            store = SqliteRateStore() if LOGIN_RATE_STORE == "sqlite" else MemoryRateStore()
+        _limiter = LoginLimiter(store)
+        return _limiter
+
+
+def get_limiter():
+    if _limiter is None:
+        configurar()
+    return _limiter
+
+
+def verificar_login(identifier, cliente=None):
+    """Devuelve None si el intento se permite, o (motivo, segundos de espera) si se rechaza."""
+    if not LOGIN_RATE_LIMIT:
+        return None
+    return get_limiter().verificar(identifier, cliente)
+
+
+def registrar_login(identifier, exitoso):
+    if LOGIN_RATE_LIMIT:
+        get_limiter().registrar(identifier, exitoso)
+
+
+def retry_after(espera):
+    """Valor de la cabecera Retry-After (segundos enteros, al menos 1)."""
+    return str(max(1, math.ceil(espera)))
@@ -2,148 +2,313 @@
 
 import azure.functions as func
 import logging
-import json
-import re
 import pyodbc
 import os
-import time
-import scrypt
-import base64
+import auth
+import circuit_breaker
+import contrasenas
+import db_pool
+import esquemas
+import hash_pool
+import cache
+import retry
+import timing
 
-# Obtener la cadena de conexión desde las variables de entorno
-conn_str = os.environ["SqlConnectionString"]
+# Alta de colaboradores en lote (RRHH pre-registra una cuadrilla completa)
+REGISTRO_LOTE_MAX = int(os.environ.get("RegistroLoteMaxUsuarios", "1000"))
+REGISTRO_LOTE_CHUNK_SIZE = int(os.environ.get("RegistroLoteChunkSize", "500"))
+_MENSAJE_MAXIMO_LOTE = f"Máximo {REGISTRO_LOTE_MAX} colaboradores por solicitud"
 
-# Funciones de validación y limpieza
-def validate_rut(rut):
-    """Valida el formato del RUT chileno."""
-    pattern = r'^\d{1,8}-[0-9kK]$'
-    return re.match(pattern, rut) is not None
+# Resultado de cada RUT en el registro en lote
+MENSAJES_LOTE = {
+    "registrado": "Usuario registrado exitosamente.",
+    "ya_registrado": "El RUT ya está registrado en UsuarioLogin.",
+    "no_existe": "El RUT no existe en la tabla Empleados.",
+    "duplicado": "El RUT aparece más de una vez en el lote.",
+    "error": "No se pudo registrar por un error de base de datos, intente nuevamente.",
+}
 
-def validate_password(password):
-    """Valida el formato de la contraseña."""
-    pattern = r'^(?=.*[a-zA-ZñÑ])(?=.*[A-ZÑ])(?=.*\d)[a-zA-ZñÑ\d]{8,}$'
-    return re.match(pattern, password) is not None
-
-def sanitize_input(input_string):
-    """Limpia la entrada de caracteres potencialmente peligrosos."""
-    input_string = input_string.replace(" ", "")
-    return re.sub(r"[;'\"*?=&]", "", input_string)
+def _registrar(rut, final_hash, direccion, numero):
+    """Un intento de RegistrarUsuarioColaborador. El pool devuelve la conexión aunque ocurra un error."""
+    with db_pool.connection() as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            cursor.execute("{CALL RegistrarUsuarioColaborador(?,?,?,?)}", 
+                         (rut, final_hash, direccion, numero))
+        
+        # Verificar si se insertó una fila
+        if cursor.rowcount > 0:
+            success = True
+            message = "Usuario registrado exitosamente."
+        else:
+            message = cursor.messages[0][1] if cursor.messages else None
+            
+            if message:
+                success = "exitosamente" in message.lower()
+            else:
+                success = False
+                message = "No se pudo registrar el usuario por una razón desconocida."
 
-def clean_rut(rut):
-    """Limpia el RUT eliminando el guión y el dígito verificador."""
-    return rut.split('-')[0]
+        with timing.span("db_query"):
+            conn.commit()
+    if success:
+        # El perfil ahora incluye dirección y teléfono del colaborador
+        cache.invalidate_rut(rut)
+        db_pool.marcar_escritura(rut)
+    return success, message
 
 # Función para registrar usuario colaborador en la base de datos
-def register_usuario_colaborador(rut, password, direccion, numero, max_retries=3, delay=1):
+def register_usuario_colaborador(rut, password, direccion, numero, max_retries=3, delay=None):
     """Realiza el registro del usuario llamando al procedimiento almacenado con reintentos."""
-    attempts = 0
-    while attempts < max_retries:
-        try:
-            # Generar un salt aleatorio (reducido a 8 bytes)
-            salt = os.urandom(8)
-            # Generar el hash de la contraseña usando scrypt con buffer más pequeño
-            hashed_password = scrypt.hash(
-                password.encode('utf-8'),
-                salt,
-                N=16384,
-                r=8,
-                p=1,
-                buflen=24  # Reducido de 32 a 24
-            )
-            
-            # Combinar salt y hash, y convertir a base64
-            final_hash = base64.b64encode(salt + hashed_password).decode('utf-8')
+    # Con la base de datos caída no tiene sentido pagar el hash
+    db_pool.breaker.verificar()
+    # Generar el hash una sola vez, fuera del bucle de reintentos, en el pool de procesos y con
+    # los parámetros actuales (ver contrasenas.py). Las fallas del pool (hash_pool.NO_DISPONIBLE)
+    # se propagan para que el handler responda 503.
+    final_hash = contrasenas.hashear(password)
 
-            conn = pyodbc.connect(conn_str)
+    try:
+        return retry.call_with_retries(_registrar, (rut, final_hash, direccion, numero), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos después de {max_retries} intentos: {str(e)}"
+    except circuit_breaker.CircuitoAbierto:
+        raise
+    except Exception as e:
+        return False, str(e)
+
+async def register_usuario_colaborador_async(rut, password, direccion, numero, max_retries=3, delay=None):
+    """Variante async de register_usuario_colaborador."""
+    db_pool.breaker.verificar()
+    final_hash = await contrasenas.hashear_async(password)
+
+    try:
+        return await retry.call_with_retries_async(_registrar, (rut, final_hash, direccion, numero), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos después de {max_retries} intentos: {str(e)}"
+    except circuit_breaker.CircuitoAbierto:
+        raise
+    except Exception as e:
+        return False, str(e)
+
+def _estados_lote(ruts):
+    """Un intento de EstadoColaboradoresLote: {rut: 'pendiente' | 'ya_registrado' | 'no_existe'}."""
+    estados = {}
+    with db_pool.connection() as conn:
+        with timing.span("db_query"):
             cursor = conn.cursor()
-            cursor.execute("{CALL RegistrarUsuarioColaborador(?,?,?,?)}", 
-                         (rut, final_hash, direccion, numero))
-            
-            # Verificar si se insertó una fila
-            if cursor.rowcount > 0:
-                success = True
-                message = "Usuario registrado exitosamente."
-            else:
-                message = cursor.messages[0][1] if cursor.messages else None
-                
-                if message:
-                    success = "exitosamente" in message.lower()
-                else:
-                    success = False
-                    message = "No se pudo registrar el usuario por una razón desconocida."
+            for i in range(0, len(ruts), REGISTRO_LOTE_CHUNK_SIZE):
+                bloque = [(rut,) for rut in ruts[i:i + REGISTRO_LOTE_CHUNK_SIZE]]
+                cursor.execute("{CALL EstadoColaboradoresLote(?)}", (bloque,))
+                for row in cursor.fetchall():
+                    estados[str(row.RUTUsuario)] = row.Resultado
+    return estados
 
+def _registrar_lote(filas):
+    """Un intento de RegistrarColaboradoresLote para un bloque, en una transacción.
+    Devuelve {rut: 'registrado' | 'ya_registrado' | 'no_existe'}."""
+    with db_pool.connection() as conn:
+        with timing.span("db_query"):
+            cursor = conn.cursor()
+            cursor.execute("{CALL RegistrarColaboradoresLote(?)}", (filas,))
+            resultados = {str(row.RUTUsuario): row.Resultado for row in cursor.fetchall()}
             conn.commit()
-            conn.close()
-            return success, message
+    return resultados
+
+def _filas_lote(pendientes, hashes):
+    return [(rut, final_hash, direccion, numero)
+            for (rut, _, direccion, numero), final_hash in zip(pendientes, hashes)]
+
+def _resultado_lote(estados, bloques_fallidos, error):
+    """Marca como 'error' los RUTs de los bloques que no se pudieron insertar e invalida la
+    cache de los registrados."""
+    for bloque in bloques_fallidos:
+        for fila in bloque:
+            estados[fila[0]] = "error"
+    for rut, estado in estados.items():
+        if estado == "registrado":
+            cache.invalidate_rut(rut)
+            db_pool.marcar_escritura(rut)
+    if error:
+        logging.error(f"Registro en lote incompleto: {error}")
+        return True, "Registro en lote completado con errores", estados
+    return True, "Registro en lote completado", estados
+
+def register_usuarios_colaboradores(usuarios, max_retries=3, delay=None):
+    """Registro en lote. `usuarios` es una lista de (rut, password, direccion, numero) ya validados
+    y sin RUTs repetidos. Solo se calcula el hash de los RUTs que se pueden registrar; los hashes
+    se reparten en el pool de procesos y la inserción va en bloques set-based.
+    Devuelve (success, message, {rut: resultado})."""
+    db_pool.breaker.verificar()
+    try:
+        estados = retry.call_with_retries(_estados_lote, ([u[0] for u in usuarios],), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos después de {max_retries} intentos: {str(e)}", None
+
+    pendientes = [u for u in usuarios if estados.get(u[0]) == "pendiente"]
+    filas = _filas_lote(pendientes, contrasenas.hashear_lote([u[1] for u in pendientes]))
+
+    bloques = [filas[i:i + REGISTRO_LOTE_CHUNK_SIZE] for i in range(0, len(filas), REGISTRO_LOTE_CHUNK_SIZE)]
+    for i, bloque in enumerate(bloques):
+        try:
+            estados.update(retry.call_with_retries(_registrar_lote, (bloque,), max_retries, delay))
         except pyodbc.Error as e:
-            attempts += 1
-            if attempts == max_retries:
-                return False, f"Error de base de datos después de {max_retries} intentos: {str(e)}"
-            time.sleep(delay)
-        except Exception as e:
-            return False, str(e)
+            return _resultado_lote(estados, bloques[i:], e)
+    return _resultado_lote(estados, [], None)
+
+async def register_usuarios_colaboradores_async(usuarios, max_retries=3, delay=None):
+    """Variante async de register_usuarios_colaboradores."""
+    db_pool.breaker.verificar()
+    try:
+        estados = await retry.call_with_retries_async(_estados_lote, ([u[0] for u in usuarios],), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos después de {max_retries} intentos: {str(e)}", None
+
+    pendientes = [u for u in usuarios if estados.get(u[0]) == "pendiente"]
+    filas = _filas_lote(pendientes, await contrasenas.hashear_lote_async([u[1] for u in pendientes]))
+
+    bloques = [filas[i:i + REGISTRO_LOTE_CHUNK_SIZE] for i in range(0, len(filas), REGISTRO_LOTE_CHUNK_SIZE)]
+    for i, bloque in enumerate(bloques):
+        try:
+            estados.update(await retry.call_with_retries_async(_registrar_lote, (bloque,), max_retries, delay))
+        except pyodbc.Error as e:
+            return _resultado_lote(estados, bloques[i:], e)
+    return _resultado_lote(estados, [], None)
+
+def _leer_registro(req):
+    """Extrae y valida los datos de registro. Devuelve ((rut, password, direccion, numero), None)
+    o (None, respuesta de error). El RUT se devuelve sin guión ni dígito verificador."""
+    datos, error = esquemas.REGISTRO.leer(req)
+    if error:
+        return None, error
+    return (datos['rut'], datos['password'], datos['direccion'], datos['numero']), None
+
+def _respuesta(success, message):
+    if success:
+        return esquemas.respuesta({"mensaje": message})
+    if message.startswith("Error de base de datos"):
+        # Falla transitoria tras los reintentos: 503 para que el cliente reintente (una
+        # respuesta 503 no queda guardada para su Idempotency-Key)
+        return esquemas.no_disponible(message)
+    return esquemas.error(message, 400)
+
+def _respuesta_ocupado(e):
+    if not isinstance(e, hash_pool.HashPoolFull):
+        logging.error(f"Falla del pool de hashing: {type(e).__name__}: {str(e)}")
+    return esquemas.no_disponible("Servicio ocupado, intente nuevamente")
+
+def _leer_registro_lote(req):
+    """Valida cada colaborador del lote por separado, solo para administradores. Devuelve
+    ((entradas, usuarios), None) o (None, respuesta de error). `entradas` conserva el orden
+    recibido como (rut recibido, rut normalizado o None, motivo del rechazo o None); `usuarios`
+    son los válidos y sin repetir, listos para register_usuarios_colaboradores."""
+    _, error = auth.admin_autenticado(req)
+    if error:
+        return None, error
+    datos, error = esquemas.REGISTRO_LOTE.leer(req)
+    if error:
+        return None, error
+    if len(datos['colaboradores']) > REGISTRO_LOTE_MAX:
+        return None, esquemas.error(_MENSAJE_MAXIMO_LOTE, 400)
+
+    entradas, usuarios, vistos = [], [], set()
+    for colaborador in datos['colaboradores']:
+        valido, mensaje = esquemas.REGISTRO.validar(colaborador)
+        if mensaje:
+            entradas.append((colaborador.get('rut'), None, mensaje))
+        elif valido['rut'] in vistos:
+            entradas.append((colaborador.get('rut'), valido['rut'], MENSAJES_LOTE["duplicado"]))
+        else:
+            vistos.add(valido['rut'])
+            entradas.append((colaborador.get('rut'), valido['rut'], None))
+            usuarios.append((valido['rut'], valido['password'], valido['direccion'], valido['numero']))
+    return (entradas, usuarios), None
+
+def _respuesta_lote(entradas, success, message, estados):
+    if not success:
+        # Solo falla la consulta inicial de estados, tras los reintentos: nada se registró
+        return esquemas.no_disponible(message)
+    resultados = []
+    for rut_recibido, rut, motivo in entradas:
+        if motivo:
+            estado = "duplicado" if rut else "invalido"
+        else:
+            estado = estados.get(rut, "error")
+            motivo = MENSAJES_LOTE[estado]
+        resultados.append({"rut": rut_recibido, "estado": estado, "mensaje": motivo})
+    return esquemas.respuesta({
+        "mensaje": message,
+        "registrados": sum(1 for r in resultados if r["estado"] == "registrado"),
+        "resultados": resultados
+    })
 
 def main_register(req: func.HttpRequest) -> func.HttpResponse:
     """Maneja la solicitud HTTP para el registro de usuario."""
     logging.info('Función HTTP de Python procesando una solicitud de registro.')
 
-    try:
-        req_body = req.get_json()
-    except ValueError:
-        return func.HttpResponse(
-            json.dumps({"error": "Cuerpo de solicitud inválido"}),
-            mimetype="application/json",
-            status_code=400
-        )
-
-    # Extraer datos del cuerpo de la solicitud
-    rut = req_body.get('rut')
-    password = req_body.get('password')
-    direccion = req_body.get('direccion')
-    numero = req_body.get('numero')
-
-    # Validar campos obligatorios
-    if not all([rut, password]):
-        return func.HttpResponse(
-            json.dumps({"error": "RUT y contraseña son campos obligatorios"}),
-            mimetype="application/json",
-            status_code=400
-        )
-
-    # Sanitizar entradas
-    rut = sanitize_input(rut)
-    password = sanitize_input(password)
-
-    # Validaciones
-    if not validate_rut(rut):
-        return func.HttpResponse(
-            json.dumps({"error": "Formato de RUT inválido"}),
-            mimetype="application/json",
-            status_code=400
-        )
-
-    if not validate_password(password):
-        return func.HttpResponse(
-            json.dumps({"error": "Formato de contraseña inválido. La contraseña debe tener al menos 8 caracteres, contener una letra mayúscula, una minúscula y un número."}),
-            mimetype="application/json",
-            status_code=400
-        )
-
-    # Limpiar RUT (solo números, sin guión ni dígito verificador)
-    rut_limpio = clean_rut(rut)
+    with timing.span("validacion"):
+        datos, error = _leer_registro(req)
+    if error:
+        return error
 
     # Registrar usuario colaborador
-    success, message = register_usuario_colaborador(rut_limpio, password, direccion, numero)
+    try:
+        resultado = register_usuario_colaborador(*datos)
+    except hash_pool.NO_DISPONIBLE as e:
+        return _respuesta_ocupado(e)
+    except circuit_breaker.CircuitoAbierto as e:
+        return esquemas.no_disponible(esquemas.BASE_NO_DISPONIBLE, e.reintentar_en)
+    with timing.span("respuesta"):
+        return _respuesta(*resultado)
 
-    if success:
-        return func.HttpResponse(
-            json.dumps({"mensaje": message}),
-            mimetype="application/json",
-            status_code=200
-        )
-    else:
-        return func.HttpResponse(
-            json.dumps({"error": message}),
-            mimetype="application/json",
-            status_code=400
-        )
\ No newline at end of file
+async def main_register_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_register."""
+    logging.info('Función HTTP de Python procesando una solicitud de registro.')
+
+    with timing.span("validacion"):
+        datos, error = _leer_registro(req)
+    if error:
+        return error
+
+    try:
+        resultado = await register_usuario_colaborador_async(*datos)
+    except hash_pool.NO_DISPONIBLE as e:
+        return _respuesta_ocupado(e)
+    except circuit_breaker.CircuitoAbierto as e:
+        return esquemas.no_disponible(esquemas.BASE_NO_DISPONIBLE, e.reintentar_en)
+    with timing.span("respuesta"):
+        return _respuesta(*resultado)
+
+def main_register_lote(req: func.HttpRequest) -> func.HttpResponse:
+    """Maneja la solicitud HTTP para registrar varios colaboradores a la vez."""
+    with timing.span("validacion"):
+        datos, error = _leer_registro_lote(req)
+    if error:
+        return error
+    entradas, usuarios = datos
+
+    try:
+        resultado = register_usuarios_colaboradores(usuarios) if usuarios else (True, "Registro en lote completado", {})
+    except hash_pool.NO_DISPONIBLE as e:
+        return _respuesta_ocupado(e)
+    except circuit_breaker.CircuitoAbierto as e:
+        return esquemas.no_disponible(esquemas.BASE_NO_DISPONIBLE, e.reintentar_en)
+    with timing.span("respuesta"):
+        return _respuesta_lote(entradas, *resultado)
+
+async def main_register_lote_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_register_lote."""
+    with timing.span("validacion"):
+        datos, error = _leer_registro_lote(req)
+    if error:
+        return error
+    entradas, usuarios = datos
+
+    try:
+        resultado = (await register_usuarios_colaboradores_async(usuarios) if usuarios
+                     else (True, "Registro en lote completado", {}))
+    except hash_pool.NO_DISPONIBLE as e:
+        return _respuesta_ocupado(e)
+    except circuit_breaker.CircuitoAbierto as e:
+        return esquemas.no_disponible(esquemas.BASE_NO_DISPONIBLE, e.reintentar_en)
+    with timing.span("respuesta"):
+        return _respuesta_lote(entradas, *resultado)
@@ -0,0 +1,86 @@
+# retry.py
+
+import asyncio
+import contextvars
+import os
+import random
+import time
+from contextlib import contextmanager
+
+import pyodbc
+
+import async_support
+import db_pool
+import timing
+
+# Política de reintentos (variables de entorno opcionales)
+RETRY_BASE_DELAY = float(os.environ.get("RetryBaseDelaySeconds", "0.2"))   # primera espera
+RETRY_MAX_DELAY = float(os.environ.get("RetryMaxDelaySeconds", "2"))       # tope de cada espera
+RETRY_BACKOFF = os.environ.get("RetryBackoff", "exponential")              # exponential | fixed
+# Tiempo total que una solicitud puede dedicar a reintentos; 0 = sin límite
+RETRY_DEADLINE = float(os.environ.get("RetryDeadlineSeconds", "5"))
+
+_limite = contextvars.ContextVar("limite_reintentos", default=None)
+
+
+@contextmanager
+def presupuesto(segundos=None):
+    """Fija el plazo de la solicitud en curso: todas las llamadas con reintentos que haga
+    comparten el mismo presupuesto. function_app lo abre en cada trigger."""
+    segundos = RETRY_DEADLINE if segundos is None else segundos
+    token = _limite.set(time.monotonic() + segundos if segundos > 0 else None)
+    try:
+        yield
+    finally:
+        _limite.reset(token)
+
+
+def _espera(attempts, delay):
+    """Backoff exponencial con jitter completo: un valor al azar entre 0 y el tope del intento,
+    para que las solicitudes que fallaron juntas no reintenten juntas."""
+    delay = RETRY_BASE_DELAY if delay is None else delay
+    if RETRY_BACKOFF == "fixed":
+        return delay
+    return random.uniform(0, min(delay * (2 ** (attempts - 1)), RETRY_MAX_DELAY))
+
+
+def _hay_tiempo(espera):
+    limite = _limite.get()
+    return limite is None or time.monotonic() + espera < limite
+
+
+def call_with_retries(fn, args=(), max_retries=3, delay=None):
+    """Llama `fn(*args)` reintentando ante pyodbc.Error. Si se agotan los intentos, o la próxima
+    espera excede el plazo de la solicitud, relanza el último error. Los errores de la consulta
+    o de los datos (db_pool.es_transitorio) se relanzan sin reintentar, y con el circuit breaker
+    abierto db_pool lanza CircuitoAbierto, que tampoco se reintenta."""
+    attempts = 0
+    while True:
+        try:
+            return fn(*args)
+        except pyodbc.Error as e:
+            if not db_pool.es_transitorio(e):
+                raise
+            attempts += 1
+            espera = _espera(attempts, delay)
+            if attempts >= max_retries or not _hay_tiempo(espera):
+                raise
+            with timing.span("retry_sleep"):
+                time.sleep(espera)
+
+
+async def call_with_retries_async(fn, args=(), max_retries=3, delay=None):
+    """Variante async: `fn` corre en el executor y la espera entre intentos usa asyncio.sleep."""
+    attempts = 0
+    while True:
+        try:
+            return await async_support.run_blocking(fn, *args)
+        except pyodbc.Error as e:
+            if not db_pool.es_transitorio(e):
+                raise
+            attempts += 1
+            espera = _espera(attempts, delay)
+            if attempts >= max_retries or not _hay_tiempo(espera):
+                raise
+            with timing.span("retry_sleep"):
+                await asyncio.sleep(espera)
@@ -0,0 +1,403 @@
+# sms_outbox.py
+#
+# Outbox de los SMS de recuperación: el handler encola y un despachador en segundo plano envía,
+# con reintentos y backoff. Solo se reclaman en lote (ReclamarSms toma SmsBatchSize mensajes con
+# un lease): cada mensaje se envía con su propia llamada a ACS, que solo agrupa destinatarios de
+# un mismo texto, y cada código es distinto. Al enviarse o descartarse un mensaje se borra su
+# texto (lleva el código), y la purga (timer_sms_outbox) borra las filas cerradas tras
+# SmsPurgaHoras.
+#
+# El SMS del código se reserva retenido (Estado R: ocupa el throttle pero el despachador no lo
+# reclama) y se libera recién cuando el código quedó guardado; si no se guardó, se cancela y
+# libera el throttle. Así nunca sale un código que no está en el almacén.
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import db_pool
+
+# Configuración del outbox de SMS (variables de entorno opcionales)
+SMS_OUTBOX_STORE = os.environ.get("SmsOutboxStore", "sql")        # sql | memory
+SMS_SENDER = os.environ.get("SmsSender", "acs")                   # acs | fake
+SMS_BATCH_SIZE = int(os.environ.get("SmsBatchSize", "20"))
+SMS_MAX_ATTEMPTS = int(os.environ.get("SmsMaxAttempts", "5"))
+SMS_BACKOFF_SECONDS = float(os.environ.get("SmsBackoffSeconds", "2"))
+SMS_BACKOFF_MAX_SECONDS = float(os.environ.get("SmsBackoffMaxSeconds", "300"))
+SMS_THROTTLE_SECONDS = int(os.environ.get("SmsThrottleSeconds", "60"))   # un SMS por teléfono por ventana
+SMS_LEASE_SECONDS = int(os.environ.get("SmsLeaseSeconds", "60"))
+SMS_POLL_SECONDS = float(os.environ.get("SmsPollSeconds", "1"))
+# Antigüedad de los mensajes enviados o fallidos que se purgan; debe superar la ventana del
+# throttle, que se calcula sobre las filas del outbox
+SMS_PURGA_HORAS = int(os.environ.get("SmsPurgaHoras", "24"))
+SMS_PURGA_LOTE = int(os.environ.get("SmsPurgaLote", "5000"))
+#Reemplaza "tu_connection_string_de_communication_services" con el connection string real de Azure Communication Services
+COMMUNICATION_CONNECTION_STRING = os.environ.get("CommunicationServicesConnectionString", "tu_connection_string_de_communication_services")
+#Reemplaza "+tu_numero_de_sender" con el número de teléfono real que obtuviste de Azure Communication Services
+SMS_FROM_NUMBER = os.environ.get("SmsFromNumber", "+tu_numero_de_sender")
+
+
+class Mensaje:
+    __slots__ = ("id", "telefono", "texto", "intentos")
+
+    def __init__(self, id, telefono, texto, intentos):
+        self.id = id
+        self.telefono = telefono
+        self.texto = texto
+        self.intentos = intentos
+
+
+def _demora_reintento(intentos):
+    """Backoff exponencial entre reintentos de envío."""
+    return min(SMS_BACKOFF_SECONDS * (2 ** (intentos - 1)), SMS_BACKOFF_MAX_SECONDS)
+
+
+# --- Almacenes ---------------------------------------------------------------
+
+class SqlOutboxStore:
+    """Outbox durable en la tabla SmsOutbox: sobrevive al reciclaje de la instancia."""
+
+    def encolar(self, telefono, texto, ventana=SMS_THROTTLE_SECONDS, retenido=False):
+        """Devuelve el Id del mensaje, o None si el teléfono ya recibió uno dentro de la ventana.
+        Un mensaje `retenido` no se envía hasta liberarlo."""
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("{CALL EncolarSms(?, ?, ?, ?)}", (telefono, texto, ventana, int(retenido)))
+            row = cursor.fetchone()
+            conn.commit()
+            return row.Id if row and row.Id is not None else None
+
+    def liberar(self, id):
+        self._ejecutar("{CALL LiberarSms(?)}", (id,))
+
+    def cancelar(self, id, error):
+        # Un fallido no cuenta para el throttle de EncolarSms
+        self.marcar_fallido(id, error)
+
+    def reclamar(self, limite, lease=SMS_LEASE_SECONDS):
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("{CALL ReclamarSms(?, ?)}", (limite, lease))
+            mensajes = [Mensaje(r.Id, r.Telefono, r.Mensaje, r.Intentos) for r in cursor.fetchall()]
+            conn.commit()
+            return mensajes
+
+    def marcar_enviado(self, id):
+        self._ejecutar("{CALL MarcarSmsEnviado(?)}", (id,))
+
+    def reprogramar(self, id, demora, error):
+        self._ejecutar("{CALL ReprogramarSms(?, ?, ?)}", (id, int(demora), error[:400]))
+
+    def marcar_fallido(self, id, error):
+        self._ejecutar("{CALL MarcarSmsFallido(?, ?)}", (id, error[:400]))
+
+    def purgar(self, horas, lote):
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("{CALL PurgarSmsOutbox(?, ?)}", (horas, lote))
+            row = cursor.fetchone()
+            conn.commit()
+            return row.Borrados if row else 0
+
+    def _ejecutar(self, sql, params):
+        with db_pool.connection() as conn:
+            conn.cursor().execute(sql, params)
+            conn.commit()
+
+
+class MemoryOutboxStore:
+    """Outbox en memoria, para desarrollo y pruebas locales (no es durable)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mensajes = OrderedDict()
+        self._ultimo_envio = {}
+        self._siguiente_id = 1
+
+    def encolar(self, telefono, texto, ventana=SMS_THROTTLE_SECONDS, retenido=False):
+        ahora = time.time()
+        with self._lock:
+            ultimo = self._ultimo_envio.get(telefono)
+            if ultimo is not None and ahora - ultimo < ventana:
+                return None
+            self._ultimo_envio[telefono] = ahora
+            if len(self._ultimo_envio) > 10000:
+                # Mantener acotada la memoria del throttle: olvidar teléfonos fuera de la ventana
+                self._ultimo_envio = {t: u for t, u in self._ultimo_envio.items() if ahora - u < ventana}
+            id = self._siguiente_id
+            self._siguiente_id += 1
+            self._mensajes[id] = {"telefono": telefono, "texto": texto, "estado": "R" if retenido else "P",
+                                  "intentos": 0, "proximo": ahora, "error": None, "creado": ahora}
+            return id
+
+    def liberar(self, id):
+        with self._lock:
+            m = self._mensajes[id]
+            if m["estado"] == "R":
+                m["estado"] = "P"
+                m["proximo"] = time.time()
+
+    def cancelar(self, id, error):
+        with self._lock:
+            m = self._mensajes[id]
+            m["estado"] = "F"
+            m["texto"] = ""
+            m["error"] = error
+            # Igual que en EncolarSms, el mensaje cancelado no ocupa el throttle
+            if self._ultimo_envio.get(m["telefono"]) == m["creado"]:
+                del self._ultimo_envio[m["telefono"]]
+
+    def reclamar(self, limite, lease=SMS_LEASE_SECONDS):
+        ahora = time.time()
+        reclamados = []
+        with self._lock:
+            for id, m in self._mensajes.items():
+                if len(reclamados) >= limite:
+                    break
+                if m["estado"] == "P" and m["proximo"] <= ahora:
+                    m["intentos"] += 1
+                    m["proximo"] = ahora + lease
+                    reclamados.append(Mensaje(id, m["telefono"], m["texto"], m["intentos"]))
+        return reclamados
+
+    def marcar_enviado(self, id):
+        with self._lock:
+            # Los mensajes enviados no se conservan: solo importa el throttle por teléfono
+            self._mensajes.pop(id, None)
+
+    def reprogramar(self, id, demora, error):
+        with self._lock:
+            m = self._mensajes[id]
+            m["proximo"] = time.time() + demora
+            m["error"] = error
+
+    def marcar_fallido(self, id, error):
+        with self._lock:
+            m = self._mensajes[id]
+            m["estado"] = "F"
+            m["texto"] = ""
+            m["error"] = error
+
+    def purgar(self, horas, lote):
+        limite = time.time() - horas * 3600
+        with self._lock:
+            # Los enviados ya se quitaron al marcarlos: quedan los fallidos y los retenidos que
+            # nunca se liberaron
+            viejos = [id for id, m in self._mensajes.items()
+                      if m["estado"] in ("F", "R") and m["creado"] < limite][:lote]
+            for id in viejos:
+                del self._mensajes[id]
+            return len(viejos)
+
+    def pendientes(self):
+        with self._lock:
+            return sum(1 for m in self._mensajes.values() if m["estado"] == "P")
+
+
+# --- Emisores ----------------------------------------------------------------
+
+class AcsSmsSender:
+    """Envía con Azure Communication Services reutilizando un único SmsClient."""
+
+    def __init__(self, connection_string=COMMUNICATION_CONNECTION_STRING, from_number=SMS_FROM_NUMBER):
+        self.connection_string = connection_string
+        self.from_number = from_number
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from azure.communication.sms import SmsClient
+                    self._client = SmsClient.from_connection_string(self.connection_string)
+        return self._client
+
+    def enviar(self, telefono, texto):
+        """Lanza una excepción si el proveedor no acepta el mensaje."""
+        resultados = self._get_client().send(from_=self.from_number, to=telefono, message=texto)
+        for resultado in resultados:
+            if not getattr(resultado, "successful", True):
+                raise RuntimeError(getattr(resultado, "error_message", None) or "Envío rechazado")
+
+
+class FakeSmsSender:
+    """Emisor local: guarda los mensajes en memoria. `fallos` hace fallar los primeros N envíos."""
+
+    def __init__(self, fallos=0):
+        self.enviados = []
+        self.fallos = fallos
+        self._lock = threading.Lock()
+
+    def enviar(self, telefono, texto):
+        with self._lock:
+            if self.fallos > 0:
+                self.fallos -= 1
+                raise RuntimeError("Falla simulada del proveedor de SMS")
+            self.enviados.append((telefono, texto))
+
+
+# --- Despachador -------------------------------------------------------------
+
+class Dispatcher:
+    """Toma lotes del outbox y los envía en segundo plano, con reintentos y backoff."""
+
+    def __init__(self, store, sender, batch_size=SMS_BATCH_SIZE, max_attempts=SMS_MAX_ATTEMPTS,
+                 poll_seconds=SMS_POLL_SECONDS):
+        self.store = store
+        self.sender = sender
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+        self._lock = threading.Lock()
+        # drenar() corre en el hilo despachador y en el timer a la vez
+        self._contadores_lock = threading.Lock()
+        self.enviados = 0
+        self.reintentos = 0
+        self.fallidos = 0
+
+    def drenar(self, max_lotes=None):
+        """Envía lotes hasta vaciar lo pendiente (o `max_lotes`). Devuelve cuántos mensajes procesó."""
+        procesados = 0
+        lotes = 0
+        while max_lotes is None or lotes < max_lotes:
+            mensajes = self.store.reclamar(self.batch_size)
+            if not mensajes:
+                break
+            lotes += 1
+            for mensaje in mensajes:
+                self._enviar(mensaje)
+                procesados += 1
+        return procesados
+
+    def _enviar(self, mensaje):
+        try:
+            self.sender.enviar(mensaje.telefono, mensaje.texto)
+        except Exception as e:
+            error = str(e)
+            if mensaje.intentos >= self.max_attempts:
+                logging.error(f"SMS {mensaje.id} descartado tras {mensaje.intentos} intentos: {error}")
+                self.store.marcar_fallido(mensaje.id, error)
+                with self._contadores_lock:
+                    self.fallidos += 1
+            else:
+                logging.warning(f"Error enviando SMS {mensaje.id}, se reintentará: {error}")
+                self.store.reprogramar(mensaje.id, _demora_reintento(mensaje.intentos), error)
+                with self._contadores_lock:
+                    self.reintentos += 1
+            return
+        self.store.marcar_enviado(mensaje.id)
+        with self._contadores_lock:
+            self.enviados += 1
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                self.drenar()
+            except Exception as e:
+                logging.error(f"Error en el despachador de SMS: {str(e)}")
+            self._despertar.wait(self.poll_seconds)
+            self._despertar.clear()
+
+    def iniciar(self):
+        """Arranca el hilo despachador si aún no está corriendo."""
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._detener.clear()
+                self._hilo = threading.Thread(target=self._bucle, name="sms-outbox", daemon=True)
+                self._hilo.start()
+
+    def notificar(self):
+        """Despierta al despachador para que envíe sin esperar al próximo sondeo."""
+        self._despertar.set()
+
+    def detener(self, timeout=5):
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    def stats(self):
+        with self._contadores_lock:
+            return {"enviados": self.enviados, "reintentos": self.reintentos, "fallidos": self.fallidos}
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def configurar(store=None, sender=None, **opciones):
+    """Reemplaza el despachador compartido (por ejemplo, con MemoryOutboxStore y FakeSmsSender)."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is not None:
+            _dispatcher.detener()
+        if store is None:
+            store = MemoryOutboxStore() if SMS_OUTBOX_STORE == "memory" else SqlOutboxStore()
+        if sender is None:
+            sender = FakeSmsSender() if SMS_SENDER == "fake" else AcsSmsSender()
+        _dispatcher = Dispatcher(store, sender, **opciones)
+        return _dispatcher
+
+
+def get_dispatcher():
+    if _dispatcher is None:
+        configurar()
+    return _dispatcher
+
+
+def encolar_codigo(telefono, code):
+    """Encola el SMS con el código y despierta al despachador. Devuelve (success, message)."""
+    dispatcher = get_dispatcher()
+    texto = f"Tu código de recuperación de contraseña es: {code}"
+    if dispatcher.store.encolar(telefono, texto) is None:
+        return False, "Ya se envió un código a este teléfono, espere antes de solicitar otro"
+    dispatcher.iniciar()
+    dispatcher.notificar()
+    return True, "SMS encolado"
+
+
+def reservar_codigo(telefono, code):
+    """Encola retenido el SMS con el código, para liberarlo una vez guardado el código.
+    Devuelve (Id del mensaje, message), con Id None si el throttle lo rechaza."""
+    texto = f"Tu código de recuperación de contraseña es: {code}"
+    id = get_dispatcher().store.encolar(telefono, texto, retenido=True)
+    if id is None:
+        return None, "Ya se envió un código a este teléfono, espere antes de solicitar otro"
+    return id, "SMS reservado"
+
+
+def liberar(id):
+    """Deja enviar el SMS reservado y despierta al despachador."""
+    dispatcher = get_dispatcher()
+    dispatcher.store.liberar(id)
+    dispatcher.iniciar()
+    dispatcher.notificar()
+
+
+def cancelar(id, error="El código no se guardó"):
+    """Descarta el SMS reservado sin enviarlo; deja de ocupar el throttle del teléfono."""
+    get_dispatcher().store.cancelar(id, error)
+
+
+def drenar():
+    """Envía lo pendiente en el outbox; lo usa el timer trigger para recoger mensajes huérfanos."""
+    return get_dispatcher().drenar()
+
+
+def purgar(horas=SMS_PURGA_HORAS, lote=SMS_PURGA_LOTE):
+    """Borra los mensajes enviados, fallidos o retenidos sin liberar de hace más de `horas`, en
+    lotes de `lote`.
+    Devuelve cuántos borró."""
+    store = get_dispatcher().store
+    total = 0
+    while True:
+        borrados = store.purgar(horas, lote)
+        total += borrados
+        if borrados < lote:
+            return total
@@ -0,0 +1,217 @@
+# timing.py
+#
+# Medición por fases de cada solicitud HTTP. Fases registradas por los módulos:
+#   validacion    lectura del cuerpo, sanitize_input y validaciones
+#   auth          verificación del token Bearer
+#   rate_limit    límites de intentos de login
+#   db_checkout   obtener una conexión del pool (incluye db_connect si hubo que abrirla)
+#   db_connect    pyodbc.connect de una conexión nueva
+#   db_query      cursor.execute + fetch/commit
+#   hash_cola     espera en la cola del pool de hashing
+#   scrypt        cálculo del hash
+#   jwt           firma del token
+#   retry_sleep   esperas entre reintentos
+#   sms_encolar   encolar el SMS de recuperación en el outbox
+#   respuesta     construcción y serialización JSON de la respuesta
+# Las fases anidadas (db_connect dentro de db_checkout, jwt dentro de respuesta) se reportan
+# por separado, por lo que su suma puede superar el total.
+
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+# RequestTiming=1 activa la medición por fases. Desactivada, span() devuelve un context
+# manager vacío compartido y medir() llama al handler directamente.
+ENABLED = os.environ.get("RequestTiming", "0") == "1"
+# Cabecera Server-Timing en las respuestas (solo si la medición está activa)
+SERVER_TIMING_HEADER = os.environ.get("ServerTimingHeader", "1") == "1"
+
+# Límites superiores (ms) de los buckets de los histogramas
+BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+_actual = contextvars.ContextVar("medicion_actual", default=None)
+
+
+class _Nulo:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULO = _Nulo()
+
+
+class Histograma:
+    """Histograma de latencias con buckets fijos; permite estimar percentiles sin guardar muestras."""
+
+    def __init__(self):
+        self.conteos = [0] * (len(BUCKETS_MS) + 1)
+        self.total = 0
+        self.suma_ms = 0.0
+        self.max_ms = 0.0
+
+    def registrar(self, ms):
+        self.conteos[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.total += 1
+        self.suma_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentil(self, p):
+        """Límite superior del bucket que contiene el percentil `p`."""
+        if not self.total:
+            return 0.0
+        objetivo = self.total * p / 100
+        acumulado = 0
+        for i, n in enumerate(self.conteos):
+            acumulado += n
+            if acumulado >= objetivo:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def resumen(self):
+        return {
+            "conteo": self.total,
+            "media_ms": self.suma_ms / self.total if self.total else 0.0,
+            "p50_ms": self.percentil(50),
+            "p95_ms": self.percentil(95),
+            "p99_ms": self.percentil(99),
+            "max_ms": self.max_ms,
+        }
+
+
+_histogramas = {}
+_histogramas_lock = threading.Lock()
+
+
+def _registrar(ruta, fase, ms):
+    clave = (ruta, fase)
+    with _histogramas_lock:
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            histograma = _histogramas[clave] = Histograma()
+        histograma.registrar(ms)
+
+
+def registrar(ruta, fase, ms):
+    """Registra en los histogramas una medición hecha fuera de una solicitud HTTP (p. ej. en un
+    timer). Se registra aunque RequestTiming esté desactivado."""
+    _registrar(ruta, fase, ms)
+
+
+class _Span:
+    __slots__ = ("medicion", "fase", "inicio")
+
+    def __init__(self, medicion, fase):
+        self.medicion = medicion
+        self.fase = fase
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.medicion.agregar(self.fase, (time.perf_counter() - self.inicio) * 1000)
+        return False
+
+
+class Medicion:
+    """Tiempos acumulados por fase de una solicitud."""
+
+    __slots__ = ("ruta", "inicio", "fases")
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.inicio = time.perf_counter()
+        self.fases = {}
+
+    def agregar(self, fase, ms):
+        # Una fase puede repetirse (p. ej. reintentos): se acumula
+        self.fases[fase] = self.fases.get(fase, 0.0) + ms
+
+    def cerrar(self, resp):
+        total_ms = (time.perf_counter() - self.inicio) * 1000
+        for fase, ms in self.fases.items():
+            _registrar(self.ruta, fase, ms)
+        _registrar(self.ruta, "total", total_ms)
+
+        status = getattr(resp, "status_code", None)
+        logging.info(json.dumps({
+            "evento": "timing",
+            "ruta": self.ruta,
+            "status": status,
+            "total_ms": round(total_ms, 3),
+            "fases": {fase: round(ms, 3) for fase, ms in self.fases.items()},
+        }))
+        if SERVER_TIMING_HEADER and resp is not None:
+            partes = [f"{fase};dur={ms:.2f}" for fase, ms in self.fases.items()]
+            partes.append(f"total;dur={total_ms:.2f}")
+            resp.headers["Server-Timing"] = ", ".join(partes)
+
+
+def span(fase):
+    """Mide una fase de la solicitud en curso: `with timing.span("db_query"): ...`."""
+    if not ENABLED:
+        return _NULO
+    medicion = _actual.get()
+    if medicion is None:
+        return _NULO
+    return _Span(medicion, fase)
+
+
+def agregar(fase, ms):
+    """Suma a la solicitud en curso una fase medida por otros medios (p. ej. en otro proceso)."""
+    if not ENABLED:
+        return
+    medicion = _actual.get()
+    if medicion is not None:
+        medicion.agregar(fase, ms)
+
+
+def medir(ruta, handler, req):
+    """Ejecuta el handler midiendo sus fases y agrega Server-Timing a la respuesta."""
+    if not ENABLED:
+        return handler(req)
+    medicion = Medicion(ruta)
+    token = _actual.set(medicion)
+    try:
+        resp = handler(req)
+    finally:
+        _actual.reset(token)
+    medicion.cerrar(resp)
+    return resp
+
+
+async def medir_async(ruta, handler, req):
+    """Variante async de medir."""
+    if not ENABLED:
+        return await handler(req)
+    medicion = Medicion(ruta)
+    token = _actual.set(medicion)
+    try:
+        resp = await handler(req)
+    finally:
+        _actual.reset(token)
+    medicion.cerrar(resp)
+    return resp
+
+
+def histogramas():
+    """Resumen de los histogramas por ruta y fase."""
+    with _histogramas_lock:
+        resultado = {}
+        for (ruta, fase), histograma in sorted(_histogramas.items()):
+            resultado.setdefault(ruta, {})[fase] = histograma.resumen()
+        return resultado
+
+
+def reiniciar():
+    with _histogramas_lock:
+        _histogramas.clear()
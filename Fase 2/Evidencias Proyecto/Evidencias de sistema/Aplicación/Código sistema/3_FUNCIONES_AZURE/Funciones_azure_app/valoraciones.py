@@ -0,0 +1,463 @@
+# valoraciones.py
+#
+# Valoraciones de las conversaciones del chatbot (tabla Valoraciones), con escritura diferida:
+# main_valorar solo valida y deja la valoración en un buffer en memoria (responde 202), y un
+# hilo la escribe en lotes con RegistrarValoracionesLote (un parámetro tabla por lote):
+#   - apenas se juntan ValoracionesBatchSize, o
+#   - cada ValoracionesFlushSeconds (lo que espere una valoración antes de llegar a SQL), y
+#   - al terminar el proceso de forma ordenada (atexit) o al reemplazar el buffer.
+#
+# Durabilidad:
+#   - un lote que falla (tras los reintentos de retry.py) vuelve al inicio del buffer y se
+#     reintenta en el próximo vaciado; si el buffer llega a ValoracionesMaxPendientes la ruta
+#     responde 503 en vez de descartar valoraciones
+#   - cada valoración lleva una Clave (uuid) asignada al recibirla: si se pierde la
+#     confirmación de un lote que sí se guardó, el reintento no la duplica (migración 4)
+#   - lo que esté en el buffer si el proceso muere sin apagarse se pierde: a lo más
+#     ValoracionesFlushSeconds de valoraciones de esa instancia
+#
+# Resumen: ValoracionesResumen guarda cantidad, suma y distribución por día y usuario, y
+# RegistrarValoracionesLote lo actualiza en la misma transacción con solo las filas que
+# insertó. El panel (main_resumen) lee esa tabla; nunca recorre Valoraciones.
+#
+# El almacén se elige con ValoracionesStore:
+#   sql     tablas Valoraciones y ValoracionesResumen
+#   memory  en memoria del proceso, con el mismo resumen incremental: para desarrollo local
+
+import atexit
+import datetime
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+import azure.functions as func
+import pyodbc
+
+import auth
+import circuit_breaker
+import db_pool
+import esquemas
+import retry
+import timing
+
+# Configuración (variables de entorno opcionales)
+VALORACIONES_STORE = os.environ.get("ValoracionesStore", "sql")         # sql | memory
+VALORACIONES_BATCH_SIZE = int(os.environ.get("ValoracionesBatchSize", "200"))
+VALORACIONES_FLUSH_SECONDS = float(os.environ.get("ValoracionesFlushSeconds", "5"))
+VALORACIONES_MAX_PENDIENTES = int(os.environ.get("ValoracionesMaxPendientes", "10000"))
+# Espera máxima por el hilo al apagar, antes del vaciado final
+VALORACIONES_SHUTDOWN_SECONDS = float(os.environ.get("ValoracionesShutdownSeconds", "10"))
+# Rango del panel: por defecto los últimos ValoracionesResumenDias días
+VALORACIONES_RESUMEN_DIAS = int(os.environ.get("ValoracionesResumenDias", "30"))
+VALORACIONES_RESUMEN_MAX_DIAS = int(os.environ.get("ValoracionesResumenMaxDias", "366"))
+
+_MENSAJE_PENDIENTES = "Demasiadas valoraciones pendientes, intente nuevamente"
+_MENSAJE_RANGO = f"Rango de fechas inválido (máximo {VALORACIONES_RESUMEN_MAX_DIAS} días)"
+
+# Una fila de ValoracionesTipo, en el orden de sus columnas
+Valoracion = namedtuple("Valoracion", ["clave", "usuario", "puntuacion", "comentario", "fecha"])
+
+
+def _ahora():
+    """Fecha de recepción en UTC sin zona, como GETDATE() en Azure SQL."""
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class Resumen:
+    """Cantidad, suma y distribución (puntuaciones 1 a 5) de un grupo de valoraciones. Dos
+    resúmenes se combinan sumando sus campos; el promedio se calcula al final."""
+
+    __slots__ = ("cantidad", "suma", "distribucion")
+
+    def __init__(self, cantidad=0, suma=0, distribucion=None):
+        self.cantidad = cantidad
+        self.suma = suma
+        self.distribucion = list(distribucion) if distribucion else [0] * 5
+
+    def agregar(self, puntuacion):
+        self.cantidad += 1
+        self.suma += puntuacion
+        self.distribucion[puntuacion - 1] += 1
+
+    def combinar(self, otro):
+        self.cantidad += otro.cantidad
+        self.suma += otro.suma
+        for i, n in enumerate(otro.distribucion):
+            self.distribucion[i] += n
+        return self
+
+    @property
+    def promedio(self):
+        return self.suma / self.cantidad if self.cantidad else None
+
+    def a_dict(self):
+        promedio = self.promedio
+        return {
+            "cantidad": self.cantidad,
+            "promedio": round(promedio, 3) if promedio is not None else None,
+            "distribucion": {str(i + 1): n for i, n in enumerate(self.distribucion)},
+        }
+
+    def __eq__(self, otro):
+        return (isinstance(otro, Resumen) and self.cantidad == otro.cantidad and self.suma == otro.suma
+                and self.distribucion == otro.distribucion)
+
+    def __repr__(self):
+        return f"Resumen({self.cantidad}, {self.suma}, {self.distribucion})"
+
+
+# --- Almacenes ---------------------------------------------------------------
+
+class SqlValoracionesStore:
+    """Valoraciones en la tabla Valoraciones y su resumen en ValoracionesResumen (migración 4)."""
+
+    def guardar(self, lote):
+        """Inserta el lote en una transacción (las que ya estaban, por Clave, se omiten) y
+        devuelve cuántas insertó."""
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("{CALL RegistrarValoracionesLote(?)}", (list(lote),))
+            row = cursor.fetchone()
+            conn.commit()
+            return row.Insertadas if row else 0
+
+    def resumen(self, desde, hasta, usuario=None):
+        """(total, {dia: Resumen}, {usuario: Resumen}) entre `desde` y `hasta` (inclusive). El
+        panel tolera el atraso de la réplica, así que se lee de ella si hay."""
+        with db_pool.lectura("valoraciones") as conn:
+            with timing.span("db_query"):
+                cursor = conn.cursor()
+                cursor.execute("{CALL ResumenValoraciones(?, ?, ?)}", (desde, hasta, usuario))
+                filas = cursor.fetchall()
+
+        total, por_dia, por_usuario = Resumen(), {}, {}
+        for row in filas:
+            parcial = Resumen(row.Cantidad or 0, row.Suma or 0,
+                              [row.P1 or 0, row.P2 or 0, row.P3 or 0, row.P4 or 0, row.P5 or 0])
+            if not row.TodosLosDias:
+                por_dia[row.Dia] = parcial
+            elif not row.TodosLosUsuarios:
+                por_usuario[row.Usuario] = parcial
+            else:
+                total = parcial
+        return total, por_dia, por_usuario
+
+
+class MemoryValoracionesStore:
+    """Valoraciones en memoria, para desarrollo y pruebas locales (no es durable). Mantiene el
+    mismo resumen incremental por día y usuario que ValoracionesResumen."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._claves = set()
+        self.valoraciones = []
+        self._resumen = {}   # (dia, usuario) -> Resumen
+
+    def guardar(self, lote):
+        insertadas = 0
+        with self._lock:
+            for valoracion in lote:
+                if valoracion.clave in self._claves:
+                    continue
+                self._claves.add(valoracion.clave)
+                self.valoraciones.append(valoracion)
+                clave = (valoracion.fecha.date(), valoracion.usuario)
+                self._resumen.setdefault(clave, Resumen()).agregar(valoracion.puntuacion)
+                insertadas += 1
+        return insertadas
+
+    def resumen(self, desde, hasta, usuario=None):
+        total, por_dia, por_usuario = Resumen(), {}, {}
+        with self._lock:
+            for (dia, rut), parcial in self._resumen.items():
+                if desde <= dia <= hasta and usuario in (None, rut):
+                    total.combinar(parcial)
+                    por_dia.setdefault(dia, Resumen()).combinar(parcial)
+                    por_usuario.setdefault(rut, Resumen()).combinar(parcial)
+        return total, por_dia, por_usuario
+
+
+# --- Buffer ------------------------------------------------------------------
+
+class Buffer:
+    """Valoraciones recibidas y aún no escritas. Un hilo las escribe en lotes de `tamano_lote`
+    cuando se junta un lote o cada `intervalo` segundos."""
+
+    def __init__(self, store, tamano_lote=VALORACIONES_BATCH_SIZE, intervalo=VALORACIONES_FLUSH_SECONDS,
+                 max_pendientes=VALORACIONES_MAX_PENDIENTES):
+        self.store = store
+        self.tamano_lote = tamano_lote
+        self.intervalo = intervalo
+        self.max_pendientes = max_pendientes
+        self._pendientes = []
+        self._lock = threading.Lock()
+        # Un vaciado a la vez: el hilo, el apagado y las llamadas directas no se pisan
+        self._vaciando = threading.Lock()
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo = None
+        self._hilo_lock = threading.Lock()
+        self.aceptadas = 0
+        self.rechazadas = 0
+        self.guardadas = 0
+        self.duplicadas = 0
+        self.lotes = 0
+        self.fallos = 0
+
+    def agregar(self, valoracion):
+        """Deja la valoración en el buffer. Devuelve False si ya hay `max_pendientes` sin escribir."""
+        with self._lock:
+            if len(self._pendientes) >= self.max_pendientes:
+                self.rechazadas += 1
+                return False
+            self._pendientes.append(valoracion)
+            self.aceptadas += 1
+            lleno = len(self._pendientes) >= self.tamano_lote
+        self.iniciar()
+        if lleno:
+            self._despertar.set()
+        return True
+
+    def pendientes(self):
+        with self._lock:
+            return len(self._pendientes)
+
+    def vaciar(self):
+        """Escribe lo pendiente, lote a lote, y devuelve cuántas valoraciones se insertaron. Si un
+        lote falla vuelve al inicio del buffer, en orden, y la excepción se propaga: lo ya
+        escrito queda escrito y el resto se reintenta en el próximo vaciado."""
+        insertadas = 0
+        with self._vaciando:
+            while True:
+                with self._lock:
+                    lote = self._pendientes[:self.tamano_lote]
+                    del self._pendientes[:self.tamano_lote]
+                if not lote:
+                    return insertadas
+                inicio = time.perf_counter()
+                try:
+                    n = retry.call_with_retries(self.store.guardar, (lote,))
+                except Exception:
+                    with self._lock:
+                        self._pendientes[:0] = lote
+                        self.fallos += 1
+                    raise
+                timing.registrar("valoraciones", "lote", (time.perf_counter() - inicio) * 1000)
+                with self._lock:
+                    self.lotes += 1
+                    self.guardadas += n
+                    self.duplicadas += len(lote) - n
+                insertadas += n
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            self._despertar.wait(self.intervalo)
+            self._despertar.clear()
+            try:
+                self.vaciar()
+            except Exception as e:
+                logging.error(f"Error escribiendo valoraciones ({self.pendientes()} pendientes): {str(e)}")
+                # Sin base de datos: no reintentar con cada lote que se complete
+                self._detener.wait(self.intervalo)
+
+    def iniciar(self):
+        """Arranca el hilo escritor si aún no está corriendo."""
+        with self._hilo_lock:
+            if not self._detener.is_set() and (self._hilo is None or not self._hilo.is_alive()):
+                self._hilo = threading.Thread(target=self._bucle, name="valoraciones", daemon=True)
+                self._hilo.start()
+
+    def detener(self, timeout=VALORACIONES_SHUTDOWN_SECONDS):
+        """Detiene el hilo y escribe lo que quede pendiente."""
+        self._detener.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+        try:
+            self.vaciar()
+        except Exception as e:
+            logging.error(f"Valoraciones sin escribir al detener el buffer: {self.pendientes()} ({str(e)})")
+
+    def stats(self):
+        with self._lock:
+            return {"pendientes": len(self._pendientes), "aceptadas": self.aceptadas,
+                    "rechazadas": self.rechazadas, "guardadas": self.guardadas,
+                    "duplicadas": self.duplicadas, "lotes": self.lotes, "fallos": self.fallos}
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def configurar(store=None, **opciones):
+    """Reemplaza el buffer compartido (por ejemplo, con MemoryValoracionesStore). El anterior
+    se detiene y escribe lo que tenía pendiente."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is not None:
+            _buffer.detener()
+        if store is None:
+            store = MemoryValoracionesStore() if VALORACIONES_STORE == "memory" else SqlValoracionesStore()
+        _buffer = Buffer(store, **opciones)
+        return _buffer
+
+
+def get_buffer():
+    if _buffer is None:
+        configurar()
+    return _buffer
+
+
+def _al_salir():
+    if _buffer is not None:
+        _buffer.detener()
+
+
+atexit.register(_al_salir)
+
+
+def stats():
+    return get_buffer().stats()
+
+
+# --- Servicio ----------------------------------------------------------------
+
+def valorar(valoracion):
+    """Deja la valoración en el buffer compartido. Devuelve (success, message)."""
+    if not get_buffer().agregar(valoracion):
+        return False, _MENSAJE_PENDIENTES
+    return True, "Valoración recibida"
+
+
+def _informe(desde, hasta, total, por_dia, por_usuario):
+    return {
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "total": total.a_dict(),
+        "por_dia": [{"dia": str(dia), **r.a_dict()} for dia, r in sorted(por_dia.items())],
+        "por_usuario": [{"usuario": rut, **r.a_dict()} for rut, r in sorted(por_usuario.items())],
+    }
+
+
+def resumen(desde, hasta, usuario=None, max_retries=3, delay=None):
+    """Totales, por día y por usuario entre `desde` y `hasta`, leídos del resumen incremental.
+    Devuelve (success, message, informe)."""
+    try:
+        partes = retry.call_with_retries(get_buffer().store.resumen, (desde, hasta, usuario), max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}", None
+    return True, "Resumen de valoraciones", _informe(desde, hasta, *partes)
+
+
+async def resumen_async(desde, hasta, usuario=None, max_retries=3, delay=None):
+    """Variante async de resumen."""
+    try:
+        partes = await retry.call_with_retries_async(get_buffer().store.resumen, (desde, hasta, usuario),
+                                                     max_retries, delay)
+    except pyodbc.Error as e:
+        return False, f"Error de base de datos: {str(e)}", None
+    return True, "Resumen de valoraciones", _informe(desde, hasta, *partes)
+
+
+# --- HTTP --------------------------------------------------------------------
+
+def _leer_valoracion(req):
+    """Valoración del cuerpo, a nombre del RUT del token (o del cuerpo si AuthRequired=0).
+    Devuelve (Valoracion, None) o (None, respuesta de error)."""
+    datos, error = esquemas.VALORACION.leer(req)
+    if error:
+        return None, error
+    rut, error = auth.rut_autenticado(req, datos['rut'])
+    if error:
+        return None, error
+
+    if not rut:
+        return None, esquemas.error(esquemas.VALORACION.faltantes, 400)
+    return Valoracion(str(uuid.uuid4()), str(rut), datos['puntuacion'], datos['comentario'] or None, _ahora()), None
+
+
+def _leer_solicitud_resumen(req):
+    """Rango y usuario del panel, solo para administradores. Devuelve ((desde, hasta, usuario), None)
+    o (None, respuesta de error)."""
+    _, error = auth.admin_autenticado(req)
+    if error:
+        return None, error
+    datos, error = esquemas.RESUMEN_VALORACIONES.leer(req)
+    if error:
+        return None, error
+    hasta = datos['hasta'] or _ahora().date()
+    desde = datos['desde'] or hasta - datetime.timedelta(days=VALORACIONES_RESUMEN_DIAS - 1)
+    if desde > hasta or (hasta - desde).days >= VALORACIONES_RESUMEN_MAX_DIAS:
+        return None, esquemas.error(_MENSAJE_RANGO, 400)
+    return (desde, hasta, datos['usuario'] or None), None
+
+
+def _respuesta(success, message):
+    if success:
+        return esquemas.respuesta({"mensaje": message}, 202)
+    return esquemas.no_disponible(message, VALORACIONES_FLUSH_SECONDS)
+
+
+def _respuesta_resumen(success, message, informe):
+    if success:
+        return esquemas.respuesta({"mensaje": message, **informe})
+    return esquemas.no_disponible(message)
+
+
+def _respuesta_excepcion(e):
+    if isinstance(e, circuit_breaker.CircuitoAbierto):
+        return esquemas.no_disponible(esquemas.BASE_NO_DISPONIBLE, e.reintentar_en)
+    if isinstance(e, (ValueError, KeyError, TypeError)):
+        return esquemas.error("Solicitud inválida: " + str(e), 400)
+    logging.error(f"Error no manejado: {str(e)}")
+    return esquemas.error("Error interno del servidor", 500)
+
+
+def main_valorar(req: func.HttpRequest) -> func.HttpResponse:
+    """Maneja la solicitud HTTP para valorar una conversación."""
+    try:
+        with timing.span("validacion"):
+            valoracion, error = _leer_valoracion(req)
+        if error:
+            return error
+        resultado = valorar(valoracion)
+        with timing.span("respuesta"):
+            return _respuesta(*resultado)
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+
+async def main_valorar_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_valorar: no hace E/S (la escritura es del hilo del buffer)."""
+    return main_valorar(req)
+
+
+def main_resumen(req: func.HttpRequest) -> func.HttpResponse:
+    """Maneja la solicitud HTTP del panel de valoraciones."""
+    try:
+        with timing.span("validacion"):
+            parametros, error = _leer_solicitud_resumen(req)
+        if error:
+            return error
+        resultado = resumen(*parametros)
+        with timing.span("respuesta"):
+            return _respuesta_resumen(*resultado)
+    except Exception as e:
+        return _respuesta_excepcion(e)
+
+
+async def main_resumen_async(req: func.HttpRequest) -> func.HttpResponse:
+    """Variante async de main_resumen."""
+    try:
+        with timing.span("validacion"):
+            parametros, error = _leer_solicitud_resumen(req)
+        if error:
+            return error
+        resultado = await resumen_async(*parametros)
+        with timing.span("respuesta"):
+            return _respuesta_resumen(*resultado)
+    except Exception as e:
+        return _respuesta_excepcion(e)